@@ -6,10 +6,17 @@ Run locally:
   python Api/algoritmia-api.py
 """
 
+import asyncio
+import sys
+
 from algoritmia_api.app import app  # FastAPI instance
 
 if __name__ == "__main__":
     import uvicorn
 
+    if sys.platform == "win32":
+        # psycopg's AsyncConnection can't run on the default Proactor loop
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+
     uvicorn.run(app, host="0.0.0.0", port=8000, reload=True)
 
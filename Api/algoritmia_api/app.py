@@ -1,5 +1,6 @@
 import os
 import time
+from contextlib import asynccontextmanager
 from threading import Lock
 from typing import Any, Dict, Optional
 import logging
@@ -9,9 +10,11 @@ logging.basicConfig(level=logging.INFO)
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from .routes import uploads
+from fastapi.staticfiles import StaticFiles
+from .routes import uploads, storage
 
-from . import db
+from . import db, db_async, scheduler, codeforces, passwords, audit_writer, image_processing, storage_gc, storage_backends, email_utils, email_sender
+from .image_uploads import UploadSizeLimitMiddleware
 from .tables import (
     users,
     contests,
@@ -22,14 +25,71 @@ from .tables import (
     password_reset_tokens,
     audit_logs,
     auth,
+    leaderboard,
+    storage_objects,
+    email_outbox,
 )
 
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One connection pool per worker process, shared by every router
+    db.open_pool()
+    await db_async.open_pool()
+    if os.getenv("DATABASE_URL"):
+        audit_writer.writer.start()
+        if email_sender.EMAIL_SENDER:
+            email_sender.sender.start()
+
+    jobs = []
+    if os.getenv("DATABASE_URL") and leaderboard.CF_RATINGS_SYNC_INTERVAL > 0:
+        jobs.append(
+            scheduler.start_periodic(
+                "cf_ratings_sync",
+                leaderboard.CF_RATINGS_SYNC_INTERVAL,
+                leaderboard.sync_ratings,
+                initial_delay=10,
+            )
+        )
+    if os.getenv("DATABASE_URL") and audit_logs.AUDIT_MAINTENANCE_INTERVAL > 0:
+        jobs.append(
+            scheduler.start_periodic(
+                "audit_logs_maintenance",
+                audit_logs.AUDIT_MAINTENANCE_INTERVAL,
+                audit_logs.maintain_partitions,
+                initial_delay=60,
+            )
+        )
+    if os.getenv("DATABASE_URL") and storage_gc.R2_GC_INTERVAL > 0:
+        jobs.append(
+            scheduler.start_periodic(
+                "r2_orphan_gc",
+                storage_gc.R2_GC_INTERVAL,
+                storage_gc.run_job,
+                initial_delay=300,
+            )
+        )
+    try:
+        yield
+    finally:
+        await scheduler.stop_all(jobs)
+        codeforces.close_client()
+        passwords.shutdown()
+        image_processing.shutdown()
+        email_sender.sender.stop()
+        email_utils.shutdown()
+        # Flush queued audit entries while the DB pool is still open
+        audit_writer.writer.stop()
+        await db_async.close_pool()
+        db.close_pool()
+
+
 def create_app() -> FastAPI:
     app = FastAPI(
         title="Algoritmia API",
         version=os.getenv("ALGORITMIA_API_VERSION", "0.1.0"),
         description="Backend endpoints for the Algoritmia website.",
+        lifespan=lifespan,
     )
 
     # ---- CORS (with credentials) ----
@@ -44,6 +104,9 @@ def create_app() -> FastAPI:
 
     allow_origins = list(dict.fromkeys(default_origins + extra_origins))
 
+    # Added before CORS so CORS wraps it and a 413 still carries the CORS headers
+    app.add_middleware(UploadSizeLimitMiddleware)
+
     app.add_middleware(
         CORSMiddleware,
         allow_origins=allow_origins,
@@ -80,7 +143,18 @@ def create_app() -> FastAPI:
     app.include_router(password_reset_tokens.router)
     app.include_router(audit_logs.router)
     app.include_router(auth.router)
+    app.include_router(leaderboard.router)
     app.include_router(uploads.router)
+    app.include_router(storage.router)
+
+    if storage_backends.STORAGE_BACKEND == "local":
+        # Dev storage: serve uploaded files from the API itself
+        os.makedirs(storage_backends.STORAGE_LOCAL_DIR, exist_ok=True)
+        app.mount(
+            storage_backends.local_mount_path(),
+            StaticFiles(directory=storage_backends.STORAGE_LOCAL_DIR),
+            name="storage",
+        )
 
     @app.post("/init")
     def initialize(force: bool = False) -> Dict[str, Any]:
@@ -102,6 +176,9 @@ def create_app() -> FastAPI:
                     ("password_reset_tokens", password_reset_tokens),
                     ("audit_logs", audit_logs),
                     ("auth", auth),
+                    ("leaderboard", leaderboard),
+                    ("storage_objects", storage_objects),
+                    ("email_outbox", email_outbox),
                 ]:
                     try:
                         mod.ensure_table(conn)
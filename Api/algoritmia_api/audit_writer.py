@@ -0,0 +1,261 @@
+"""
+Buffered audit log writer.
+
+add_audit_log() calls that aren't part of a route transaction are queued here
+and written by one background thread with COPY, every AUDIT_FLUSH_INTERVAL_MS
+or as soon as AUDIT_FLUSH_BATCH entries are waiting. The app lifespan starts
+the writer and flushes it on shutdown; when it isn't running (scripts) or the
+queue is full, entries are written synchronously instead.
+
+The same thread keeps the audit_log_daily_stats rollup: batches it writes are
+counted as they are flushed, and rows written inside route transactions only
+append to audit_log_stats_pending (no shared row to lock), which it folds into
+the rollup every AUDIT_STATS_FOLD_INTERVAL seconds.
+"""
+
+import os
+import time
+import queue
+import logging
+import threading
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Optional
+
+try:
+    import psycopg
+except Exception:  # pragma: no cover
+    psycopg = None
+
+from . import db
+
+logger = logging.getLogger("audit_writer")
+
+AUDIT_FLUSH_INTERVAL_MS = int(os.getenv("AUDIT_FLUSH_INTERVAL_MS", "250"))
+AUDIT_FLUSH_BATCH = int(os.getenv("AUDIT_FLUSH_BATCH", "500"))
+AUDIT_QUEUE_MAXSIZE = int(os.getenv("AUDIT_QUEUE_MAXSIZE", "10000"))
+AUDIT_FLUSH_RETRIES = int(os.getenv("AUDIT_FLUSH_RETRIES", "3"))
+AUDIT_STATS_FOLD_INTERVAL = float(os.getenv("AUDIT_STATS_FOLD_INTERVAL", "5"))  # seconds
+
+COLUMNS = ("actor_user_id", "action", "entity_table", "entity_id", "metadata", "created_at")
+
+COPY_SQL = f"COPY audit_logs ({', '.join(COLUMNS)}) FROM STDIN"
+
+INSERT_SQL = f"""
+    INSERT INTO audit_logs({', '.join(COLUMNS)})
+    VALUES (%s,%s,%s,%s,%s::jsonb,%s)
+"""
+
+# One queued entry: values in COLUMNS order (metadata already JSON-encoded)
+Entry = tuple[Optional[int], str, Optional[str], Optional[int], Optional[str], datetime]
+
+
+def make_entry(
+    actor_user_id: Optional[int],
+    action: str,
+    entity_table: Optional[str],
+    entity_id: Optional[int],
+    json_metadata: Optional[str],
+) -> Entry:
+    # Stamp the time now, not when the batch is flushed
+    return (actor_user_id, action, entity_table, entity_id, json_metadata, datetime.now(timezone.utc))
+
+
+# Daily rollup, bumped by the writer thread for the batches it flushes
+BUMP_STATS_SQL = """
+    INSERT INTO audit_log_daily_stats(day, action, actor_user_id, count)
+    VALUES (%s, %s, %s, %s)
+    ON CONFLICT (day, action, actor_user_id)
+    DO UPDATE SET count = audit_log_daily_stats.count + EXCLUDED.count
+"""
+
+
+# Route transactions only append here, so concurrent ones never wait on a rollup row
+# (e.g. the actor 0 row every anonymous login / signup would otherwise update)
+PENDING_STATS_SQL = """
+    INSERT INTO audit_log_stats_pending(day, action, actor_user_id)
+    VALUES (%s, %s, %s)
+"""
+
+# Move the pending counts into the rollup. Concurrent folds (one per worker process)
+# can't count a row twice: the second DELETE skips rows the first one removed.
+FOLD_STATS_SQL = """
+    WITH moved AS (
+        DELETE FROM audit_log_stats_pending
+        RETURNING day, action, actor_user_id
+    )
+    INSERT INTO audit_log_daily_stats(day, action, actor_user_id, count)
+    SELECT day, action, actor_user_id, COUNT(*)
+    FROM moved
+    GROUP BY day, action, actor_user_id
+    ORDER BY day, action, actor_user_id
+    ON CONFLICT (day, action, actor_user_id)
+    DO UPDATE SET count = audit_log_daily_stats.count + EXCLUDED.count
+"""
+
+
+def _stats_key(entry: Entry) -> tuple:
+    return (entry[5].astimezone(timezone.utc).date(), entry[1], entry[0] or 0)
+
+
+def bump_stats(conn, entries: list[Entry]) -> None:
+    """Add `entries` to audit_log_daily_stats (not committed)."""
+    counts = Counter(_stats_key(e) for e in entries)
+    with conn.cursor() as cur:
+        # sorted keys: concurrent flushes lock rollup rows in the same order
+        cur.executemany(BUMP_STATS_SQL, [(*key, n) for key, n in sorted(counts.items())])
+
+
+def count_later(conn, entries: list[Entry]) -> None:
+    """Leave `entries` for the next fold_stats() (not committed); for route transactions."""
+    with conn.cursor() as cur:
+        cur.executemany(PENDING_STATS_SQL, [_stats_key(e) for e in entries])
+
+
+def fold_stats(conn) -> int:
+    """Fold audit_log_stats_pending into audit_log_daily_stats and commit. Returns rollup rows touched."""
+    with conn.cursor() as cur:
+        cur.execute(FOLD_STATS_SQL)
+        touched = cur.rowcount
+    conn.commit()
+    return touched
+
+
+def insert_entry(conn, entry: Entry) -> None:
+    """INSERT one entry and leave it to be counted (not committed)."""
+    db.execute(conn, INSERT_SQL, list(entry), commit=False)
+    count_later(conn, [entry])
+
+
+def write_entries(conn, entries: list[Entry]) -> None:
+    """COPY a batch into audit_logs on `conn` and count it (not committed)."""
+    with conn.cursor() as cur:
+        with cur.copy(COPY_SQL) as copy:
+            for entry in entries:
+                copy.write_row(entry)
+    bump_stats(conn, entries)
+
+
+def _drop_missing_actors(conn, entries: list[Entry]) -> list[Entry]:
+    """
+    Users deleted while their entries were queued would fail the FK; store those
+    with actor_user_id NULL, which is what ON DELETE SET NULL would have done.
+    """
+    ids = list({e[0] for e in entries if e[0] is not None})
+    existing = {r["id"] for r in db.fetchall(conn, "SELECT id FROM users WHERE id = ANY(%s)", [ids])}
+    return [e if e[0] is None or e[0] in existing else (None,) + e[1:] for e in entries]
+
+
+class AuditWriter:
+    def __init__(self, flush_interval: float, batch_size: int, maxsize: int):
+        self.flush_interval = flush_interval
+        self.batch_size = max(1, batch_size)
+        self._queue: "queue.Queue[Entry]" = queue.Queue(maxsize=maxsize)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+        self._thread.start()
+        logger.info(
+            "Audit writer started (every %sms or %s entries)",
+            int(self.flush_interval * 1000), self.batch_size,
+        )
+
+    def stop(self, timeout: float = 10) -> None:
+        """Stop accepting work and flush whatever is still queued."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logger.error("Audit writer did not finish flushing within %ss", timeout)
+        self._thread = None
+
+    def submit(self, entry: Entry) -> bool:
+        """Queue an entry. False if the writer isn't running or the queue is full."""
+        if not self.running or self._stop.is_set():
+            return False
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            logger.warning("Audit queue full; writing entry synchronously")
+            return False
+        return True
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def _take_batch(self, wait: float) -> list[Entry]:
+        batch: list[Entry] = []
+        deadline = time.monotonic() + wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _fold_stats(self) -> None:
+        try:
+            with db.connect() as conn:
+                fold_stats(conn)
+        except Exception:
+            logger.exception("Folding pending audit stats failed")
+
+    def _run(self) -> None:
+        carry: list[Entry] = []
+        failures = 0
+        next_fold = time.monotonic() + AUDIT_STATS_FOLD_INTERVAL
+        while True:
+            stopping = self._stop.is_set()
+            batch = carry + self._take_batch(0 if stopping else self.flush_interval)
+            carry = []
+            if batch:
+                try:
+                    self._flush(batch)
+                    failures = 0
+                except Exception:
+                    failures += 1
+                    logger.exception("Audit flush of %s entries failed (attempt %s)", len(batch), failures)
+                    if failures < AUDIT_FLUSH_RETRIES and not stopping:
+                        carry = batch
+                        time.sleep(min(2 ** failures, 10))
+                    else:
+                        # Give up on this batch, but leave a trace of every entry in the logs
+                        for entry in batch:
+                            logger.error("Dropped audit entry: %r", entry)
+                        failures = 0
+            if stopping or time.monotonic() >= next_fold:
+                self._fold_stats()
+                next_fold = time.monotonic() + AUDIT_STATS_FOLD_INTERVAL
+            if stopping and not carry and self._queue.empty():
+                return
+
+    def _flush(self, batch: list[Entry]) -> None:
+        with db.connect() as conn:
+            try:
+                write_entries(conn, batch)
+                conn.commit()
+            except psycopg.errors.ForeignKeyViolation:
+                conn.rollback()
+                write_entries(conn, _drop_missing_actors(conn, batch))
+                conn.commit()
+
+
+writer = AuditWriter(
+    flush_interval=AUDIT_FLUSH_INTERVAL_MS / 1000,
+    batch_size=AUDIT_FLUSH_BATCH,
+    maxsize=AUDIT_QUEUE_MAXSIZE,
+)
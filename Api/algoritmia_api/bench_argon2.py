@@ -0,0 +1,129 @@
+"""
+Argon2 cost calibration.
+
+Measures hash / verify latency and peak memory on *this* machine for a grid of
+time_cost / memory_cost / parallelism values, then recommends the strongest
+parameters whose hash p95 stays under the target.
+
+Run it on the production host (or one like it):
+  cd Api
+  python -m algoritmia_api.bench_argon2 --target-p95-ms 250
+  python -m algoritmia_api.bench_argon2 -t 1,2,3,4 -m 19456,47104,65536 -p 1,2,4 --samples 30
+
+Put the recommended values in ARGON2_TIME_COST / ARGON2_MEMORY_COST /
+ARGON2_PARALLELISM; stored hashes are upgraded as users log in.
+"""
+
+import argparse
+import multiprocessing
+import statistics
+import sys
+import time
+from typing import Optional
+
+from passlib.hash import argon2
+
+try:
+    import resource  # not available on Windows
+except ImportError:  # pragma: no cover
+    resource = None
+
+
+def _ints(value: str) -> list[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def _p95(samples: list[float]) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))]
+
+
+def _peak_rss_kib() -> Optional[int]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, KiB on Linux
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def _measure(time_cost: int, memory_cost: int, parallelism: int, samples: int) -> dict:
+    """Runs in a fresh process so peak RSS belongs to this configuration alone."""
+    baseline = _peak_rss_kib()
+    hasher = argon2.using(type="ID", rounds=time_cost, memory_cost=memory_cost, parallelism=parallelism)
+    password = "benchmark-Password-123"
+
+    hash_ms: list[float] = []
+    verify_ms: list[float] = []
+    hashed = hasher.hash(password)  # warm-up
+    for _ in range(samples):
+        t0 = time.perf_counter()
+        hashed = hasher.hash(password)
+        t1 = time.perf_counter()
+        hasher.verify(password, hashed)
+        t2 = time.perf_counter()
+        hash_ms.append((t1 - t0) * 1000)
+        verify_ms.append((t2 - t1) * 1000)
+
+    peak = _peak_rss_kib()
+    return {
+        "time_cost": time_cost,
+        "memory_cost": memory_cost,
+        "parallelism": parallelism,
+        "hash_p50_ms": statistics.median(hash_ms),
+        "hash_p95_ms": _p95(hash_ms),
+        "verify_p95_ms": _p95(verify_ms),
+        "peak_rss_mib": (peak - baseline) / 1024 if peak is not None and baseline is not None else None,
+    }
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("-t", "--time-cost", type=_ints, default=[1, 2, 3, 4])
+    parser.add_argument("-m", "--memory-cost", type=_ints, default=[19456, 47104, 65536, 131072],
+                        help="KiB, comma separated")
+    parser.add_argument("-p", "--parallelism", type=_ints, default=[1, 2, 4])
+    parser.add_argument("--samples", type=int, default=20)
+    parser.add_argument("--target-p95-ms", type=float, default=250.0,
+                        help="hash latency budget for one login / signup")
+    args = parser.parse_args(argv)
+
+    grid = [
+        (t, m, p)
+        for m in args.memory_cost
+        for t in args.time_cost
+        for p in args.parallelism
+    ]
+    print(f"argon2id, {args.samples} samples per configuration, target hash p95 <= {args.target_p95_ms:.0f} ms\n")
+    print(f"{'time':>4} {'memory KiB':>10} {'par':>3} {'hash p50':>9} {'hash p95':>9} {'verify p95':>10} {'peak MiB':>8}")
+
+    results = []
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(processes=1, maxtasksperchild=1) as pool:
+        for t, m, p in grid:
+            r = pool.apply(_measure, (t, m, p, args.samples))
+            results.append(r)
+            rss = f"{r['peak_rss_mib']:.0f}" if r["peak_rss_mib"] is not None else "n/a"
+            print(
+                f"{t:>4} {m:>10} {p:>3} {r['hash_p50_ms']:>7.1f}ms {r['hash_p95_ms']:>7.1f}ms "
+                f"{r['verify_p95_ms']:>8.1f}ms {rss:>8}"
+            )
+
+    within = [r for r in results if r["hash_p95_ms"] <= args.target_p95_ms]
+    if not within:
+        print("\nNo configuration meets the target; lower the costs or raise --target-p95-ms.")
+        return 1
+
+    # Strongest = most memory x passes; memory-hardness first, then the faster one
+    best = max(within, key=lambda r: (r["memory_cost"] * r["time_cost"], r["memory_cost"], -r["hash_p95_ms"]))
+    print(
+        f"\nRecommended (hash p95 {best['hash_p95_ms']:.0f} ms):\n"
+        f"  ARGON2_TIME_COST={best['time_cost']}\n"
+        f"  ARGON2_MEMORY_COST={best['memory_cost']}\n"
+        f"  ARGON2_PARALLELISM={best['parallelism']}\n"
+        f"Each concurrent hash needs ~{best['memory_cost'] // 1024} MiB; size PASSWORD_HASH_WORKERS accordingly."
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,97 @@
+"""
+Storage upload benchmark.
+
+Pushes uploads through the r2_client facade (its bounded thread pool and
+timeouts included) against a storage backend and reports throughput and
+latency per object size. With the memory or local backend it runs offline,
+which isolates the API-side overhead from the network; against r2 / s3 it
+measures the real thing (objects are written under bench/ and deleted).
+
+  cd Api
+  python -m algoritmia_api.bench_storage --backend memory
+  python -m algoritmia_api.bench_storage --backend local --sizes 65536,2097152 --concurrency 1,8,32
+  STORAGE_BACKEND=r2 python -m algoritmia_api.bench_storage --backend r2 --uploads 50
+"""
+
+import argparse
+import io
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from . import r2_client
+from .storage_backends import create_backend
+
+
+def _ints(value: str) -> list[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def _p95(samples: list[float]) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))]
+
+
+def _measure(size: int, concurrency: int, uploads: int) -> dict:
+    body = os.urandom(size)
+    keys = [f"bench/{size}-{concurrency}-{i}.bin" for i in range(uploads)]
+
+    def one(key: str) -> float:
+        t0 = time.perf_counter()
+        r2_client.upload_file_obj(io.BytesIO(body), key=key, content_type="application/octet-stream")
+        return (time.perf_counter() - t0) * 1000
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as callers:
+        latencies = list(callers.map(one, keys))
+    elapsed = time.perf_counter() - started
+
+    backend = r2_client.get_backend()
+    for i in range(0, len(keys), 1000):
+        backend.delete_many(keys[i:i + 1000])
+
+    return {
+        "size": size,
+        "concurrency": concurrency,
+        "uploads_per_s": uploads / elapsed,
+        "mib_per_s": uploads * size / elapsed / (1024 * 1024),
+        "p50_ms": statistics.median(latencies),
+        "p95_ms": _p95(latencies),
+    }
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--backend", default="memory", help="r2, s3, local or memory (default: memory)")
+    parser.add_argument("--sizes", type=_ints, default=[16 * 1024, 256 * 1024, 2 * 1024 * 1024])
+    parser.add_argument("--concurrency", type=_ints, default=sorted({1, 4, r2_client.R2_CONCURRENCY}))
+    parser.add_argument("--uploads", type=int, default=200, help="uploads per size / concurrency pair")
+    args = parser.parse_args(argv)
+
+    r2_client.set_backend(create_backend(args.backend, max_pool_connections=r2_client.R2_CONCURRENCY * 2))
+
+    print(f"backend={args.backend} R2_CONCURRENCY={r2_client.R2_CONCURRENCY} R2_MAX_PENDING={r2_client.R2_MAX_PENDING}")
+    print(f"{'size':>10} {'conc':>5} {'uploads/s':>10} {'MiB/s':>8} {'p50 ms':>8} {'p95 ms':>8}")
+    for size in args.sizes:
+        for concurrency in args.concurrency:
+            try:
+                r = _measure(size, concurrency, args.uploads)
+            except r2_client.StorageBusy:
+                print(f"{size:>10} {concurrency:>5}  queue full (raise R2_MAX_PENDING or lower --concurrency)")
+                continue
+            print(
+                f"{r['size']:>10} {r['concurrency']:>5} {r['uploads_per_s']:>10.1f} "
+                f"{r['mib_per_s']:>8.1f} {r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f}"
+            )
+
+    stats = r2_client.upload_stats()
+    print(f"totals: {stats['uploads']} uploads, {stats['multipart']} multipart, {stats['parts']} parts, {stats['failed']} failed")
+    print("config:", ", ".join(f"{k}={v}" for k, v in stats["config"].items()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,317 @@
+import os
+import re
+import time
+import random
+import logging
+from concurrent.futures import Future
+from threading import BoundedSemaphore, Lock
+from typing import Iterable, Optional, Sequence
+
+import httpx
+from fastapi import HTTPException
+
+from .cache import TTLCache
+
+logger = logging.getLogger("codeforces")
+
+# Point this at a local stub server for tests / benchmarks
+CF_API_BASE_URL = os.getenv("CF_API_BASE_URL", "https://codeforces.com/api").rstrip("/")
+CF_USER_INFO_BATCH_SIZE = int(os.getenv("CF_USER_INFO_BATCH_SIZE", "300"))
+# Codeforces asks for at most one call every 2 seconds per client (ratings sync)
+CF_API_MIN_INTERVAL = float(os.getenv("CF_API_MIN_INTERVAL", "2"))
+CF_API_BURST = int(os.getenv("CF_API_BURST", "1"))  # sync calls allowed back to back
+# Signup handle checks have their own, separate budget so they neither queue
+# behind a sync nor behind each other; past CF_INTERACTIVE_MAX_WAIT they get a 503
+CF_INTERACTIVE_RATE = float(os.getenv("CF_INTERACTIVE_RATE", "1"))  # calls per second
+CF_INTERACTIVE_BURST = int(os.getenv("CF_INTERACTIVE_BURST", "4"))
+CF_INTERACTIVE_MAX_WAIT = float(os.getenv("CF_INTERACTIVE_MAX_WAIT", "3"))  # seconds
+
+# Shared HTTP client: keep-alive pool, timeouts, concurrency cap and retries
+CF_HTTP_TIMEOUT = float(os.getenv("CF_HTTP_TIMEOUT", "10"))  # seconds, per request
+CF_HTTP_CONNECT_TIMEOUT = float(os.getenv("CF_HTTP_CONNECT_TIMEOUT", "3"))
+CF_HTTP_MAX_CONNECTIONS = int(os.getenv("CF_HTTP_MAX_CONNECTIONS", "4"))
+CF_HTTP_KEEPALIVE_EXPIRY = float(os.getenv("CF_HTTP_KEEPALIVE_EXPIRY", "60"))
+CF_HTTP_MAX_RETRIES = int(os.getenv("CF_HTTP_MAX_RETRIES", "2"))
+# Retries may add at most this fraction on top of first attempts (plus a small floor)
+CF_HTTP_RETRY_RATIO = float(os.getenv("CF_HTTP_RETRY_RATIO", "0.2"))
+
+# Handle validation cache: existing handles are remembered for a long time,
+# "does not exist" answers only briefly (the user may be registering it right now).
+CF_HANDLE_CACHE_TTL = float(os.getenv("CF_HANDLE_CACHE_TTL", str(24 * 60 * 60)))
+CF_HANDLE_NEGATIVE_TTL = float(os.getenv("CF_HANDLE_NEGATIVE_TTL", "300"))
+CF_HANDLE_CACHE_MAXSIZE = int(os.getenv("CF_HANDLE_CACHE_MAXSIZE", "5000"))
+
+CF_HANDLE_RE = re.compile(r"^[A-Za-z0-9_\-]{1,24}$")
+
+_NOT_FOUND_RE = re.compile(r"User with handle (\S+) not found", re.IGNORECASE)
+
+_RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+_existing_handles = TTLCache(maxsize=CF_HANDLE_CACHE_MAXSIZE, ttl=CF_HANDLE_CACHE_TTL)
+_missing_handles = TTLCache(maxsize=CF_HANDLE_CACHE_MAXSIZE, ttl=CF_HANDLE_NEGATIVE_TTL)
+
+# handle (lower-cased) -> Future shared by every concurrent check of that handle
+_inflight: dict[str, Future] = {}
+_inflight_lock = Lock()
+
+_client: Optional[httpx.Client] = None
+_client_lock = Lock()
+# Every call goes to the same host, so the pool size doubles as the per-host cap.
+# The rate limiters decide when a call may start; this caps how many overlap.
+_host_slots = BoundedSemaphore(max(1, CF_HTTP_MAX_CONNECTIONS))
+
+
+class CodeforcesError(RuntimeError):
+    """Codeforces could not be reached or answered with something unusable."""
+
+
+class _RateLimiter:
+    """
+    Token bucket: `rate` calls per second on average, up to `burst` at once.
+    A caller reserves its slot under the lock and sleeps outside it, so waiting
+    callers don't block each other and calls that are allowed run concurrently.
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.interval = 1 / rate if rate > 0 else 0.0
+        self.burst = max(1, burst)
+        self._next_free = 0.0  # when the bucket will have been refilled completely
+        self._lock = Lock()
+
+    def acquire(self, max_wait: Optional[float] = None) -> bool:
+        """Wait for a slot; False (and nothing reserved) if that would take longer than max_wait."""
+        with self._lock:
+            now = time.monotonic()
+            base = max(self._next_free, now)
+            wait = max(0.0, base - (self.burst - 1) * self.interval - now)
+            if max_wait is not None and wait > max_wait:
+                return False
+            self._next_free = base + self.interval
+        if wait > 0:
+            time.sleep(wait)
+        return True
+
+
+class _RetryBudget:
+    """
+    Token bucket shared by all calls: each first attempt deposits `ratio` tokens,
+    each retry spends one. When Codeforces is down for everyone we stop retrying
+    (and stop multiplying our own traffic) instead of retrying every request.
+    """
+
+    def __init__(self, ratio: float, floor: float = 3.0):
+        self.ratio = ratio
+        self.floor = floor
+        self._tokens = floor
+        self._lock = Lock()
+
+    def deposit(self) -> None:
+        with self._lock:
+            self._tokens = min(self._tokens + self.ratio, self.floor + 100 * self.ratio)
+
+    def withdraw(self) -> bool:
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+_retry_budget = _RetryBudget(CF_HTTP_RETRY_RATIO)
+
+_sync_limiter = _RateLimiter(1 / CF_API_MIN_INTERVAL if CF_API_MIN_INTERVAL > 0 else 0, CF_API_BURST)
+_interactive_limiter = _RateLimiter(CF_INTERACTIVE_RATE, CF_INTERACTIVE_BURST)
+
+
+def _get_client() -> httpx.Client:
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = httpx.Client(
+                    base_url=CF_API_BASE_URL,
+                    timeout=httpx.Timeout(CF_HTTP_TIMEOUT, connect=CF_HTTP_CONNECT_TIMEOUT),
+                    limits=httpx.Limits(
+                        max_connections=CF_HTTP_MAX_CONNECTIONS,
+                        max_keepalive_connections=CF_HTTP_MAX_CONNECTIONS,
+                        keepalive_expiry=CF_HTTP_KEEPALIVE_EXPIRY,
+                    ),
+                    headers={"User-Agent": "algoritmia-api"},
+                )
+    return _client
+
+
+def close_client() -> None:
+    """Close the shared HTTP client (app shutdown). It is re-created on next use."""
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+
+def _call(
+    method: str,
+    params: dict,
+    timeout: Optional[float] = None,
+    *,
+    limiter: _RateLimiter = _sync_limiter,
+    max_wait: Optional[float] = None,
+) -> dict:
+    client = _get_client()
+    _retry_budget.deposit()
+    attempt = 0
+    while True:
+        if not limiter.acquire(max_wait):
+            raise CodeforcesError("Too many Codeforces requests right now")
+        error: Exception
+        try:
+            with _host_slots:
+                resp = client.get(
+                    f"/{method}",
+                    params=params,
+                    timeout=timeout if timeout is not None else httpx.USE_CLIENT_DEFAULT,
+                )
+        except httpx.TransportError as e:
+            error = CodeforcesError(f"Could not reach Codeforces: {e}")
+            error.__cause__ = e
+        else:
+            # CF answers 400 with a JSON body for "FAILED" calls; let the caller read it
+            if resp.status_code not in _RETRY_STATUSES:
+                try:
+                    return resp.json()
+                except ValueError as e:
+                    raise CodeforcesError(
+                        f"Invalid JSON from Codeforces (HTTP {resp.status_code})"
+                    ) from e
+            error = CodeforcesError(f"HTTP {resp.status_code} from Codeforces")
+
+        if attempt >= CF_HTTP_MAX_RETRIES or not _retry_budget.withdraw():
+            raise error
+        attempt += 1
+        delay = min(0.5 * 2 ** attempt, 8) * random.uniform(0.5, 1.0)
+        logger.warning("Codeforces %s failed (%s); retry %s in %.1fs", method, error, attempt, delay)
+        time.sleep(delay)
+
+
+def fetch_user_info(handles: Sequence[str]) -> list[dict]:
+    """
+    Batched user.info for any number of handles.
+
+    Returns the Codeforces user objects that exist. Handles Codeforces reports as
+    unknown are dropped and the rest of the batch is retried, so one renamed account
+    doesn't hide everybody else's rating.
+    """
+    results: list[dict] = []
+    pending = [h for h in dict.fromkeys(h.strip() for h in handles) if h]
+
+    for start in range(0, len(pending), CF_USER_INFO_BATCH_SIZE):
+        batch = pending[start : start + CF_USER_INFO_BATCH_SIZE]
+        while batch:
+            data = _call("user.info", {"handles": ";".join(batch), "checkHistoricHandles": "false"})
+            if data.get("status") == "OK":
+                results.extend(data.get("result") or [])
+                break
+
+            comment = data.get("comment") or ""
+            match = _NOT_FOUND_RE.search(comment)
+            if not match:
+                raise CodeforcesError(comment or "Codeforces returned FAILED")
+
+            missing = match.group(1).lower()
+            remaining = [h for h in batch if h.lower() != missing]
+            if len(remaining) == len(batch):
+                raise CodeforcesError(comment)
+            logger.info("Codeforces handle %s not found; skipping it", missing)
+            batch = remaining
+
+    return results
+
+
+def remember_existing(handles: Iterable[str]) -> None:
+    """Warm the positive cache, e.g. with the handles a ratings sync just saw."""
+    for h in handles:
+        _existing_handles.set(h.lower(), True)
+
+
+def _lookup_handle(handle: str) -> bool:
+    data = _call(
+        "user.info",
+        {"handles": handle, "checkHistoricHandles": "false"},
+        timeout=5,
+        limiter=_interactive_limiter,
+        max_wait=CF_INTERACTIVE_MAX_WAIT,
+    )
+    if data.get("status") == "OK":
+        return True
+    comment = data.get("comment") or ""
+    if _NOT_FOUND_RE.search(comment):
+        return False
+    raise CodeforcesError(comment or "Codeforces returned FAILED")
+
+
+def handle_exists(handle: str) -> bool:
+    """
+    Does this Codeforces handle exist? Cached (positive and negative) and coalesced:
+    concurrent checks of the same handle wait on a single upstream call.
+    Raises CodeforcesError if Codeforces can't be asked; errors are never cached.
+    """
+    key = handle.lower()
+    if _existing_handles.get(key):
+        return True
+    if _missing_handles.get(key):
+        return False
+
+    with _inflight_lock:
+        future = _inflight.get(key)
+        leader = future is None
+        if leader:
+            future = Future()
+            _inflight[key] = future
+
+    if not leader:
+        return future.result()
+
+    try:
+        exists = _lookup_handle(handle)
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    else:
+        (_existing_handles if exists else _missing_handles).set(key, True)
+        future.set_result(exists)
+        return exists
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+
+
+def validate_codeforces_handle_exists(handle: str) -> None:
+    """Signup / profile validation: 422 for a bad or unknown handle, 503 if CF is down."""
+    # Basic format validation
+    if not CF_HANDLE_RE.fullmatch(handle):
+        raise HTTPException(
+            status_code=422,
+            detail=(
+                "El handle de Codeforces debe tener entre 3 y 24 caracteres "
+                "(letras, dígitos, '_' o '-')."
+            ),
+        )
+
+    try:
+        exists = handle_exists(handle)
+    except CodeforcesError:
+        # Treat this as an external service issue, not a bad handle syntax
+        raise HTTPException(
+            status_code=503,
+            detail=(
+                "No se pudo contactar a Codeforces para verificar tu handle. "
+                "Intenta de nuevo más tarde."
+            ),
+        )
+
+    if not exists:
+        raise HTTPException(
+            status_code=422,
+            detail=f"El usuario de Codeforces '{handle}' no existe.",
+        )
@@ -1,5 +1,7 @@
 import os
-from typing import Any, Iterable, Optional, Sequence
+import logging
+from contextlib import contextmanager
+from typing import Any, Iterable, Iterator, Optional, Sequence
 
 try:
     import psycopg
@@ -7,6 +9,23 @@ try:
 except Exception:  # pragma: no cover
     psycopg = None
 
+try:
+    from psycopg_pool import ConnectionPool
+except Exception:  # pragma: no cover
+    ConnectionPool = None
+
+logger = logging.getLogger("db")
+
+# Pool sizing / health knobs (all optional)
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_POOL_MAX_IDLE = float(os.getenv("DB_POOL_MAX_IDLE", "300"))  # seconds
+DB_POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", "3600"))  # seconds
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))  # seconds waiting for a free connection
+DB_POOL_CHECK = os.getenv("DB_POOL_CHECK", "1") not in ("0", "false", "False")
+
+_pool = None
+
 
 def require_psycopg() -> None:
     if psycopg is None:
@@ -20,11 +39,109 @@ def get_database_url() -> str:
     return url
 
 
+def open_pool() -> None:
+    """
+    Create the process-wide connection pool. Called once from create_app() at startup.
+    Safe to call twice; if psycopg_pool is missing we keep the old connect-per-call behaviour.
+    """
+    global _pool
+    if _pool is not None:
+        return
+    require_psycopg()
+    if ConnectionPool is None:
+        logger.warning("psycopg_pool is not installed; falling back to one connection per call")
+        return
+    if not os.getenv("DATABASE_URL"):
+        # Same as before pooling: the app still boots, DB routes fail on first use.
+        logger.warning("DATABASE_URL is not set; DB pool not opened")
+        return
+
+    _pool = ConnectionPool(
+        get_database_url(),
+        min_size=DB_POOL_MIN_SIZE,
+        max_size=DB_POOL_MAX_SIZE,
+        max_idle=DB_POOL_MAX_IDLE,
+        max_lifetime=DB_POOL_MAX_LIFETIME,
+        timeout=DB_POOL_TIMEOUT,
+        kwargs={"row_factory": dict_row},
+        # Validate a connection before handing it out, so a dropped server-side
+        # connection doesn't turn into a 500 on the next request.
+        check=ConnectionPool.check_connection if DB_POOL_CHECK else None,
+        name="algoritmia",
+        open=False,
+    )
+    # Don't block startup waiting for min_size connections; they fill in the background.
+    _pool.open(wait=False)
+    logger.info("DB pool opened (min=%s, max=%s)", DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE)
+
+
+def close_pool() -> None:
+    global _pool
+    if _pool is None:
+        return
+    _pool.close()
+    _pool = None
+    logger.info("DB pool closed")
+
+
+def pool_stats() -> dict:
+    return _pool.get_stats() if _pool is not None else {}
+
+
 def connect():  # context manager usage: with connect() as conn: ...
+    """
+    Borrow a connection from the pool (or open a fresh one if no pool is running).
+
+    Both variants behave the same inside `with`: commit on success, rollback on
+    exception. The pooled one returns the connection to the pool instead of closing it.
+    """
     require_psycopg()
+    if _pool is not None:
+        return _pool.connection()
     return psycopg.connect(get_database_url(), row_factory=dict_row)
 
 
+def get_conn():
+    """
+    FastAPI dependency: one connection (and one transaction) per request.
+
+    FastAPI caches dependencies per request, so get_current_user, the route body and
+    add_audit_log(conn=...) all share this connection. Routes that write should call
+    conn.commit() themselves once the change and its audit row are in place; anything
+    left uncommitted is committed on exit, or rolled back if the request raised.
+    """
+    with connect() as conn:
+        yield conn
+
+
+def try_advisory_xact_lock(conn, name: str) -> bool:
+    """
+    Take a transaction-scoped advisory lock named `name`, without waiting.
+    Used by background jobs so only one worker process runs them at a time;
+    the lock is released on commit/rollback.
+    """
+    row = fetchone(conn, "SELECT pg_try_advisory_xact_lock(hashtext(%s)) AS locked", [name])
+    return bool(row and row["locked"])
+
+
+@contextmanager
+def advisory_lock(conn, name: str) -> Iterator[bool]:
+    """
+    Session-level variant of try_advisory_xact_lock for jobs that commit several
+    times while they run. Yields whether the lock was taken; it is released on exit
+    (the connection goes back to the pool, so it must not keep the lock).
+    """
+    row = fetchone(conn, "SELECT pg_try_advisory_lock(hashtext(%s)) AS locked", [name])
+    locked = bool(row and row["locked"])
+    try:
+        yield locked
+    finally:
+        if locked:
+            conn.rollback()
+            fetchone(conn, "SELECT pg_advisory_unlock(hashtext(%s)) AS unlocked", [name])
+            conn.commit()
+
+
 def ensure_extensions(conn) -> None:
     with conn.cursor() as cur:
         cur.execute("CREATE EXTENSION IF NOT EXISTS citext;")
@@ -45,10 +162,16 @@ def fetchone(conn, sql: str, params: Optional[Sequence[Any]] = None):
         return cur.fetchone()
 
 
-def execute(conn, sql: str, params: Optional[Sequence[Any]] = None) -> int:
+def execute(
+    conn,
+    sql: str,
+    params: Optional[Sequence[Any]] = None,
+    *,
+    commit: bool = True,
+) -> int:
     with conn.cursor() as cur:
         cur.execute(sql, params or ())
         rowcount = cur.rowcount
-    conn.commit()
+    if commit:
+        conn.commit()
     return rowcount
-
@@ -0,0 +1,122 @@
+"""
+asyncio counterpart of db.py for `async def` routes.
+
+Same helpers (connect / get_conn / fetchall / fetchone / execute), but built on
+psycopg's AsyncConnection and an AsyncConnectionPool, so a request waiting on
+Postgres doesn't hold one of anyio's worker threads. Concurrency on these routes
+is bounded by the pool size instead of the thread limiter.
+"""
+
+import os
+import logging
+from contextlib import asynccontextmanager
+from typing import Any, Optional, Sequence
+
+try:
+    import psycopg
+    from psycopg.rows import dict_row
+except Exception:  # pragma: no cover
+    psycopg = None
+
+try:
+    from psycopg_pool import AsyncConnectionPool
+except Exception:  # pragma: no cover
+    AsyncConnectionPool = None
+
+from .db import get_database_url, require_psycopg, DB_POOL_MAX_IDLE, DB_POOL_MAX_LIFETIME, DB_POOL_CHECK
+
+logger = logging.getLogger("db_async")
+
+DB_ASYNC_POOL_MIN_SIZE = int(os.getenv("DB_ASYNC_POOL_MIN_SIZE", "2"))
+DB_ASYNC_POOL_MAX_SIZE = int(os.getenv("DB_ASYNC_POOL_MAX_SIZE", "20"))
+DB_ASYNC_POOL_TIMEOUT = float(os.getenv("DB_ASYNC_POOL_TIMEOUT", "10"))  # seconds
+
+_pool = None
+
+
+async def open_pool() -> None:
+    """Create the async pool. Must run inside the event loop (app lifespan)."""
+    global _pool
+    if _pool is not None:
+        return
+    require_psycopg()
+    if AsyncConnectionPool is None:
+        logger.warning("psycopg_pool is not installed; async routes open one connection per call")
+        return
+    if not os.getenv("DATABASE_URL"):
+        logger.warning("DATABASE_URL is not set; async DB pool not opened")
+        return
+
+    _pool = AsyncConnectionPool(
+        get_database_url(),
+        min_size=DB_ASYNC_POOL_MIN_SIZE,
+        max_size=DB_ASYNC_POOL_MAX_SIZE,
+        max_idle=DB_POOL_MAX_IDLE,
+        max_lifetime=DB_POOL_MAX_LIFETIME,
+        timeout=DB_ASYNC_POOL_TIMEOUT,
+        kwargs={"row_factory": dict_row},
+        check=AsyncConnectionPool.check_connection if DB_POOL_CHECK else None,
+        name="algoritmia-async",
+        open=False,
+    )
+    await _pool.open(wait=False)
+    logger.info(
+        "Async DB pool opened (min=%s, max=%s)", DB_ASYNC_POOL_MIN_SIZE, DB_ASYNC_POOL_MAX_SIZE
+    )
+
+
+async def close_pool() -> None:
+    global _pool
+    if _pool is None:
+        return
+    await _pool.close()
+    _pool = None
+    logger.info("Async DB pool closed")
+
+
+@asynccontextmanager
+async def connect():  # usage: async with connect() as conn: ...
+    """Commit on success, rollback on exception — same contract as db.connect()."""
+    require_psycopg()
+    if _pool is not None:
+        async with _pool.connection() as conn:
+            yield conn
+        return
+
+    async with await psycopg.AsyncConnection.connect(
+        get_database_url(), row_factory=dict_row
+    ) as conn:
+        yield conn
+
+
+async def get_conn():
+    """FastAPI dependency: one async connection per request (see db.get_conn)."""
+    async with connect() as conn:
+        yield conn
+
+
+async def fetchall(conn, sql: str, params: Optional[Sequence[Any]] = None):
+    async with conn.cursor() as cur:
+        await cur.execute(sql, params or ())
+        return await cur.fetchall()
+
+
+async def fetchone(conn, sql: str, params: Optional[Sequence[Any]] = None):
+    async with conn.cursor() as cur:
+        await cur.execute(sql, params or ())
+        return await cur.fetchone()
+
+
+async def execute(
+    conn,
+    sql: str,
+    params: Optional[Sequence[Any]] = None,
+    *,
+    commit: bool = True,
+) -> int:
+    async with conn.cursor() as cur:
+        await cur.execute(sql, params or ())
+        rowcount = cur.rowcount
+    if commit:
+        await conn.commit()
+    return rowcount
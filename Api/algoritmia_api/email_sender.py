@@ -0,0 +1,267 @@
+"""
+Delivers the email_outbox.
+
+Each round claims up to EMAIL_BATCH_SIZE due rows (FOR UPDATE SKIP LOCKED, so
+concurrent senders never pick the same row), leases them for
+EMAIL_CLAIM_LEASE seconds and commits, then sends them over one pooled SMTP
+connection and records the outcome. Failures are retried after
+EMAIL_RETRY_BASE * 2^(attempts - 1) seconds (capped at EMAIL_RETRY_MAX) up to
+EMAIL_MAX_ATTEMPTS; 5xx rejections fail right away. Delivery is at-least-once:
+a sender killed between the SMTP send and the UPDATE sends that row again.
+
+Every API process runs one sender thread (EMAIL_SENDER=0 turns it off), woken
+right after a route queues a message. To add capacity, run more elsewhere:
+  cd Api
+  python -m algoritmia_api.email_sender
+  python -m algoritmia_api.email_sender --once   # drain what is due and exit
+"""
+
+import os
+import sys
+import time
+import smtplib
+import logging
+import argparse
+import threading
+from typing import Optional
+
+from . import db
+from .email_utils import pool as smtp_pool, build_message, smtp_configured
+
+logger = logging.getLogger("email_sender")
+
+EMAIL_SENDER = os.getenv("EMAIL_SENDER", "1") != "0"  # in-process sender thread
+EMAIL_POLL_INTERVAL = float(os.getenv("EMAIL_POLL_INTERVAL", "5"))  # seconds between idle polls
+EMAIL_BATCH_SIZE = int(os.getenv("EMAIL_BATCH_SIZE", "50"))
+EMAIL_CLAIM_LEASE = int(os.getenv("EMAIL_CLAIM_LEASE", "300"))  # seconds a claimed row stays hidden
+EMAIL_MAX_ATTEMPTS = int(os.getenv("EMAIL_MAX_ATTEMPTS", "8"))
+EMAIL_RETRY_BASE = int(os.getenv("EMAIL_RETRY_BASE", "30"))  # seconds
+EMAIL_RETRY_MAX = int(os.getenv("EMAIL_RETRY_MAX", "3600"))
+# Finished rows (sent / failed) are deleted after this many days
+EMAIL_OUTBOX_RETENTION_DAYS = int(os.getenv("EMAIL_OUTBOX_RETENTION_DAYS", "30"))
+
+CLAIM_SQL = """
+UPDATE email_outbox o
+SET attempts = o.attempts + 1,
+    next_attempt_at = NOW() + make_interval(secs => %s)
+FROM (
+    SELECT id FROM email_outbox
+    WHERE status = 'pending' AND next_attempt_at <= NOW()
+    ORDER BY next_attempt_at, id
+    LIMIT %s
+    FOR UPDATE SKIP LOCKED
+) due
+WHERE o.id = due.id
+RETURNING o.id, o.kind, o.to_email, o.subject, o.text_body, o.html_body, o.attempts,
+          o.expires_at IS NOT NULL AND o.expires_at <= NOW() AS expired
+"""
+
+MARK_SENT_SQL = """
+UPDATE email_outbox
+SET status = 'sent', sent_at = NOW(), last_error = NULL, text_body = NULL, html_body = NULL
+WHERE id = ANY(%s)
+"""
+
+MARK_FAILED_SQL = """
+UPDATE email_outbox
+SET status = 'failed', last_error = %s, text_body = NULL, html_body = NULL
+WHERE id = %s
+"""
+
+RETRY_SQL = """
+UPDATE email_outbox
+SET last_error = %s,
+    next_attempt_at = NOW() + make_interval(secs => LEAST(%s * power(2, attempts - 1), %s))
+WHERE id = %s
+"""
+
+# Let a claimed row go without counting the attempt (SMTP unreachable, shutdown)
+RELEASE_SQL = """
+UPDATE email_outbox
+SET attempts = attempts - 1, last_error = %s, next_attempt_at = NOW() + make_interval(secs => %s)
+WHERE id = ANY(%s)
+"""
+
+PURGE_SQL = """
+DELETE FROM email_outbox
+WHERE status IN ('sent', 'failed') AND created_at < NOW() - make_interval(days => %s)
+"""
+
+
+def _permanent(error: Exception) -> bool:
+    """5xx replies and refused recipients won't succeed on retry."""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return True
+    return isinstance(error, smtplib.SMTPResponseException) and error.smtp_code >= 500
+
+
+def _send_all(rows: list[dict]) -> tuple[list[int], dict[int, Exception], list[int]]:
+    """
+    Send `rows` reusing one connection. Returns (sent ids, {id: error}, ids left
+    unsent because the server could not be reached).
+    """
+    sent: list[int] = []
+    errors: dict[int, Exception] = {}
+    todo = list(rows)
+    reconnects = 0
+    while todo:
+        try:
+            with smtp_pool.connection() as server:
+                while todo:
+                    row = todo[0]
+                    msg = build_message(row["to_email"], row["subject"], row["text_body"] or "", row["html_body"])
+                    try:
+                        server.send_message(msg)
+                        sent.append(row["id"])
+                    except (smtplib.SMTPRecipientsRefused, smtplib.SMTPResponseException) as e:
+                        # The server answered; the connection is still good
+                        errors[row["id"]] = e
+                    todo.pop(0)
+        except Exception as e:
+            # SMTPException subclasses OSError: only a hang-up or a socket error is
+            # worth a reconnect; anything else (e.g. bad credentials) won't fix itself
+            lost = isinstance(e, smtplib.SMTPServerDisconnected) or (
+                isinstance(e, OSError) and not isinstance(e, smtplib.SMTPException)
+            )
+            reconnects += 1
+            if not lost or reconnects > 1:
+                logger.warning("SMTP unavailable (%r); %s emails put back", e, len(todo))
+                return sent, errors, [row["id"] for row in todo]
+    return sent, errors, []
+
+
+def send_due(batch_size: int = EMAIL_BATCH_SIZE) -> int:
+    """One round: claim, send and record up to `batch_size` due emails. Returns how many were claimed."""
+    with db.connect() as conn:
+        rows = db.fetchall(conn, CLAIM_SQL, [EMAIL_CLAIM_LEASE, batch_size])
+        conn.commit()
+    if not rows:
+        return 0
+
+    expired = [r for r in rows if r["expired"]]
+    rows = [r for r in rows if not r["expired"]]
+
+    if not smtp_configured():
+        for row in rows:
+            logger.warning(
+                "SMTP not configured. Would have sent email to %s with subject '%s'",
+                row["to_email"],
+                row["subject"],
+            )
+        sent, errors, unsent = [], {r["id"]: RuntimeError("SMTP not configured") for r in rows}, []
+    else:
+        sent, errors, unsent = _send_all(rows)
+
+    attempts = {r["id"]: r["attempts"] for r in rows}
+    with db.connect() as conn:
+        if sent:
+            db.execute(conn, MARK_SENT_SQL, [sent], commit=False)
+        for row in expired:
+            db.execute(conn, MARK_FAILED_SQL, ["expired before it could be sent", row["id"]], commit=False)
+        for email_id, error in errors.items():
+            if _permanent(error) or attempts[email_id] >= EMAIL_MAX_ATTEMPTS or not smtp_configured():
+                db.execute(conn, MARK_FAILED_SQL, [repr(error), email_id], commit=False)
+            else:
+                db.execute(conn, RETRY_SQL, [repr(error), EMAIL_RETRY_BASE, EMAIL_RETRY_MAX, email_id], commit=False)
+        if unsent:
+            db.execute(conn, RELEASE_SQL, ["SMTP unavailable", EMAIL_RETRY_BASE, unsent], commit=False)
+        conn.commit()
+
+    if sent:
+        logger.info("Sent %s emails", len(sent))
+    for email_id, error in errors.items():
+        logger.warning("Email %s not sent: %r", email_id, error)
+    return len(rows) + len(expired)
+
+
+def purge_finished(days: int = EMAIL_OUTBOX_RETENTION_DAYS) -> int:
+    with db.connect() as conn:
+        return db.execute(conn, PURGE_SQL, [days])
+
+
+class EmailSender:
+    """Background thread draining the outbox; wake() skips the wait after a route queues mail."""
+
+    def __init__(self, poll_interval: float, batch_size: int):
+        self.poll_interval = poll_interval
+        self.batch_size = max(1, batch_size)
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="email-sender", daemon=True)
+        self._thread.start()
+        logger.info("Email sender started (polling every %ss)", self.poll_interval)
+
+    def stop(self, timeout: float = 30) -> None:
+        """Finish the batch in flight and stop."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._wake.set()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logger.error("Email sender did not stop within %ss", timeout)
+        self._thread = None
+
+    def wake(self) -> None:
+        self._wake.set()
+
+    def _run(self) -> None:
+        failures = 0
+        next_purge = 0.0
+        while not self._stop.is_set():
+            try:
+                claimed = send_due(self.batch_size)
+                if time.monotonic() >= next_purge:
+                    purge_finished()
+                    next_purge = time.monotonic() + 3600
+                failures = 0
+            except Exception:
+                failures += 1
+                claimed = 0
+                logger.exception("Email outbox round failed (attempt %s)", failures)
+            if claimed >= self.batch_size:
+                continue  # more may be due right away
+            wait = self.poll_interval if not failures else min(2 ** failures, 60)
+            self._wake.wait(wait)
+            self._wake.clear()
+
+
+sender = EmailSender(poll_interval=EMAIL_POLL_INTERVAL, batch_size=EMAIL_BATCH_SIZE)
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Send queued emails from email_outbox.")
+    parser.add_argument("--once", action="store_true", help="send what is due now and exit")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    db.open_pool()
+    try:
+        if args.once:
+            while send_due() >= EMAIL_BATCH_SIZE:
+                pass
+            return 0
+        sender.start()
+        try:
+            while sender.running:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+        sender.stop()
+    finally:
+        db.close_pool()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
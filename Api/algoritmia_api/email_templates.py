@@ -0,0 +1,122 @@
+"""
+Transactional email templates.
+
+Each email is a pair of files in templates/email/:
+  <name>.txt   "Subject: ..." on the first line, a blank line, then the text body
+  <name>.html  the HTML content, wrapped in layout.html at its {{ content }}
+
+Placeholders are {{ variable }}; in .html templates (and nowhere else) the
+value is HTML-escaped. There are no loops or conditionals: compute values in
+Python and pass them in.
+
+All templates are read and compiled when this module is imported (startup).
+Compiling merges the layout into each HTML body and turns the static text
+into a str.format string, so rendering is one format() call with no parsing.
+Adding an email means adding its two files and calling
+email_outbox.enqueue_template(conn, "<name>", ...).
+"""
+
+import re
+import html
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable
+
+TEMPLATES_DIR = Path(__file__).parent / "templates" / "email"
+LAYOUT = "layout.html"
+
+_PLACEHOLDER = re.compile(r"\{\{\s*([A-Za-z_][A-Za-z0-9_]*)\s*\}\}")
+
+
+class TemplateError(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class CompiledTemplate:
+    name: str
+    fmt: str  # static text with braces escaped and {0}, {1}, ... for the variables
+    variables: tuple[str, ...]  # distinct variable names, in slot order
+    escape: Callable[[str], str]
+
+    def render(self, context: dict[str, Any]) -> str:
+        try:
+            values = [self.escape(str(context[v])) for v in self.variables]
+        except KeyError as e:
+            raise TemplateError(f"{self.name}: missing variable {e.args[0]!r}") from None
+        return self.fmt.format(*values)
+
+
+def _plain(value: str) -> str:
+    return value
+
+
+def _escape_html(value: str) -> str:
+    return html.escape(value, quote=True)
+
+
+def compile_template(name: str, source: str, *, escape_html: bool) -> CompiledTemplate:
+    variables: list[str] = []
+    pieces: list[str] = []
+    pos = 0
+    for match in _PLACEHOLDER.finditer(source):
+        pieces.append(source[pos:match.start()].replace("{", "{{").replace("}", "}}"))
+        var = match.group(1)
+        if var not in variables:
+            variables.append(var)
+        pieces.append("{%d}" % variables.index(var))
+        pos = match.end()
+    pieces.append(source[pos:].replace("{", "{{").replace("}", "}}"))
+    return CompiledTemplate(
+        name=name,
+        fmt="".join(pieces),
+        variables=tuple(variables),
+        escape=_escape_html if escape_html else _plain,
+    )
+
+
+@dataclass(frozen=True)
+class EmailTemplate:
+    subject: CompiledTemplate
+    text: CompiledTemplate
+    html: CompiledTemplate
+
+    def render(self, **context: Any) -> tuple[str, str, str]:
+        """(subject, text body, html body)"""
+        return self.subject.render(context), self.text.render(context), self.html.render(context)
+
+
+def _load(directory: Path) -> dict[str, EmailTemplate]:
+    layout = (directory / LAYOUT).read_text(encoding="utf-8")
+    if "{{ content }}" not in layout:
+        raise TemplateError(f"{LAYOUT} has no {{{{ content }}}} placeholder")
+
+    templates: dict[str, EmailTemplate] = {}
+    for text_path in sorted(directory.glob("*.txt")):
+        name = text_path.stem
+        header, sep, text_body = text_path.read_text(encoding="utf-8").partition("\n\n")
+        if not sep or not header.startswith("Subject:"):
+            raise TemplateError(f"{text_path.name} must start with 'Subject: ...' and a blank line")
+        html_path = text_path.with_suffix(".html")
+        if not html_path.exists():
+            raise TemplateError(f"{name} has no {html_path.name}")
+        html_body = layout.replace("{{ content }}", html_path.read_text(encoding="utf-8").rstrip("\n"))
+
+        templates[name] = EmailTemplate(
+            subject=compile_template(f"{name} subject", header[len("Subject:"):].strip(), escape_html=False),
+            text=compile_template(text_path.name, text_body, escape_html=False),
+            html=compile_template(html_path.name, html_body, escape_html=True),
+        )
+    return templates
+
+
+_templates = _load(TEMPLATES_DIR)
+
+
+def render(name: str, **context: Any) -> tuple[str, str, str]:
+    """Render email template `name` to (subject, text body, html body)."""
+    try:
+        template = _templates[name]
+    except KeyError:
+        raise TemplateError(f"unknown email template {name!r}") from None
+    return template.render(**context)
@@ -1,9 +1,25 @@
 # app/email_utils.py
+"""
+Outgoing email over SMTP.
+
+Connecting, STARTTLS and AUTH cost several round trips, so authenticated
+connections are kept in a small pool and reused: a burst of verification /
+reset emails pays for one handshake per pooled connection, not one per
+message. A connection that sat idle for SMTP_NOOP_AFTER seconds is checked
+with NOOP before reuse, one idle past SMTP_IDLE_TIMEOUT (servers drop those)
+is closed, and a send that fails because the server hung up is retried once
+on a fresh connection.
+"""
+
 import os
+import time
 import logging
 import smtplib
 import ssl
+from contextlib import contextmanager
 from email.message import EmailMessage
+from threading import BoundedSemaphore, Lock
+from typing import Iterator, Optional
 
 logger = logging.getLogger("email")
 
@@ -13,19 +29,108 @@ SMTP_USER = os.getenv("SMTP_USER")
 SMTP_PASS = os.getenv("SMTP_PASS")
 FROM_EMAIL = os.getenv("FROM_EMAIL", SMTP_USER or "no-reply@example.com")
 
+SMTP_POOL_SIZE = int(os.getenv("SMTP_POOL_SIZE", "2"))  # connections per worker process
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", "15"))  # socket timeout, seconds
+SMTP_NOOP_AFTER = float(os.getenv("SMTP_NOOP_AFTER", "10"))  # idle seconds before a NOOP check
+SMTP_IDLE_TIMEOUT = float(os.getenv("SMTP_IDLE_TIMEOUT", "120"))  # idle seconds before closing
 
-def send_email(to_email: str, subject: str, text_body: str, html_body: str | None = None) -> None:
-    """
-    Sends an email using Gmail SMTP (via app password).
-    """
-    if not (SMTP_USER and SMTP_PASS):
-        logger.warning(
-            "SMTP not configured. Would have sent email to %s with subject '%s'",
-            to_email,
-            subject,
-        )
-        return
+# The server went away: worth one retry on a new connection
+_CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError)
+
+
+def smtp_configured() -> bool:
+    return bool(SMTP_USER and SMTP_PASS)
+
+
+class SmtpPool:
+    """Authenticated SMTP connections, reused LIFO; at most `size` open at once."""
+
+    def __init__(self, size: int):
+        self._slots = BoundedSemaphore(max(1, size))
+        self._idle: list[tuple[smtplib.SMTP, float]] = []  # (connection, last used)
+        self._lock = Lock()
+        self.handshakes = 0
+
+    def _connect(self) -> smtplib.SMTP:
+        server = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=SMTP_TIMEOUT)
+        try:
+            server.starttls(context=ssl.create_default_context())  # upgrade to TLS
+            server.login(SMTP_USER, SMTP_PASS)
+        except BaseException:
+            _close(server)
+            raise
+        with self._lock:
+            self.handshakes += 1
+        return server
+
+    def _take_idle(self) -> Optional[smtplib.SMTP]:
+        while True:
+            with self._lock:
+                if not self._idle:
+                    return None
+                server, last_used = self._idle.pop()
+            idle = time.monotonic() - last_used
+            if idle > SMTP_IDLE_TIMEOUT:
+                _close(server)
+                continue
+            if idle > SMTP_NOOP_AFTER:
+                try:
+                    code, _ = server.noop()
+                except (smtplib.SMTPException, OSError):
+                    code = None
+                if code != 250:
+                    _close(server)
+                    continue
+            return server
+
+    @contextmanager
+    def connection(self) -> Iterator[smtplib.SMTP]:
+        """
+        A logged-in connection for one or more sends. It goes back to the pool
+        afterwards unless the block raised, in which case it is closed.
+        """
+        if not self._slots.acquire(timeout=SMTP_TIMEOUT):
+            raise TimeoutError("no SMTP connection available")
+        try:
+            server = self._take_idle() or self._connect()
+            try:
+                yield server
+            except BaseException:
+                _close(server)
+                raise
+            with self._lock:
+                self._idle.append((server, time.monotonic()))
+        finally:
+            self._slots.release()
+
+    def send(self, msg: EmailMessage) -> None:
+        """Send on a pooled connection; once more on a new one if the server hung up."""
+        try:
+            with self.connection() as server:
+                server.send_message(msg)
+        except _CONNECTION_ERRORS:
+            logger.info("SMTP connection lost, reconnecting")
+            with self.connection() as server:
+                server.send_message(msg)
+
+    def close(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for server, _ in idle:
+            _close(server)
 
+
+def _close(server: smtplib.SMTP) -> None:
+    try:
+        server.quit()
+    except Exception:
+        server.close()
+
+
+pool = SmtpPool(SMTP_POOL_SIZE)
+
+
+def build_message(to_email: str, subject: str, text_body: str, html_body: str | None = None) -> EmailMessage:
     msg = EmailMessage()
     msg["Subject"] = subject
     msg["From"] = FROM_EMAIL
@@ -34,16 +139,30 @@ def send_email(to_email: str, subject: str, text_body: str, html_body: str | Non
 
     if html_body:
         msg.add_alternative(html_body, subtype="html")
+    return msg
 
-    try:
-        context = ssl.create_default_context()
-        with smtplib.SMTP(SMTP_HOST, SMTP_PORT) as server:
-            server.starttls(context=context)  # upgrade to TLS
-            server.login(SMTP_USER, SMTP_PASS)
-            server.send_message(msg)
 
+def send_email(to_email: str, subject: str, text_body: str, html_body: str | None = None) -> None:
+    """
+    Sends an email using Gmail SMTP (via app password), over a pooled connection.
+    """
+    if not smtp_configured():
+        logger.warning(
+            "SMTP not configured. Would have sent email to %s with subject '%s'",
+            to_email,
+            subject,
+        )
+        return
+
+    try:
+        pool.send(build_message(to_email, subject, text_body, html_body))
         logger.info("Email sent to %s with subject '%s'", to_email, subject)
     except Exception as e:
         logger.error("Error sending email to %s: %s", to_email, e)
         # You can choose to raise here, but for password reset I usually don't:
         # raise
+
+
+def shutdown() -> None:
+    """Close idle pooled connections (app shutdown)."""
+    pool.close()
@@ -0,0 +1,174 @@
+"""
+Resized WebP variants for avatars and event banners.
+
+Decoding and resizing a multi-megabyte phone photo is CPU work, so it runs in
+its own bounded process pool (like password hashing). Workers are handed the
+path of a temp file holding the original, never its bytes: uploads are copied
+there from the spooled request body and presigned uploads are streamed there
+from storage, in chunks, so no image is ever held whole in the API process or
+pickled to a worker. Each variant is
+re-encoded from pixels only, which drops EXIF (GPS, camera, ...) and other
+metadata; the EXIF orientation is applied first so nothing ends up sideways.
+
+Variants are stored next to the original as <key stem>_<size>.webp, refcounted
+like the content-addressed original they derive from. Their URLs are kept as
+{"64": url, "256": url, ...} in users.profile_image_variants /
+events.image_variants so the frontend can pick the smallest adequate size.
+"""
+
+import io
+import os
+import shutil
+import logging
+import tempfile
+from typing import Optional
+
+from fastapi import HTTPException
+
+from .process_pool import BoundedProcessPool, PoolSaturated
+from .r2_client import (
+    upload_file_obj,
+    delete_object,
+    discard_object,
+    get_key_from_url,
+    StorageBusy,
+    StorageTimeout,
+)
+
+logger = logging.getLogger("image_processing")
+
+
+def _sizes(value: str) -> tuple[int, ...]:
+    return tuple(sorted({int(v) for v in value.split(",") if v.strip()}))
+
+
+# Avatars are square-cropped to NxN; banners keep their aspect ratio with the
+# longer edge bounded by N. Sources smaller than N are never upscaled.
+AVATAR_VARIANT_SIZES = _sizes(os.getenv("AVATAR_VARIANT_SIZES", "64,256,1024"))
+BANNER_VARIANT_SIZES = _sizes(os.getenv("BANNER_VARIANT_SIZES", "256,1024,1920"))
+IMAGE_WEBP_QUALITY = int(os.getenv("IMAGE_WEBP_QUALITY", "80"))
+# Refuse to decode anything bigger (decompression bombs); ~50 MP covers any phone
+IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", "50000000"))
+
+IMAGE_PROCESS_WORKERS = int(os.getenv("IMAGE_PROCESS_WORKERS", str(min(2, os.cpu_count() or 1))))
+IMAGE_PROCESS_MAX_PENDING = int(os.getenv("IMAGE_PROCESS_MAX_PENDING", "16"))
+IMAGE_PROCESS_QUEUE_TIMEOUT = float(os.getenv("IMAGE_PROCESS_QUEUE_TIMEOUT", "2"))
+
+pool = BoundedProcessPool(
+    "image-process",
+    max_workers=IMAGE_PROCESS_WORKERS,
+    max_pending=IMAGE_PROCESS_MAX_PENDING,
+    queue_timeout=IMAGE_PROCESS_QUEUE_TIMEOUT,
+)
+
+
+# ---- Worker-side function (must be an importable top-level callable) ----
+
+def _render_variants(
+    path: str,
+    sizes: tuple[int, ...],
+    square: bool,
+    quality: int,
+    max_pixels: int,
+) -> dict[int, bytes]:
+    """Decode the image file at `path` and return {size: WebP bytes}. Raises ValueError on bad input."""
+    from PIL import Image, ImageOps, UnidentifiedImageError
+
+    try:
+        with Image.open(path) as src:
+            if src.width * src.height > max_pixels:
+                raise ValueError(f"image has {src.width}x{src.height} pixels")
+            # JPEG: let libjpeg decode at a reduced scale, still >= the largest variant
+            src.draft("RGB", (max(sizes), max(sizes)))
+            img = ImageOps.exif_transpose(src)  # first frame only for GIF / animated WebP
+            has_alpha = img.mode in ("RGBA", "LA", "PA") or "transparency" in img.info
+            img = img.convert("RGBA" if has_alpha else "RGB")
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError, SyntaxError) as e:
+        raise ValueError(f"cannot decode image: {e}") from None
+
+    img.info.clear()  # no EXIF / XMP / ICC carried into the variants
+
+    out: dict[int, bytes] = {}
+    for size in sizes:
+        if square:
+            edge = min(size, img.width, img.height)
+            variant = ImageOps.fit(img, (edge, edge), Image.Resampling.LANCZOS)
+        else:
+            variant = img.copy()
+            variant.thumbnail((size, size), Image.Resampling.LANCZOS)
+        buf = io.BytesIO()
+        variant.save(buf, "WEBP", quality=quality, method=4)
+        out[size] = buf.getvalue()
+    return out
+
+
+# ---- API-side helpers ----
+
+def variant_key(key: str, size: int) -> str:
+    """avatars/<sha256>.png -> avatars/<sha256>_256.webp"""
+    stem = key.rsplit(".", 1)[0]
+    return f"{stem}_{size}.webp"
+
+
+def image_tempfile():
+    """Named temp file for an original the pool workers read; removed when closed."""
+    return tempfile.NamedTemporaryFile(prefix="image-")
+
+
+def copy_to_tempfile(file_obj, tmp) -> None:
+    """Copy a (spooled) upload into `tmp` in chunks, from the start."""
+    file_obj.seek(0)
+    shutil.copyfileobj(file_obj, tmp, 1024 * 1024)
+    tmp.flush()
+
+
+def render_variants(path: str, *, sizes: tuple[int, ...], square: bool) -> dict[int, bytes]:
+    """Run _render_variants in the pool; 503 when saturated, 415 if the image can't be decoded."""
+    try:
+        return pool.run(_render_variants, path, sizes, square, IMAGE_WEBP_QUALITY, IMAGE_MAX_PIXELS)
+    except PoolSaturated:
+        raise HTTPException(
+            status_code=503,
+            detail="El servidor está ocupado. Intenta de nuevo en unos segundos.",
+            headers={"Retry-After": "2"},
+        )
+    except ValueError as e:
+        logger.info("Rejected image: %s", e)
+        raise HTTPException(status_code=415, detail="No se pudo procesar la imagen.")
+
+
+def store_variants(key: str, path: str, *, sizes: tuple[int, ...], square: bool) -> dict[str, str]:
+    """
+    Render the variants of the original stored at `key` (a local copy of which is
+    at `path`) and upload them next to it. Returns {"<size>": public url}.
+    Blocking: call from sync routes or a threadpool.
+    """
+    rendered = render_variants(path, sizes=sizes, square=square)
+
+    urls: dict[str, str] = {}
+    try:
+        for size, body in rendered.items():
+            urls[str(size)] = upload_file_obj(
+                io.BytesIO(body), key=variant_key(key, size), content_type="image/webp", track=True
+            )
+    except Exception as e:
+        for size in urls:
+            discard_object(variant_key(key, int(size)))
+        if isinstance(e, StorageBusy):
+            raise HTTPException(status_code=503, detail="Demasiadas subidas en curso. Intenta de nuevo en unos segundos.")
+        if isinstance(e, StorageTimeout):
+            raise HTTPException(status_code=504, detail="La subida a R2 tardó demasiado.")
+        raise HTTPException(status_code=500, detail=f"Error subiendo variantes a R2: {e!r}")
+    return urls
+
+
+def delete_variants(variants: Optional[dict]) -> None:
+    """Drop the DB's reference to stored variants (e.g. when the image is replaced)."""
+    for url in (variants or {}).values():
+        key = get_key_from_url(url)
+        if key:
+            delete_object(key)
+
+
+def shutdown() -> None:
+    pool.shutdown()
@@ -0,0 +1,244 @@
+"""
+Image upload guard rails shared by the avatar, banner and generic image routes.
+
+Starlette has already spooled the multipart body (to disk past 1 MiB) when the
+route runs, so nothing here buffers the file: we check the declared size, sniff
+the real type from the first bytes and hand boto3 a size-capped reader that it
+streams to R2 in parts. Oversized requests are refused earlier still, from
+Content-Length, by UploadSizeLimitMiddleware.
+
+The presign / verify helpers implement the direct-to-R2 flow, where the bytes
+never reach the API at all.
+"""
+
+import io
+import os
+import re
+import secrets
+from typing import Optional
+
+from fastapi import HTTPException, UploadFile
+from pydantic import BaseModel, Field
+from starlette.responses import JSONResponse
+
+from .r2_client import (
+    presign_put,
+    head_object,
+    read_object_head,
+    discard_object,
+    StorageBusy,
+    StorageTimeout,
+    StorageUnsupported,
+    R2_PRESIGN_EXPIRES,
+)
+
+MIB = 1024 * 1024
+
+UPLOAD_MAX_AVATAR_BYTES = int(os.getenv("UPLOAD_MAX_AVATAR_BYTES", str(2 * MIB)))
+UPLOAD_MAX_BANNER_BYTES = int(os.getenv("UPLOAD_MAX_BANNER_BYTES", str(8 * MIB)))
+UPLOAD_MAX_IMAGE_BYTES = int(os.getenv("UPLOAD_MAX_IMAGE_BYTES", str(8 * MIB)))
+# Whole request body (multipart framing included); anything bigger is refused unread
+UPLOAD_MAX_REQUEST_BYTES = int(
+    os.getenv(
+        "UPLOAD_MAX_REQUEST_BYTES",
+        str(max(UPLOAD_MAX_AVATAR_BYTES, UPLOAD_MAX_BANNER_BYTES, UPLOAD_MAX_IMAGE_BYTES) + MIB),
+    )
+)
+
+EXTENSIONS = {
+    "image/jpeg": "jpg",
+    "image/png": "png",
+    "image/webp": "webp",
+    "image/gif": "gif",
+}
+
+AVATAR_TYPES = {"image/jpeg", "image/png", "image/webp"}
+IMAGE_TYPES = set(EXTENSIONS)
+
+_SNIFF_BYTES = 16
+
+
+class UploadTooLarge(ValueError):
+    pass
+
+
+class InvalidImage(ValueError):
+    pass
+
+
+def sniff_image_type(head: bytes) -> Optional[str]:
+    """Content type from the file's magic bytes, or None if it isn't a known image."""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    return None
+
+
+class LimitedReader:
+    """
+    File-like wrapper that raises UploadTooLarge as soon as more than `max_bytes`
+    have been read, for bodies whose size wasn't known up front.
+    """
+
+    def __init__(self, file_obj, max_bytes: int):
+        self._file = file_obj
+        self._max = max_bytes
+        self._read = 0
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = self._max + 1 - self._read
+        chunk = self._file.read(min(size, self._max + 1 - self._read))
+        self._read += len(chunk)
+        if self._read > self._max:
+            raise UploadTooLarge(f"upload exceeds {self._max} bytes")
+        return chunk
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        # Only rewinding (after hashing the body); no tell(), so boto3 still streams it
+        if (offset, whence) != (0, 0):
+            raise io.UnsupportedOperation("LimitedReader can only be rewound")
+        self._read = 0
+        return self._file.seek(0)
+
+
+def open_image_upload(file: UploadFile, *, max_bytes: int, allowed: set[str]) -> tuple[LimitedReader, str]:
+    """
+    Validate an uploaded image without reading it into memory.
+
+    Returns (reader to pass to the storage upload, sniffed content type); raises
+    413 / 415 HTTPExceptions. The client-declared content type is ignored.
+    """
+    if file.size is not None and file.size > max_bytes:
+        raise HTTPException(
+            status_code=413,
+            detail=f"La imagen no puede pesar más de {max_bytes // MIB} MB.",
+        )
+
+    head = file.file.read(_SNIFF_BYTES)
+    file.file.seek(0)
+    content_type = sniff_image_type(head)
+    if content_type is None or content_type not in allowed:
+        raise HTTPException(status_code=415, detail="Formato de imagen no soportado.")
+
+    return LimitedReader(file.file, max_bytes), content_type
+
+
+def too_large_error(max_bytes: int) -> HTTPException:
+    """For routes catching UploadTooLarge raised mid-upload by LimitedReader."""
+    return HTTPException(
+        status_code=413,
+        detail=f"La imagen no puede pesar más de {max_bytes // MIB} MB.",
+    )
+
+
+# ---------- Presigned (direct-to-R2) uploads ----------
+
+class PresignRequest(BaseModel):
+    content_type: str
+    size: int = Field(..., gt=0, description="Exact file size in bytes")
+
+
+class FinalizeUpload(BaseModel):
+    key: str
+
+
+def presign_image_upload(
+    payload: PresignRequest,
+    *,
+    key_prefix: str,
+    max_bytes: int,
+    allowed: set[str],
+) -> dict:
+    """
+    Validate the declared type / size and issue a presigned PUT for a fresh key
+    under `key_prefix`. The browser then uploads straight to R2 and calls the
+    matching finalize endpoint with the returned key.
+    """
+    if payload.content_type not in allowed:
+        raise HTTPException(status_code=415, detail="Formato de imagen no soportado.")
+    if payload.size > max_bytes:
+        raise HTTPException(
+            status_code=413,
+            detail=f"La imagen no puede pesar más de {max_bytes // MIB} MB.",
+        )
+
+    key = f"{key_prefix}{secrets.token_hex(16)}.{EXTENSIONS[payload.content_type]}"
+    try:
+        upload_url = presign_put(key, payload.content_type, payload.size)
+    except StorageUnsupported:
+        raise HTTPException(
+            status_code=501,
+            detail="Este almacenamiento no admite subidas directas; usa la subida normal.",
+        )
+    return {
+        "key": key,
+        "upload_url": upload_url,
+        "method": "PUT",
+        "headers": {"Content-Type": payload.content_type},
+        "expires_in": R2_PRESIGN_EXPIRES,
+    }
+
+
+def verify_uploaded_image(key: str, *, key_prefix: str, max_bytes: int, allowed: set[str]) -> str:
+    """
+    Finalize step: the key must be one we issued under `key_prefix` (i.e. for this
+    user / purpose), exist in R2, respect the size limit and really be an allowed
+    image. Bad uploads are deleted. Returns the sniffed content type.
+    """
+    if not re.fullmatch(re.escape(key_prefix) + r"[0-9a-f]{32}\.[a-z]+", key):
+        raise HTTPException(status_code=400, detail="Clave de archivo inválida.")
+
+    try:
+        meta = head_object(key)
+        head = read_object_head(key, _SNIFF_BYTES) if meta else b""
+    except StorageTimeout:
+        raise HTTPException(status_code=504, detail="R2 tardó demasiado en responder.")
+    except StorageBusy:
+        raise HTTPException(status_code=503, detail="Demasiadas subidas en curso. Intenta de nuevo en unos segundos.")
+
+    if meta is None:
+        raise HTTPException(status_code=404, detail="No se encontró el archivo subido.")
+    if meta["size"] > max_bytes:
+        discard_object(key)
+        raise HTTPException(
+            status_code=413,
+            detail=f"La imagen no puede pesar más de {max_bytes // MIB} MB.",
+        )
+
+    content_type = sniff_image_type(head)
+    if content_type is None or content_type not in allowed:
+        discard_object(key)
+        raise HTTPException(status_code=415, detail="Formato de imagen no soportado.")
+    return content_type
+
+
+class UploadSizeLimitMiddleware:
+    """
+    Pure ASGI middleware: refuse multipart requests whose Content-Length is above
+    UPLOAD_MAX_REQUEST_BYTES before the body is read or spooled.
+    """
+
+    def __init__(self, app, max_bytes: int = UPLOAD_MAX_REQUEST_BYTES):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            headers = dict(scope.get("headers") or [])
+            content_type = headers.get(b"content-type", b"")
+            length = headers.get(b"content-length")
+            if content_type.startswith(b"multipart/") and length and length.isdigit():
+                if int(length) > self.max_bytes:
+                    response = JSONResponse(
+                        {"detail": f"El archivo no puede pesar más de {self.max_bytes // MIB} MB."},
+                        status_code=413,
+                    )
+                    await response(scope, receive, send)
+                    return
+        await self.app(scope, receive, send)
@@ -0,0 +1,110 @@
+"""
+Password hashing service.
+
+Argon2 is deliberately slow and memory-hard, so hashing / verifying runs in a
+small bounded process pool instead of the request's worker thread. When the
+pool's queue is full the caller gets a 503 right away rather than every other
+endpoint stalling behind a burst of logins.
+"""
+
+import os
+from typing import Optional
+
+from fastapi import HTTPException
+from passlib.hash import argon2
+
+from .process_pool import BoundedProcessPool, PoolSaturated
+
+# Argon2 cost. Defaults match passlib's, so existing hashes stay valid; calibrate
+# with `python -m algoritmia_api.bench_argon2`. Changing these makes logins
+# transparently rehash stored passwords (see verify_and_update).
+ARGON2_TIME_COST = int(os.getenv("ARGON2_TIME_COST", "3"))
+ARGON2_MEMORY_COST = int(os.getenv("ARGON2_MEMORY_COST", "65536"))  # KiB
+ARGON2_PARALLELISM = int(os.getenv("ARGON2_PARALLELISM", "4"))
+
+hasher = argon2.using(
+    type="ID",
+    rounds=ARGON2_TIME_COST,
+    memory_cost=ARGON2_MEMORY_COST,
+    parallelism=ARGON2_PARALLELISM,
+)
+
+# 0 workers = hash inline in the request thread (local dev, tests)
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(2, os.cpu_count() or 1))))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "32"))
+# How long a request may wait for a free queue slot before getting a 503
+PASSWORD_HASH_QUEUE_TIMEOUT = float(os.getenv("PASSWORD_HASH_QUEUE_TIMEOUT", "1"))
+
+pool = BoundedProcessPool(
+    "password-hash",
+    max_workers=PASSWORD_HASH_WORKERS,
+    max_pending=PASSWORD_HASH_MAX_PENDING,
+    queue_timeout=PASSWORD_HASH_QUEUE_TIMEOUT,
+)
+
+
+# ---- Worker-side functions (must be importable top-level callables) ----
+
+def _hash(password: str) -> str:
+    return hasher.hash(password)
+
+
+def _verify(password: str, password_hash: str) -> bool:
+    return hasher.verify(password, password_hash)
+
+
+def _verify_and_update(password: str, password_hash: str) -> tuple[bool, Optional[str]]:
+    if not hasher.verify(password, password_hash):
+        return False, None
+    if needs_rehash(password_hash):
+        return True, hasher.hash(password)
+    return True, None
+
+
+def needs_rehash(password_hash: str) -> bool:
+    """
+    True if the hash was made with other parameters than the configured ones.
+    (passlib's own needs_update() ignores time/memory/parallelism changes.)
+    """
+    try:
+        h = argon2.from_string(password_hash)
+    except ValueError:
+        return False
+    return (
+        h.type != "id"
+        or h.version != hasher.max_version
+        or h.rounds != ARGON2_TIME_COST
+        or h.memory_cost != ARGON2_MEMORY_COST
+        or h.parallelism != ARGON2_PARALLELISM
+    )
+
+
+def _run(fn, *args):
+    try:
+        return pool.run(fn, *args)
+    except PoolSaturated:
+        raise HTTPException(
+            status_code=503,
+            detail="El servidor está ocupado. Intenta de nuevo en unos segundos.",
+            headers={"Retry-After": "2"},
+        )
+
+
+def hash_password(password: str) -> str:
+    return _run(_hash, password)
+
+
+def verify_password(password: str, password_hash: str) -> bool:
+    return _run(_verify, password, password_hash)
+
+
+def verify_and_update(password: str, password_hash: str) -> tuple[bool, Optional[str]]:
+    """
+    Verify, and if the stored hash uses outdated parameters also return a fresh
+    hash of the same password (computed in the same worker job) to store instead.
+    """
+    return _run(_verify_and_update, password, password_hash)
+
+
+def shutdown() -> None:
+    pool.shutdown()
@@ -0,0 +1,88 @@
+"""
+Bounded process pool for CPU-heavy work (password hashing, image processing).
+
+A plain ProcessPoolExecutor queues without limit, so a burst of requests just
+piles up behind the workers while every caller holds a threadpool slot. Here
+at most `max_workers + max_pending` jobs may be in flight; past that, submit()
+waits up to `queue_timeout` seconds for room and then raises PoolSaturated so
+the route can answer 503 instead of starving every other endpoint.
+"""
+
+import os
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from threading import BoundedSemaphore, Lock
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger("process_pool")
+
+
+class PoolSaturated(RuntimeError):
+    """Too many jobs are already running or queued."""
+
+
+class BoundedProcessPool:
+    def __init__(self, name: str, max_workers: int, max_pending: int, queue_timeout: float = 0):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.queue_timeout = queue_timeout
+        self._slots = BoundedSemaphore(max(1, max_workers + max_pending))
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = Lock()
+
+    @property
+    def enabled(self) -> bool:
+        """max_workers <= 0 runs jobs inline in the calling thread (dev / tests)."""
+        return self.max_workers > 0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # spawn: never fork a process that holds DB pool / HTTP client threads
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+                logger.info("%s process pool started (%s workers)", self.name, self.max_workers)
+            return self._executor
+
+    def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """Run fn(*args) in a worker process and wait for the result."""
+        if not self.enabled:
+            return fn(*args)
+
+        if self.queue_timeout > 0:
+            acquired = self._slots.acquire(timeout=self.queue_timeout)
+        else:
+            acquired = self._slots.acquire(blocking=False)
+        if not acquired:
+            logger.warning("%s process pool saturated; rejecting job", self.name)
+            raise PoolSaturated(f"{self.name} pool is saturated")
+
+        try:
+            try:
+                future = self._get_executor().submit(fn, *args)
+            except BrokenProcessPool:
+                # A worker died (OOM kill, ...); start a fresh pool once
+                self._reset()
+                future = self._get_executor().submit(fn, *args)
+            return future.result()
+        finally:
+            self._slots.release()
+
+    def _reset(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            logger.warning("%s process pool is broken; restarting it", self.name)
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+            logger.info("%s process pool stopped", self.name)
@@ -1,82 +1,418 @@
+"""
+Storage facade used by the routes (named after R2, the production backend).
+
+The actual backend (R2, S3, local files, memory; see storage_backends) is built
+on first use, so importing this module is cheap and the app starts even when
+storage isn't configured. Every backend call runs on a small dedicated thread
+pool, so an upload never runs on the event loop and a slow backend can't eat the
+whole anyio threadpool either. Past R2_MAX_PENDING calls in flight, callers get
+StorageBusy.
+"""
+
 import os
-import boto3
-from botocore.client import Config
-
-R2_ACCOUNT_ID = os.getenv("R2_ACCOUNT_ID")
-R2_ACCESS_KEY_ID = os.getenv("R2_ACCESS_KEY_ID")
-R2_SECRET_ACCESS_KEY = os.getenv("R2_SECRET_ACCESS_KEY")
-R2_BUCKET_NAME = os.getenv("R2_BUCKET_NAME")
-R2_PUBLIC_BASE_URL = os.getenv("R2_PUBLIC_BASE_URL")  # e.g. https://pub-...r2.dev
-
-if not all([R2_ACCOUNT_ID, R2_ACCESS_KEY_ID, R2_SECRET_ACCESS_KEY, R2_BUCKET_NAME]):
-    raise RuntimeError("Missing R2 configuration environment variables")
-
-# S3-compatible endpoint for API access
-R2_ENDPOINT_URL = f"https://{R2_ACCOUNT_ID}.r2.cloudflarestorage.com"
-
-s3_client = boto3.client(
-    "s3",
-    endpoint_url=R2_ENDPOINT_URL,
-    aws_access_key_id=R2_ACCESS_KEY_ID,
-    aws_secret_access_key=R2_SECRET_ACCESS_KEY,
-    config=Config(signature_version="s3v4"),
-    region_name="auto",  # required but ignored by R2
+import asyncio
+import hashlib
+import logging
+import secrets
+import time
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from threading import BoundedSemaphore, Lock
+from typing import Optional
+
+from . import db
+from .storage_backends import (
+    StorageBackend,
+    StorageNotConfigured,
+    StorageUnsupported,
+    create_backend,
+    R2_MULTIPART_THRESHOLD,
+    R2_MULTIPART_CHUNKSIZE,
+    R2_TRANSFER_CONCURRENCY,
 )
+from .tables import storage_objects
+
+logger = logging.getLogger("r2_client")
+
+R2_CONCURRENCY = int(os.getenv("R2_CONCURRENCY", "4"))
+R2_MAX_PENDING = int(os.getenv("R2_MAX_PENDING", "32"))
+# One client per process, shared by every upload thread and its part threads
+R2_MAX_POOL_CONNECTIONS = int(
+    os.getenv("R2_MAX_POOL_CONNECTIONS", str(R2_CONCURRENCY * R2_TRANSFER_CONCURRENCY + 2))
+)
+R2_UPLOAD_TIMEOUT = float(os.getenv("R2_UPLOAD_TIMEOUT", "60"))  # whole call, retries included
+# Lifetime of presigned upload URLs handed to browsers
+R2_PRESIGN_EXPIRES = int(os.getenv("R2_PRESIGN_EXPIRES", "600"))
+# Content-addressed avatars / banners: keyed by SHA-256, uploaded once, refcounted
+# in storage_objects. 0 = random keys and immediate deletes, as before.
+R2_DEDUP = os.getenv("R2_DEDUP", "1") != "0"
+# Unreferenced objects touched more recently than this are left for the GC, so a
+# request that just re-uploaded the same bytes never loses them
+R2_DEDUP_GRACE = int(os.getenv("R2_DEDUP_GRACE", "86400"))  # seconds
+
+_backend: Optional[StorageBackend] = None
+_backend_lock = Lock()
+
+
+def get_backend() -> StorageBackend:
+    """The configured backend, created on first use. Raises StorageNotConfigured."""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = create_backend(max_pool_connections=R2_MAX_POOL_CONNECTIONS)
+                logger.info("Storage backend: %s", _backend.name)
+    return _backend
+
+
+def set_backend(backend: Optional[StorageBackend]) -> None:
+    """Swap the backend (tests, benchmarks); None goes back to lazy creation from the env."""
+    global _backend
+    with _backend_lock:
+        _backend = backend
+
+
+_executor = ThreadPoolExecutor(max_workers=R2_CONCURRENCY, thread_name_prefix="r2")
+_slots = BoundedSemaphore(R2_CONCURRENCY + R2_MAX_PENDING)
+
+
+class StorageBusy(RuntimeError):
+    """Too many storage calls are already running or queued."""
+
+
+class StorageTimeout(TimeoutError):
+    """A storage call took longer than R2_UPLOAD_TIMEOUT."""
+
+
+def _submit(fn, *args):
+    if not _slots.acquire(blocking=False):
+        raise StorageBusy("R2 upload queue is full")
+    try:
+        future = _executor.submit(fn, *args)
+    except BaseException:
+        _slots.release()
+        raise
+    future.add_done_callback(lambda _: _slots.release())
+    return future
+
+
+def public_url(key: str) -> str:
+    """
+    URL for a key we just stored; by then the backend exists, so unlike
+    get_key_from_url this doesn't have to cope with StorageNotConfigured.
+    """
+    return get_backend().public_url(key)
+
+
+_stats_lock = Lock()
+_stats = {"uploads": 0, "failed": 0, "multipart": 0, "bytes": 0, "parts": 0, "seconds": 0.0, "max_seconds": 0.0}
+
+
+def upload_stats() -> dict:
+    """Upload counters since startup, plus the transfer settings they were measured with."""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["mib_per_s"] = round(stats["bytes"] / stats["seconds"] / (1024 * 1024), 2) if stats["seconds"] else None
+    stats["seconds"] = round(stats["seconds"], 3)
+    stats["max_seconds"] = round(stats["max_seconds"], 3)
+    stats["config"] = {
+        "concurrency": R2_CONCURRENCY,
+        "max_pending": R2_MAX_PENDING,
+        "max_pool_connections": R2_MAX_POOL_CONNECTIONS,
+        "multipart_threshold": R2_MULTIPART_THRESHOLD,
+        "multipart_chunksize": R2_MULTIPART_CHUNKSIZE,
+        "transfer_concurrency": R2_TRANSFER_CONCURRENCY,
+    }
+    return stats
 
 
-def upload_file_obj(file_obj, key: str, content_type: str | None = None) -> str:
+def _put(file_obj, key: str, content_type: str | None) -> None:
+    started = time.perf_counter()
+    try:
+        result = get_backend().put(file_obj, key, content_type)
+    except Exception:
+        with _stats_lock:
+            _stats["failed"] += 1
+        raise
+    elapsed = time.perf_counter() - started
+
+    with _stats_lock:
+        _stats["uploads"] += 1
+        _stats["multipart"] += result.parts > 1
+        _stats["bytes"] += result.size
+        _stats["parts"] += result.parts
+        _stats["seconds"] += elapsed
+        _stats["max_seconds"] = max(_stats["max_seconds"], elapsed)
+    logger.info(
+        "Uploaded %s: %s bytes, %s part(s), %.0f ms (%.1f MiB/s)",
+        key, result.size, result.parts, elapsed * 1000,
+        result.size / elapsed / (1024 * 1024) if elapsed else 0.0,
+    )
+
+
+def _delete(key: str) -> None:
+    try:
+        get_backend().delete(key)
+    except Exception:
+        # we don't want avatar deletion to crash user actions
+        logger.warning("Could not delete R2 object %s", key, exc_info=True)
+
+
+def _sha256(file_obj) -> tuple[str, int]:
+    """Digest and size of a file-like object, rewound afterwards for the upload."""
+    h = hashlib.sha256()
+    size = 0
+    while chunk := file_obj.read(1024 * 1024):
+        h.update(chunk)
+        size += len(chunk)
+    file_obj.seek(0)
+    return h.hexdigest(), size
+
+
+def _store(file_obj, key: str, content_type: str | None, sha256: str, size: int) -> bool:
+    """Record `key` in storage_objects and upload it unless it already exists. True if bytes were sent."""
+    # Takes a pooled connection of its own, like _release: callers (upload routes)
+    # must not sit on another one while they wait for this, or uploads drain the pool
+    with db.connect() as conn:
+        storage_objects.touch(conn, key, sha256, size, content_type)
+        conn.commit()
+    if _head(key) is not None:
+        return False
+    _put(file_obj, key, content_type)
+    return True
+
+
+def _put_tracked(file_obj, key: str, content_type: str | None) -> None:
+    digest, size = _sha256(file_obj)
+    _store(file_obj, key, content_type, digest, size)
+
+
+def _put_content_addressed(file_obj, prefix: str, ext: str, content_type: str | None) -> str:
+    if not R2_DEDUP:
+        key = f"{prefix}{secrets.token_hex(16)}.{ext}"
+        _put(file_obj, key, content_type)
+        return key
+    digest, size = _sha256(file_obj)
+    key = f"{prefix}{digest}.{ext}"
+    if not _store(file_obj, key, content_type, digest, size):
+        logger.info("R2 object %s already stored; upload skipped", key)
+    return key
+
+
+def _release(key: str, delete_untracked: bool) -> None:
+    with db.connect() as conn:
+        row = storage_objects.lock_for_release(conn, key)
+        if row is None:
+            conn.rollback()
+            if delete_untracked:
+                _delete(key)
+            return
+        refcount = max(0, row["refcount"] - 1)
+        storage_objects.set_refcount(conn, key, refcount)
+        # The decrement stands on its own: a failed or slow delete below never undoes it
+        conn.commit()
+        grace_ends = row["touched_at"] + timedelta(seconds=R2_DEDUP_GRACE)
+        if refcount > 0 or grace_ends > datetime.now(timezone.utc):
+            return
+
+        # Unreferenced: delete it now rather than waiting for the GC. The row lock is
+        # held until the object is gone, so a concurrent upload of the same bytes
+        # (storage_objects.touch) waits and then re-uploads; only that key waits.
+        if not storage_objects.lock_if_unreferenced(conn, key, R2_DEDUP_GRACE):
+            conn.rollback()  # referenced again, re-touched or being deleted elsewhere
+            return
+        try:
+            get_backend().delete(key)
+        except Exception:
+            conn.rollback()
+            logger.warning("Could not delete R2 object %s; left for the GC", key, exc_info=True)
+            return
+        storage_objects.forget(conn, key)
+        conn.commit()
+
+
+def upload_file_obj(file_obj, key: str, content_type: str | None = None, track: bool = False) -> str:
     """
     Uploads a file-like object to R2 under the given key.
     Returns the public URL to access it.
+
+    For sync routes (already off the event loop). Raises StorageBusy when the
+    upload queue is full and StorageTimeout after R2_UPLOAD_TIMEOUT seconds.
+    track=True (for keys derived from a content address, e.g. image variants)
+    refcounts the object and skips the upload if the key already exists.
     """
-    extra_args = {}
-    if content_type:
-        extra_args["ContentType"] = content_type
-
-    s3_client.upload_fileobj(
-        Fileobj=file_obj,
-        Bucket=R2_BUCKET_NAME,
-        Key=key,
-        ExtraArgs=extra_args,
-    )
+    fn = _put_tracked if track and R2_DEDUP else _put
+    try:
+        _submit(fn, file_obj, key, content_type).result(timeout=R2_UPLOAD_TIMEOUT)
+    except FutureTimeoutError:
+        raise StorageTimeout(f"R2 upload of {key} timed out")
+    return public_url(key)
 
-    # Public URL using the bucket's public domain
-    if R2_PUBLIC_BASE_URL:
-        base = R2_PUBLIC_BASE_URL.rstrip("/")
-        return f"{base}/{key}"
 
-    # Fallback: generic S3-style URL (bucket in path)
-    return f"https://{R2_ACCOUNT_ID}.r2.cloudflarestorage.com/{R2_BUCKET_NAME}/{key}"
+def upload_content_addressed(file_obj, prefix: str, ext: str, content_type: str | None = None) -> tuple[str, str]:
+    """
+    Upload under `<prefix><sha256>.<ext>` and return (key, public URL). Hashing
+    reads the (already spooled) body once before anything is sent; when the key
+    exists in R2 the transfer is skipped. The caller records a reference with
+    retain_urls() when it stores the URL. `file_obj` must support seek(0).
+    """
+    try:
+        key = _submit(_put_content_addressed, file_obj, prefix, ext, content_type).result(timeout=R2_UPLOAD_TIMEOUT)
+    except FutureTimeoutError:
+        raise StorageTimeout(f"R2 upload under {prefix} timed out")
+    return key, public_url(key)
+
+
+async def upload_content_addressed_async(
+    file_obj, prefix: str, ext: str, content_type: str | None = None
+) -> tuple[str, str]:
+    """upload_content_addressed for `async def` routes."""
+    future = asyncio.wrap_future(_submit(_put_content_addressed, file_obj, prefix, ext, content_type))
+    try:
+        key = await asyncio.wait_for(future, timeout=R2_UPLOAD_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise StorageTimeout(f"R2 upload under {prefix} timed out")
+    return key, public_url(key)
+
+
+async def upload_file_obj_async(file_obj, key: str, content_type: str | None = None) -> str:
+    """upload_file_obj for `async def` routes: awaits the upload without blocking the loop."""
+    future = asyncio.wrap_future(_submit(_put, file_obj, key, content_type))
+    try:
+        await asyncio.wait_for(future, timeout=R2_UPLOAD_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise StorageTimeout(f"R2 upload of {key} timed out")
+    return public_url(key)
+
+
+def _drop(key: str, delete_untracked: bool) -> None:
+    if R2_DEDUP:
+        _release(key, delete_untracked)
+    elif delete_untracked:
+        _delete(key)
 
 
 def delete_object(key: str) -> None:
     """
     Delete an object from R2 by key. No-op if it fails.
+    Refcounted objects only lose one reference, and are removed once nothing
+    references them any more.
     """
     try:
-        s3_client.delete_object(Bucket=R2_BUCKET_NAME, Key=key)
+        _submit(_drop, key, True).result(timeout=R2_UPLOAD_TIMEOUT)
     except Exception:
-        # we don't want avatar deletion to crash user actions
-        pass
+        logger.warning("Could not delete R2 object %s", key, exc_info=True)
 
 
-def get_key_from_url(url: str) -> str | None:
+async def delete_object_async(key: str) -> None:
+    """delete_object for `async def` routes. No-op if it fails."""
+    try:
+        await asyncio.wait_for(asyncio.wrap_future(_submit(_drop, key, True)), timeout=R2_UPLOAD_TIMEOUT)
+    except Exception:
+        logger.warning("Could not delete R2 object %s", key, exc_info=True)
+
+
+def release_object(key: str) -> None:
+    """Like delete_object, but objects that aren't refcounted are left alone."""
+    try:
+        _submit(_drop, key, False).result(timeout=R2_UPLOAD_TIMEOUT)
+    except Exception:
+        logger.warning("Could not release R2 object %s", key, exc_info=True)
+
+
+def discard_object(key: str) -> None:
     """
-    Given a public URL, try to recover the object key.
-    Works for:
-    - https://pub-xxx.r2.dev/<key>
-    - https://ACCOUNT_ID.r2.cloudflarestorage.com/bucket/<key>
+    Clean up after a failed request: remove an object we uploaded but never
+    referenced. Refcounted objects may be shared, so those are left for the GC.
     """
-    if not url:
-        return None
+    if R2_DEDUP:
+        with db.connect() as conn:
+            if db.fetchone(conn, "SELECT 1 FROM storage_objects WHERE key=%s", [key]):
+                return
+    try:
+        _submit(_delete, key).result(timeout=R2_UPLOAD_TIMEOUT)
+    except Exception:
+        logger.warning("Could not delete R2 object %s", key, exc_info=True)
+
+
+def retain_urls(conn, urls) -> None:
+    """One more DB reference to each refcounted object behind `urls` (in the caller's transaction)."""
+    if R2_DEDUP:
+        storage_objects.retain(conn, [get_key_from_url(u) for u in urls if u])
+
 
-    if R2_PUBLIC_BASE_URL and url.startswith(R2_PUBLIC_BASE_URL.rstrip("/") + "/"):
-        return url[len(R2_PUBLIC_BASE_URL.rstrip("/")) + 1 :]
+def presign_put(key: str, content_type: str, content_length: int, expires: int = R2_PRESIGN_EXPIRES) -> str:
+    """
+    URL the browser can PUT the file to directly, bypassing the API.
+
+    Content-Type and Content-Length are part of the signature, so the upload must
+    match what we validated when issuing it. (R2 doesn't implement S3's presigned
+    POST policies, so the size condition is the signed exact length.)
+    Raises StorageUnsupported on the local / memory backends.
+    """
+    return get_backend().presign_put(key, content_type, content_length, expires)
 
-    # handle generic S3-style URL: .../bucket/key
-    marker = f"/{R2_BUCKET_NAME}/"
-    idx = url.find(marker)
-    if idx != -1:
-        return url[idx + len(marker) :]
 
-    return None
+def _head(key: str) -> dict | None:
+    return get_backend().head(key)
+
+
+def _read_head(key: str, length: int) -> bytes:
+    return get_backend().read(key, length)
+
+
+def _get(key: str) -> bytes:
+    return get_backend().read(key)
+
+
+def _download(key: str, file_obj) -> None:
+    get_backend().download(key, file_obj)
+    file_obj.flush()
+
+
+def head_object(key: str) -> dict | None:
+    """{"size", "content_type"} of an object, or None if it doesn't exist."""
+    try:
+        return _submit(_head, key).result(timeout=R2_UPLOAD_TIMEOUT)
+    except FutureTimeoutError:
+        raise StorageTimeout(f"R2 HEAD of {key} timed out")
+
+
+def read_object_head(key: str, length: int) -> bytes:
+    """First `length` bytes of an object (ranged GET), e.g. to check magic bytes."""
+    try:
+        return _submit(_read_head, key, length).result(timeout=R2_UPLOAD_TIMEOUT)
+    except FutureTimeoutError:
+        raise StorageTimeout(f"R2 read of {key} timed out")
+
+
+def read_object(key: str) -> bytes:
+    """Whole object body (callers check the size with head_object first)."""
+    try:
+        return _submit(_get, key).result(timeout=R2_UPLOAD_TIMEOUT)
+    except FutureTimeoutError:
+        raise StorageTimeout(f"R2 read of {key} timed out")
+
+
+def download_object(key: str, file_obj) -> None:
+    """Stream an object into `file_obj` (e.g. a temp file) instead of reading it into memory."""
+    try:
+        _submit(_download, key, file_obj).result(timeout=R2_UPLOAD_TIMEOUT)
+    except FutureTimeoutError:
+        raise StorageTimeout(f"R2 download of {key} timed out")
+
+
+def get_key_from_url(url: str) -> str | None:
+    """
+    Given a public URL, try to recover the object key (None for URLs that
+    aren't ours, e.g. external images). With no storage configured nothing
+    is ours, so this returns None instead of raising StorageNotConfigured:
+    deleting an event or the GC's scan must not fail over an external URL.
+    """
+    if not url:
+        return None
+    try:
+        backend = get_backend()
+    except StorageNotConfigured:
+        return None
+    return backend.key_from_url(url)
@@ -0,0 +1,47 @@
+# algoritmia_api/routes/storage.py
+
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Query, Depends
+
+from ..tables.auth import get_current_user
+from ..tables.audit_logs import add_audit_log
+from ..storage_gc import collect_garbage, R2_GC_GRACE
+from ..r2_client import get_backend, upload_stats
+
+router = APIRouter(prefix="/storage", tags=["Storage"])
+
+
+@router.get("/stats")
+def storage_stats(auth_ctx = Depends(get_current_user)):
+    """Admin-only: upload counters of this worker (bytes, parts, time) and its transfer settings."""
+    if auth_ctx["user"].get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Solo administradores pueden ver estas métricas.")
+    return {"backend": get_backend().name, "uploads": upload_stats()}
+
+
+@router.post("/gc")
+def run_storage_gc(
+    dry_run: bool = Query(True, description="Only report what would be deleted"),
+    grace_hours: Optional[float] = Query(None, ge=1),
+    auth_ctx = Depends(get_current_user),
+):
+    """Admin-only: collect orphaned R2 objects now and return the summary report."""
+    user = auth_ctx["user"]
+    if user.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Solo administradores pueden limpiar el almacenamiento.")
+
+    grace = int(grace_hours * 3600) if grace_hours is not None else R2_GC_GRACE
+    report = collect_garbage(dry_run=dry_run, grace=grace)
+    if "skipped" in report:
+        raise HTTPException(status_code=409, detail="Ya hay una limpieza en curso.")
+
+    add_audit_log(
+        actor_user_id=user["id"],
+        action="storage.gc",
+        entity_table=None,
+        entity_id=None,
+        metadata={k: v for k, v in report.items() if k != "sample"},
+    )
+
+    return report
@@ -6,7 +6,19 @@ from datetime import datetime
 from fastapi import APIRouter, UploadFile, File, HTTPException, Depends
 
 from ..tables.auth import get_current_user
-from ..r2_client import upload_file_obj
+from ..r2_client import upload_file_obj_async, public_url, StorageBusy, StorageTimeout
+from ..image_uploads import (
+    open_image_upload,
+    too_large_error,
+    presign_image_upload,
+    verify_uploaded_image,
+    PresignRequest,
+    FinalizeUpload,
+    UploadTooLarge,
+    UPLOAD_MAX_IMAGE_BYTES,
+    IMAGE_TYPES,
+    EXTENSIONS,
+)
 
 router = APIRouter(prefix="/uploads", tags=["Uploads"])
 
@@ -16,22 +28,22 @@ async def upload_image(
     file: UploadFile = File(...),
     current_user=Depends(get_current_user),
 ):
-    # Basic validation
-    if not file.content_type or not file.content_type.startswith("image/"):
-        raise HTTPException(status_code=400, detail="El archivo debe ser una imagen")
+    reader, content_type = open_image_upload(
+        file, max_bytes=UPLOAD_MAX_IMAGE_BYTES, allowed=IMAGE_TYPES
+    )
 
-    # Generate a unique key: e.g. images/users/<id>/<uuid>.ext
-    ext = ""
-    if "." in file.filename:
-        ext = file.filename.rsplit(".", 1)[-1].lower()
+    # Generate a unique key: e.g. images/<user id>/<uuid>.ext (ext from the sniffed type)
+    key = f"images/{current_user['user']['id']}/{uuid.uuid4().hex}.{EXTENSIONS[content_type]}"
 
-    key = f"images/{current_user['id']}/{uuid.uuid4().hex}"
-    if ext:
-        key += f".{ext}"
-
-    # Upload to R2
+    # Upload to R2 (off the event loop)
     try:
-        url = upload_file_obj(file.file, key=key, content_type=file.content_type)
+        url = await upload_file_obj_async(reader, key=key, content_type=content_type)
+    except UploadTooLarge:
+        raise too_large_error(UPLOAD_MAX_IMAGE_BYTES)
+    except StorageBusy:
+        raise HTTPException(status_code=503, detail="Demasiadas subidas en curso. Intenta de nuevo en unos segundos.")
+    except StorageTimeout:
+        raise HTTPException(status_code=504, detail="La subida a R2 tardó demasiado.")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error subiendo a R2: {e!r}")
 
@@ -40,3 +52,32 @@ async def upload_image(
     # await db.execute("UPDATE users SET avatar_url = %s WHERE id = %s", (url, current_user["id"]))
 
     return {"url": url, "key": key}
+
+
+@router.post("/image/presign")
+def presign_image(
+    payload: PresignRequest,
+    current_user=Depends(get_current_user),
+):
+    """Direct-to-R2 upload, step 1: presigned PUT URL under images/<user id>/."""
+    return presign_image_upload(
+        payload,
+        key_prefix=f"images/{current_user['user']['id']}/",
+        max_bytes=UPLOAD_MAX_IMAGE_BYTES,
+        allowed=IMAGE_TYPES,
+    )
+
+
+@router.post("/image/finalize")
+def finalize_image(
+    payload: FinalizeUpload,
+    current_user=Depends(get_current_user),
+):
+    """Direct-to-R2 upload, step 2: checks the uploaded object and returns its URL."""
+    verify_uploaded_image(
+        payload.key,
+        key_prefix=f"images/{current_user['user']['id']}/",
+        max_bytes=UPLOAD_MAX_IMAGE_BYTES,
+        allowed=IMAGE_TYPES,
+    )
+    return {"url": public_url(payload.key), "key": payload.key}
@@ -0,0 +1,37 @@
+import asyncio
+import logging
+from typing import Callable
+
+logger = logging.getLogger("scheduler")
+
+
+async def _run_periodically(name: str, interval: float, fn: Callable[[], object], initial_delay: float) -> None:
+    await asyncio.sleep(initial_delay)
+    while True:
+        try:
+            # Jobs are plain sync functions (psycopg / urllib); keep them off the event loop
+            await asyncio.to_thread(fn)
+        except Exception:
+            logger.exception("Periodic job %s failed", name)
+        await asyncio.sleep(interval)
+
+
+def start_periodic(
+    name: str,
+    interval: float,
+    fn: Callable[[], object],
+    *,
+    initial_delay: float = 0,
+) -> asyncio.Task:
+    """
+    Run `fn` every `interval` seconds in a worker thread until the task is cancelled.
+    Must be called from inside the running loop (app lifespan).
+    """
+    logger.info("Scheduling %s every %ss", name, interval)
+    return asyncio.create_task(_run_periodically(name, interval, fn, initial_delay), name=name)
+
+
+async def stop_all(tasks: list[asyncio.Task]) -> None:
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,445 @@
+"""
+Object storage backends behind the r2_client facade.
+
+STORAGE_BACKEND picks one:
+  r2      Cloudflare R2 (R2_ACCOUNT_ID / R2_ACCESS_KEY_ID / R2_SECRET_ACCESS_KEY / R2_BUCKET_NAME)
+  s3      any S3-compatible service (S3_BUCKET_NAME, S3_ENDPOINT_URL, S3_REGION, AWS credentials chain)
+  local   files under STORAGE_LOCAL_DIR, served by the API at STORAGE_LOCAL_BASE_URL (dev)
+  memory  a dict in this process (tests, offline benchmarks)
+
+R2 / S3 uploads go through one boto3 client per process with a TransferConfig
+from R2_MULTIPART_*: bodies from R2_MULTIPART_THRESHOLD up are sent as
+multipart uploads, R2_TRANSFER_CONCURRENCY parts at a time.
+
+Nothing is built at import time: boto3 is only imported, and missing settings
+only reported, when the first storage call needs the backend.
+"""
+
+import io
+import os
+import shutil
+import mimetypes
+import tempfile
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Iterator, Optional
+from urllib.parse import urlsplit
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "r2").lower()
+
+R2_CONNECT_TIMEOUT = float(os.getenv("R2_CONNECT_TIMEOUT", "5"))  # seconds
+R2_READ_TIMEOUT = float(os.getenv("R2_READ_TIMEOUT", "30"))
+
+MIB = 1024 * 1024
+# Parts must be >= 5 MiB (except the last), so with these defaults an 8 MiB
+# banner goes up as two parts in parallel instead of one 8 MiB PutObject
+R2_MULTIPART_THRESHOLD = int(os.getenv("R2_MULTIPART_THRESHOLD", str(5 * MIB)))
+R2_MULTIPART_CHUNKSIZE = int(os.getenv("R2_MULTIPART_CHUNKSIZE", str(5 * MIB)))
+R2_TRANSFER_CONCURRENCY = int(os.getenv("R2_TRANSFER_CONCURRENCY", "4"))  # parts in flight per upload
+
+STORAGE_LOCAL_DIR = os.getenv("STORAGE_LOCAL_DIR", "uploads/storage")
+STORAGE_LOCAL_BASE_URL = os.getenv("STORAGE_LOCAL_BASE_URL", "http://localhost:8000/files")
+
+DELETE_BATCH = 1000  # S3 DeleteObjects limit
+
+
+class StorageNotConfigured(RuntimeError):
+    """The selected backend is missing required settings."""
+
+
+class StorageUnsupported(NotImplementedError):
+    """The operation (e.g. presigned uploads) isn't available on this backend."""
+
+
+@dataclass
+class PutResult:
+    size: int  # bytes sent
+    parts: int  # 1 unless it was a multipart upload
+
+
+@dataclass
+class ObjectInfo:
+    key: str
+    size: int
+    last_modified: datetime
+
+
+class StorageBackend:
+    """Blocking interface; r2_client runs every call on its bounded thread pool."""
+
+    name = "base"
+
+    def put(self, file_obj, key: str, content_type: Optional[str]) -> PutResult:
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        """Remove `key`; deleting a missing key is not an error. Raises on failure."""
+        raise NotImplementedError
+
+    def delete_many(self, keys: list[str]) -> list[str]:
+        """Remove up to DELETE_BATCH keys; returns the keys that could not be deleted."""
+        failed = []
+        for key in keys:
+            try:
+                self.delete(key)
+            except Exception:
+                failed.append(key)
+        return failed
+
+    def head(self, key: str) -> Optional[dict]:
+        """{"size", "content_type"} or None if the object doesn't exist."""
+        raise NotImplementedError
+
+    def read(self, key: str, length: Optional[int] = None) -> bytes:
+        """The object's bytes (only the first `length` if given)."""
+        raise NotImplementedError
+
+    def download(self, key: str, file_obj) -> None:
+        """Stream the whole object into `file_obj` (seekable, writable) without holding it in memory."""
+        raise NotImplementedError
+
+    def list(self, prefix: str) -> Iterator[ObjectInfo]:
+        raise NotImplementedError
+
+    def public_url(self, key: str) -> str:
+        raise NotImplementedError
+
+    def key_from_url(self, url: str) -> Optional[str]:
+        raise NotImplementedError
+
+    def presign_put(self, key: str, content_type: str, content_length: int, expires: int) -> str:
+        raise StorageUnsupported(f"{self.name} storage has no presigned uploads")
+
+
+# ---------- R2 / S3 ----------
+
+class _ByteCounter:
+    """upload_fileobj progress callback; called from the transfer threads."""
+
+    def __init__(self):
+        self.total = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, amount: int) -> None:
+        with self._lock:
+            self.total += amount  # negative when a part is retried
+
+
+class S3Backend(StorageBackend):
+    name = "s3"
+
+    def __init__(
+        self,
+        *,
+        bucket: str,
+        endpoint_url: Optional[str],
+        region: Optional[str],
+        access_key_id: Optional[str],
+        secret_access_key: Optional[str],
+        public_base_url: Optional[str],
+        max_pool_connections: int,
+    ):
+        import boto3
+        from boto3.s3.transfer import TransferConfig
+        from botocore.client import Config
+
+        self.bucket = bucket
+        self.endpoint_url = endpoint_url
+        self.public_base_url = public_base_url.rstrip("/") if public_base_url else None
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=endpoint_url,
+            aws_access_key_id=access_key_id,
+            aws_secret_access_key=secret_access_key,
+            config=Config(
+                signature_version="s3v4",
+                connect_timeout=R2_CONNECT_TIMEOUT,
+                read_timeout=R2_READ_TIMEOUT,
+                retries={"max_attempts": 3, "mode": "standard"},
+                max_pool_connections=max_pool_connections,
+            ),
+            region_name=region,
+        )
+        # Part threads share the client's connection pool, so max_pool_connections
+        # must cover every upload's parts in flight (see R2_MAX_POOL_CONNECTIONS)
+        self.transfer_config = TransferConfig(
+            multipart_threshold=R2_MULTIPART_THRESHOLD,
+            multipart_chunksize=R2_MULTIPART_CHUNKSIZE,
+            max_concurrency=R2_TRANSFER_CONCURRENCY,
+            use_threads=R2_TRANSFER_CONCURRENCY > 1,
+        )
+
+    def parts_for(self, size: int) -> int:
+        if size < self.transfer_config.multipart_threshold:
+            return 1
+        return -(-size // self.transfer_config.multipart_chunksize)
+
+    def put(self, file_obj, key, content_type):
+        extra_args = {}
+        if content_type:
+            extra_args["ContentType"] = content_type
+        sent = _ByteCounter()
+        self.client.upload_fileobj(
+            Fileobj=file_obj,
+            Bucket=self.bucket,
+            Key=key,
+            ExtraArgs=extra_args,
+            Config=self.transfer_config,
+            Callback=sent,
+        )
+        return PutResult(sent.total, self.parts_for(sent.total))
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+
+    def delete_many(self, keys):
+        resp = self.client.delete_objects(
+            Bucket=self.bucket,
+            Delete={"Objects": [{"Key": k} for k in keys], "Quiet": True},
+        )
+        return [err.get("Key") for err in resp.get("Errors") or []]
+
+    def head(self, key):
+        from botocore.exceptions import ClientError
+
+        try:
+            resp = self.client.head_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+        return {"size": resp["ContentLength"], "content_type": resp.get("ContentType")}
+
+    def read(self, key, length=None):
+        params = {"Bucket": self.bucket, "Key": key}
+        if length is not None:
+            params["Range"] = f"bytes=0-{length - 1}"
+        return self.client.get_object(**params)["Body"].read()
+
+    def download(self, key, file_obj):
+        self.client.download_fileobj(
+            Bucket=self.bucket, Key=key, Fileobj=file_obj, Config=self.transfer_config
+        )
+
+    def list(self, prefix):
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix, PaginationConfig={"PageSize": 1000}):
+            for obj in page.get("Contents", []):
+                yield ObjectInfo(obj["Key"], obj.get("Size", 0), obj["LastModified"])
+
+    def public_url(self, key):
+        # Public URL using the bucket's public domain
+        if self.public_base_url:
+            return f"{self.public_base_url}/{key}"
+        # Fallback: generic S3-style URL (bucket in path)
+        return f"{self.endpoint_url}/{self.bucket}/{key}"
+
+    def key_from_url(self, url):
+        """
+        Works for:
+        - https://pub-xxx.r2.dev/<key>
+        - https://ACCOUNT_ID.r2.cloudflarestorage.com/bucket/<key>
+        """
+        if self.public_base_url and url.startswith(self.public_base_url + "/"):
+            return url[len(self.public_base_url) + 1 :]
+
+        # handle generic S3-style URL: .../bucket/key
+        marker = f"/{self.bucket}/"
+        idx = url.find(marker)
+        if idx != -1:
+            return url[idx + len(marker) :]
+        return None
+
+    def presign_put(self, key, content_type, content_length, expires):
+        # Content-Type and Content-Length are signed. Pure local signing: no network call.
+        return self.client.generate_presigned_url(
+            "put_object",
+            Params={
+                "Bucket": self.bucket,
+                "Key": key,
+                "ContentType": content_type,
+                "ContentLength": content_length,
+            },
+            ExpiresIn=expires,
+            HttpMethod="PUT",
+        )
+
+
+def _r2_backend(max_pool_connections: int) -> S3Backend:
+    account_id = os.getenv("R2_ACCOUNT_ID")
+    access_key_id = os.getenv("R2_ACCESS_KEY_ID")
+    secret_access_key = os.getenv("R2_SECRET_ACCESS_KEY")
+    bucket = os.getenv("R2_BUCKET_NAME")
+    if not all([account_id, access_key_id, secret_access_key, bucket]):
+        raise StorageNotConfigured("Missing R2 configuration environment variables")
+
+    backend = S3Backend(
+        bucket=bucket,
+        # S3-compatible endpoint for API access
+        endpoint_url=f"https://{account_id}.r2.cloudflarestorage.com",
+        region="auto",  # required but ignored by R2
+        access_key_id=access_key_id,
+        secret_access_key=secret_access_key,
+        public_base_url=os.getenv("R2_PUBLIC_BASE_URL"),  # e.g. https://pub-...r2.dev
+        max_pool_connections=max_pool_connections,
+    )
+    backend.name = "r2"
+    return backend
+
+
+def _s3_backend(max_pool_connections: int) -> S3Backend:
+    bucket = os.getenv("S3_BUCKET_NAME")
+    if not bucket:
+        raise StorageNotConfigured("Missing S3_BUCKET_NAME")
+    region = os.getenv("S3_REGION")
+    endpoint_url = os.getenv("S3_ENDPOINT_URL") or (
+        f"https://s3.{region}.amazonaws.com" if region else "https://s3.amazonaws.com"
+    )
+    # Credentials: AWS_ACCESS_KEY_ID / AWS_SECRET_ACCESS_KEY or the usual boto3 chain
+    return S3Backend(
+        bucket=bucket,
+        endpoint_url=endpoint_url,
+        region=region,
+        access_key_id=os.getenv("S3_ACCESS_KEY_ID"),
+        secret_access_key=os.getenv("S3_SECRET_ACCESS_KEY"),
+        public_base_url=os.getenv("S3_PUBLIC_BASE_URL"),
+        max_pool_connections=max_pool_connections,
+    )
+
+
+# ---------- Local filesystem ----------
+
+class LocalBackend(StorageBackend):
+    name = "local"
+
+    def __init__(self, root: str, base_url: str):
+        self.root = Path(root).resolve()
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.base_url = base_url.rstrip("/")
+
+    def _path(self, key: str) -> Path:
+        path = (self.root / key).resolve()
+        if self.root not in path.parents:
+            raise ValueError(f"key outside storage root: {key!r}")
+        return path
+
+    def put(self, file_obj, key, content_type):
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write next to the target and rename, so readers never see a partial file
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".upload-")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                shutil.copyfileobj(file_obj, out, MIB)
+                size = out.tell()
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        return PutResult(size, 1)
+
+    def delete(self, key):
+        self._path(key).unlink(missing_ok=True)
+
+    def head(self, key):
+        path = self._path(key)
+        if not path.is_file():
+            return None
+        return {"size": path.stat().st_size, "content_type": mimetypes.guess_type(path.name)[0]}
+
+    def read(self, key, length=None):
+        with open(self._path(key), "rb") as f:
+            return f.read() if length is None else f.read(length)
+
+    def download(self, key, file_obj):
+        with open(self._path(key), "rb") as f:
+            shutil.copyfileobj(f, file_obj, MIB)
+
+    def list(self, prefix):
+        # Walk only the directory the prefix points into
+        start = self.root / prefix.rsplit("/", 1)[0] if "/" in prefix else self.root
+        for dirpath, dirnames, filenames in os.walk(start):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if filename.startswith(".upload-"):
+                    continue
+                path = Path(dirpath) / filename
+                key = path.relative_to(self.root).as_posix()
+                if key.startswith(prefix):
+                    st = path.stat()
+                    yield ObjectInfo(key, st.st_size, datetime.fromtimestamp(st.st_mtime, timezone.utc))
+
+    def public_url(self, key):
+        return f"{self.base_url}/{key}"
+
+    def key_from_url(self, url):
+        if url.startswith(self.base_url + "/"):
+            return url[len(self.base_url) + 1 :]
+        return None
+
+
+def local_mount_path() -> str:
+    """URL path the app serves STORAGE_LOCAL_DIR at (from STORAGE_LOCAL_BASE_URL)."""
+    return urlsplit(STORAGE_LOCAL_BASE_URL).path.rstrip("/") or "/files"
+
+
+# ---------- In-memory ----------
+
+class MemoryBackend(StorageBackend):
+    name = "memory"
+    base_url = "memory://"
+
+    def __init__(self):
+        self._objects: dict[str, tuple[bytes, Optional[str], datetime]] = {}
+        self._lock = threading.Lock()
+
+    def put(self, file_obj, key, content_type):
+        buf = io.BytesIO()
+        shutil.copyfileobj(file_obj, buf, MIB)
+        with self._lock:
+            self._objects[key] = (buf.getvalue(), content_type, datetime.now(timezone.utc))
+        return PutResult(buf.tell(), 1)
+
+    def delete(self, key):
+        with self._lock:
+            self._objects.pop(key, None)
+
+    def head(self, key):
+        obj = self._objects.get(key)
+        return {"size": len(obj[0]), "content_type": obj[1]} if obj else None
+
+    def read(self, key, length=None):
+        try:
+            data = self._objects[key][0]
+        except KeyError:
+            raise FileNotFoundError(key) from None
+        return data if length is None else data[:length]
+
+    def download(self, key, file_obj):
+        file_obj.write(self.read(key))
+
+    def list(self, prefix):
+        with self._lock:
+            items = sorted((k, v) for k, v in self._objects.items() if k.startswith(prefix))
+        for key, (data, _, modified) in items:
+            yield ObjectInfo(key, len(data), modified)
+
+    def public_url(self, key):
+        return f"{self.base_url}{key}"
+
+    def key_from_url(self, url):
+        return url[len(self.base_url):] if url.startswith(self.base_url) else None
+
+
+def create_backend(name: str = STORAGE_BACKEND, *, max_pool_connections: int = 10) -> StorageBackend:
+    if name == "r2":
+        return _r2_backend(max_pool_connections)
+    if name == "s3":
+        return _s3_backend(max_pool_connections)
+    if name == "local":
+        return LocalBackend(STORAGE_LOCAL_DIR, STORAGE_LOCAL_BASE_URL)
+    if name == "memory":
+        return MemoryBackend()
+    raise StorageNotConfigured(f"Unknown STORAGE_BACKEND {name!r} (r2, s3, local or memory)")
@@ -0,0 +1,243 @@
+"""
+Garbage collection of orphaned R2 objects.
+
+Uploads that never end up referenced (a banner for an event that was never
+created, /uploads/image files, failed requests, deletes that didn't go
+through) stay in the bucket forever. This job pages through the bucket
+listing under R2_GC_PREFIXES, compares every key with the set of keys the DB
+references (users / events images and their variants, resource and contest
+URLs, refcounted storage_objects) and deletes the rest once they are older
+than R2_GC_GRACE, with DeleteObjects calls of up to 1000 keys.
+
+It runs daily from the app lifespan (R2_GC_INTERVAL) and can be run by hand:
+  cd Api
+  python -m algoritmia_api.storage_gc --dry-run
+  python -m algoritmia_api.storage_gc --grace-hours 72 --prefix images/
+Admins can also call POST /storage/gc (dry run by default).
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from urllib.parse import urlsplit, unquote
+
+from . import db
+from .r2_client import get_backend, get_key_from_url
+from .storage_backends import DELETE_BATCH
+
+logger = logging.getLogger("storage_gc")
+
+R2_GC_INTERVAL = int(os.getenv("R2_GC_INTERVAL", "86400"))  # seconds, 0 = never
+R2_GC_GRACE = int(os.getenv("R2_GC_GRACE", "86400"))  # objects younger than this are kept
+# Only app-managed prefixes are ever collected
+R2_GC_PREFIXES = tuple(
+    p.strip() for p in os.getenv("R2_GC_PREFIXES", "avatars/,events/banners/,images/").split(",") if p.strip()
+)
+R2_GC_DRY_RUN = os.getenv("R2_GC_DRY_RUN", "0") == "1"
+# Safety cap per run; the rest is picked up by the next run
+R2_GC_MAX_DELETES = int(os.getenv("R2_GC_MAX_DELETES", "10000"))
+
+SAMPLE_SIZE = 20
+
+REFERENCES_SQL = """
+SELECT profile_image_url AS url FROM users WHERE profile_image_url IS NOT NULL
+UNION ALL
+SELECT v.url FROM users, jsonb_each_text(profile_image_variants) AS v(size, url)
+UNION ALL
+SELECT image_url FROM events WHERE image_url IS NOT NULL
+UNION ALL
+SELECT v.url FROM events, jsonb_each_text(image_variants) AS v(size, url)
+UNION ALL
+SELECT url FROM resources
+UNION ALL
+SELECT url FROM contests
+"""
+
+
+def _url_keys(url: str) -> set[str]:
+    """
+    Keys a stored URL may point at. Besides the current public / S3-style forms
+    (get_key_from_url) we accept the plain path and the path minus its first
+    segment, so URLs saved under an older R2_PUBLIC_BASE_URL still protect their object.
+    """
+    keys = set()
+    key = get_key_from_url(url)
+    if key:
+        keys.add(key)
+    path = unquote(urlsplit(url).path).lstrip("/")
+    if path:
+        keys.add(path)
+        if "/" in path:
+            keys.add(path.split("/", 1)[1])
+    return keys
+
+
+def load_references(conn, grace: int) -> set[str]:
+    """Every key the DB references, plus refcounted objects that are in use or were just touched."""
+    referenced: set[str] = set()
+    with conn.cursor() as cur:
+        cur.execute(REFERENCES_SQL)
+        for row in cur:
+            referenced |= _url_keys(row["url"])
+        cur.execute(
+            """
+            SELECT key FROM storage_objects
+            WHERE refcount > 0 OR touched_at > NOW() - make_interval(secs => %s)
+            """,
+            [grace],
+        )
+        referenced.update(row["key"] for row in cur)
+    conn.commit()
+    return referenced
+
+
+def _delete_batch(conn, keys: list[str], grace: int, report: dict) -> None:
+    # Refcounted objects may have been re-uploaded or referenced since the listing;
+    # their row locks also make concurrent uploads of the same bytes wait for us
+    busy = {
+        r["key"]
+        for r in db.fetchall(
+            conn,
+            """
+            SELECT key, refcount > 0 OR touched_at > NOW() - make_interval(secs => %s) AS busy
+            FROM storage_objects WHERE key = ANY(%s)
+            ORDER BY key
+            FOR UPDATE
+            """,
+            [grace, keys],
+        )
+        if r["busy"]
+    }
+    keys = [k for k in keys if k not in busy]
+    report["referenced"] += len(busy)
+    report["orphans"] -= len(busy)
+    if not keys:
+        conn.rollback()
+        return
+
+    try:
+        failed = set(get_backend().delete_many(keys))
+    except Exception:
+        conn.rollback()
+        logger.exception("Batch delete of %s keys failed", len(keys))
+        report["failed"] += len(keys)
+        return
+
+    if failed:
+        logger.warning("Could not delete %s keys, e.g. %s", len(failed), sorted(failed)[:5])
+    deleted = [k for k in keys if k not in failed]
+
+    db.execute(conn, "DELETE FROM storage_objects WHERE key = ANY(%s)", [deleted], commit=False)
+    conn.commit()
+    report["deleted"] += len(deleted)
+    report["failed"] += len(failed)
+
+
+def collect_garbage(
+    *,
+    dry_run: bool = R2_GC_DRY_RUN,
+    grace: int = R2_GC_GRACE,
+    prefixes: tuple[str, ...] = R2_GC_PREFIXES,
+    max_deletes: int = R2_GC_MAX_DELETES,
+) -> dict:
+    """
+    Delete unreferenced objects older than `grace` seconds under `prefixes` and
+    return a summary. With dry_run nothing is deleted; the report says what would be.
+    """
+    started = time.monotonic()
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=grace)
+    report = {
+        "dry_run": dry_run,
+        "grace_seconds": grace,
+        "prefixes": list(prefixes),
+        "scanned": 0,
+        "referenced": 0,
+        "recent": 0,
+        "orphans": 0,
+        "orphan_bytes": 0,
+        "deleted": 0,
+        "failed": 0,
+        "capped": False,
+        "by_prefix": {},
+        "sample": [],
+    }
+
+    with db.connect() as conn, db.advisory_lock(conn, "r2_orphan_gc") as locked:
+        if not locked:
+            return {"skipped": "another GC run is active"}
+
+        referenced = load_references(conn, grace)
+        backend = get_backend()
+        batch: list[str] = []
+
+        for prefix in prefixes:
+            orphans_before = report["orphans"]
+            # Paged listing (1000 keys per request on R2 / S3)
+            for obj in backend.list(prefix):
+                report["scanned"] += 1
+                if obj.key in referenced:
+                    report["referenced"] += 1
+                    continue
+                if obj.last_modified > cutoff:
+                    report["recent"] += 1
+                    continue
+
+                report["orphans"] += 1
+                report["orphan_bytes"] += obj.size
+                if len(report["sample"]) < SAMPLE_SIZE:
+                    report["sample"].append(obj.key)
+                if dry_run:
+                    continue
+                if report["deleted"] + report["failed"] + len(batch) >= max_deletes:
+                    report["capped"] = True
+                    continue
+
+                batch.append(obj.key)
+                if len(batch) == DELETE_BATCH:
+                    _delete_batch(conn, batch, grace, report)
+                    batch = []
+            report["by_prefix"][prefix] = report["orphans"] - orphans_before
+
+        if batch:
+            _delete_batch(conn, batch, grace, report)
+
+    report["duration_s"] = round(time.monotonic() - started, 2)
+    logger.info(
+        "R2 GC%s: scanned %s, orphans %s (%s bytes), deleted %s, failed %s",
+        " (dry run)" if dry_run else "",
+        report["scanned"], report["orphans"], report["orphan_bytes"], report["deleted"], report["failed"],
+    )
+    return report
+
+
+def run_job() -> dict:
+    """Periodic job entry point (scheduler)."""
+    return collect_garbage()
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Delete orphaned R2 objects.")
+    parser.add_argument("--dry-run", action="store_true", help="only report what would be deleted")
+    parser.add_argument("--grace-hours", type=float, default=R2_GC_GRACE / 3600)
+    parser.add_argument("--prefix", action="append", help="bucket prefix to scan (repeatable)")
+    parser.add_argument("--max-deletes", type=int, default=R2_GC_MAX_DELETES)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    report = collect_garbage(
+        dry_run=args.dry_run,
+        grace=int(args.grace_hours * 3600),
+        prefixes=tuple(args.prefix) if args.prefix else R2_GC_PREFIXES,
+        max_deletes=args.max_deletes,
+    )
+    print(json.dumps(report, indent=2, default=str))
+    return 1 if report.get("failed") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,37 +1,268 @@
+import io
+import os
+import csv
+import gzip
 import json
-from typing import Optional, Any
+import zlib
+import base64
+import logging
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+from typing import Iterator, Literal, Optional, Any
 
-from fastapi import APIRouter, HTTPException, Depends, Request
+from psycopg import sql
+
+from fastapi import APIRouter, HTTPException, Depends, Request, Query
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 
-from .. import db
+from .. import db, db_async, audit_writer
+
+logger = logging.getLogger("audit_logs")
 
 router = APIRouter(prefix="/audit-logs", tags=["AuditLogs"])
 
+# Monthly partitions kept ahead of time, and how many months stay online
+AUDIT_PARTITIONS_AHEAD = int(os.getenv("AUDIT_PARTITIONS_AHEAD", "3"))
+AUDIT_RETENTION_MONTHS = int(os.getenv("AUDIT_RETENTION_MONTHS", "12"))  # 0 = keep forever
+AUDIT_ARCHIVE_DIR = Path(os.getenv("AUDIT_ARCHIVE_DIR", "archives/audit_logs"))
+AUDIT_MAINTENANCE_INTERVAL = int(os.getenv("AUDIT_MAINTENANCE_INTERVAL", str(24 * 60 * 60)))
+# Rows fetched per round trip by the streaming export
+AUDIT_EXPORT_BATCH = int(os.getenv("AUDIT_EXPORT_BATCH", "2000"))
+
 
+# Range-partitioned by month on created_at. Partitions are created
+# AUDIT_PARTITIONS_AHEAD months ahead by ensure_partitions() (on /init and from
+# the daily maintenance job). There is deliberately no DEFAULT partition: it
+# would stop Postgres from scanning partitions in order, and then
+# "newest N logs" would have to probe every month instead of only the latest.
 DDL = """
+CREATE SEQUENCE IF NOT EXISTS audit_logs_id_seq;
+
 CREATE TABLE IF NOT EXISTS audit_logs (
-    id             BIGSERIAL PRIMARY KEY,
+    id             BIGINT NOT NULL DEFAULT nextval('audit_logs_id_seq'),
     actor_user_id  BIGINT REFERENCES users(id) ON DELETE SET NULL,
     action         TEXT NOT NULL,
     entity_table   TEXT,
     entity_id      BIGINT,
     metadata       JSONB,
-    created_at     TIMESTAMPTZ DEFAULT NOW()
-);
+    created_at     TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+ALTER SEQUENCE audit_logs_id_seq OWNED BY audit_logs.id;
 
 CREATE INDEX IF NOT EXISTS idx_auditlogs_actor   ON audit_logs(actor_user_id);
 CREATE INDEX IF NOT EXISTS idx_auditlogs_entity  ON audit_logs(entity_table, entity_id);
-CREATE INDEX IF NOT EXISTS idx_auditlogs_created ON audit_logs(created_at);
+
+-- keyset pagination walks (created_at, id) backwards
+DROP INDEX IF EXISTS idx_auditlogs_created;
+CREATE INDEX IF NOT EXISTS idx_auditlogs_created_id ON audit_logs(created_at, id);
+-- cheap block-range index for wide time-range scans (rows arrive in time order)
+CREATE INDEX IF NOT EXISTS idx_auditlogs_created_brin ON audit_logs USING brin(created_at);
+-- action prefix filters ("auth.", "user.avatar.")
+CREATE INDEX IF NOT EXISTS idx_auditlogs_action ON audit_logs(action text_pattern_ops);
+-- metadata @> '{...}' containment filters
+CREATE INDEX IF NOT EXISTS idx_auditlogs_metadata ON audit_logs USING gin(metadata jsonb_path_ops);
+
+-- Per (UTC day, action, actor) counts, kept by the audit writer thread: batches it
+-- flushes are counted directly, rows written in route transactions go through
+-- audit_log_stats_pending first (see audit_writer). Outlives the partitions retention drops.
+CREATE TABLE IF NOT EXISTS audit_log_daily_stats (
+    day            DATE NOT NULL,
+    action         TEXT NOT NULL,
+    actor_user_id  BIGINT NOT NULL DEFAULT 0,   -- 0 = no actor (system / anonymous)
+    count          BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, action, actor_user_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_auditstats_action ON audit_log_daily_stats(action text_pattern_ops, day);
+CREATE INDEX IF NOT EXISTS idx_auditstats_actor  ON audit_log_daily_stats(actor_user_id, day);
+
+-- Not yet counted: one row per audit_logs row written inside a route transaction
+CREATE TABLE IF NOT EXISTS audit_log_stats_pending (
+    day            DATE NOT NULL,
+    action         TEXT NOT NULL,
+    actor_user_id  BIGINT NOT NULL DEFAULT 0
+);
+"""
+
+# First run with the rollup table (or after the legacy migration): count what is
+# already there. Afterwards the audit writer keeps it current.
+BACKFILL_STATS = """
+INSERT INTO audit_log_daily_stats(day, action, actor_user_id, count)
+SELECT (created_at AT TIME ZONE 'UTC')::date, action, COALESCE(actor_user_id, 0), COUNT(*)
+FROM audit_logs
+GROUP BY 1, 2, 3
+"""
+
+# Pre-partitioning installs had a plain audit_logs table: move it aside, create the
+# partitioned one and copy the rows over (same sequence, so ids keep counting).
+MIGRATE_LEGACY_PRE = """
+ALTER TABLE audit_logs RENAME TO audit_logs_legacy;
+ALTER INDEX IF EXISTS audit_logs_pkey RENAME TO audit_logs_legacy_pkey;
+DROP INDEX IF EXISTS idx_auditlogs_actor, idx_auditlogs_entity, idx_auditlogs_created;
+ALTER SEQUENCE IF EXISTS audit_logs_id_seq OWNED BY NONE;
+"""
+
+MIGRATE_LEGACY_POST = """
+INSERT INTO audit_logs (id, actor_user_id, action, entity_table, entity_id, metadata, created_at)
+SELECT id, actor_user_id, action, entity_table, entity_id, metadata, COALESCE(created_at, NOW())
+FROM audit_logs_legacy;
+
+SELECT setval('audit_logs_id_seq', GREATEST((SELECT MAX(id) FROM audit_logs), 1));
+
+DROP TABLE audit_logs_legacy;
 """
 
 
 def ensure_table(conn) -> None:
     with conn.cursor() as cur:
+        cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('audit_logs')")
+        row = cur.fetchone()
+        legacy = row is not None and row["relkind"] == "r"
+        if legacy:
+            logger.warning("Migrating audit_logs to a partitioned table")
+            cur.execute(MIGRATE_LEGACY_PRE)
         cur.execute(DDL)
+        if legacy:
+            cur.execute("SELECT MIN(created_at) AS oldest FROM audit_logs_legacy")
+            oldest = cur.fetchone()["oldest"]
+            ensure_partitions(conn, since=oldest, commit=False)
+            cur.execute(MIGRATE_LEGACY_POST)
+        cur.execute(
+            "SELECT NOT EXISTS (SELECT 1 FROM audit_log_daily_stats) "
+            "AND EXISTS (SELECT 1 FROM audit_logs) AS needs_backfill"
+        )
+        if cur.fetchone()["needs_backfill"]:
+            cur.execute(BACKFILL_STATS)
+    ensure_partitions(conn, commit=False)
     conn.commit()
 
 
+# ---------- Partition maintenance ----------
+
+def _month_start(d: date) -> date:
+    return date(d.year, d.month, 1)
+
+
+def _add_months(d: date, months: int) -> date:
+    y, m = divmod(d.month - 1 + months, 12)
+    return date(d.year + y, m + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"audit_logs_{month.year:04d}_{month.month:02d}"
+
+
+def _create_partition(cur, month: date) -> bool:
+    """Create the partition for `month` unless it exists. True if it was created."""
+    name = partition_name(month)
+    cur.execute("SELECT to_regclass(%s) IS NOT NULL AS present", [name])
+    if cur.fetchone()["present"]:
+        return False
+
+    lo, hi = month.isoformat(), _add_months(month, 1).isoformat()
+    cur.execute(
+        sql.SQL("CREATE TABLE {} PARTITION OF audit_logs FOR VALUES FROM ({}) TO ({})").format(
+            sql.Identifier(name),
+            sql.Literal(f"{lo} 00:00:00+00"),
+            sql.Literal(f"{hi} 00:00:00+00"),
+        )
+    )
+    logger.info("Created audit log partition %s", name)
+    return True
+
+
+def ensure_partitions(conn, *, since: Optional[datetime] = None, commit: bool = True) -> list[str]:
+    """
+    Make sure monthly partitions exist from `since` (default: this month) through
+    AUDIT_PARTITIONS_AHEAD months into the future.
+    """
+    today = datetime.now(timezone.utc).date()
+    month = _month_start(since.astimezone(timezone.utc).date() if since else today)
+    last = _add_months(_month_start(today), AUDIT_PARTITIONS_AHEAD)
+
+    created = []
+    with conn.cursor() as cur:
+        while month <= last:
+            if _create_partition(cur, month):
+                created.append(partition_name(month))
+            month = _add_months(month, 1)
+    if commit:
+        conn.commit()
+    return created
+
+
+def _archive_partition(conn, name: str) -> Path:
+    """COPY a (detached) partition to a gzip'd CSV in AUDIT_ARCHIVE_DIR."""
+    AUDIT_ARCHIVE_DIR.mkdir(parents=True, exist_ok=True)
+    final = AUDIT_ARCHIVE_DIR / f"{name}.csv.gz"
+    tmp = final.with_suffix(".gz.tmp")
+    with conn.cursor() as cur, gzip.open(tmp, "wb") as out:
+        copy_sql = sql.SQL("COPY {} TO STDOUT WITH (FORMAT csv, HEADER true)").format(sql.Identifier(name))
+        with cur.copy(copy_sql) as copy:
+            for chunk in copy:
+                out.write(chunk)
+    with open(tmp, "rb+") as f:
+        os.fsync(f.fileno())
+    tmp.replace(final)
+    return final
+
+
+def apply_retention() -> dict:
+    """
+    Detach partitions older than AUDIT_RETENTION_MONTHS, archive each one to
+    AUDIT_ARCHIVE_DIR and only then drop it. Partitions left detached by an
+    interrupted run are picked up again on the next one.
+    """
+    if AUDIT_RETENTION_MONTHS <= 0:
+        return {"skipped": "retention disabled"}
+
+    cutoff = _add_months(_month_start(datetime.now(timezone.utc).date()), -AUDIT_RETENTION_MONTHS)
+    cutoff_name = partition_name(cutoff)
+    archived = []
+
+    with db.connect() as conn, db.advisory_lock(conn, "audit_logs_retention") as locked:
+        if not locked:
+            return {"skipped": "another retention run is active"}
+
+        rows = db.fetchall(
+            conn,
+            """
+            SELECT c.relname,
+                   EXISTS (SELECT 1 FROM pg_inherits i WHERE i.inhrelid = c.oid) AS attached
+            FROM pg_class c
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = current_schema()
+              AND c.relkind = 'r'
+              AND c.relname ~ '^audit_logs_[0-9]{4}_[0-9]{2}$'
+            ORDER BY c.relname
+            """,
+        )
+        # Names sort chronologically, so comparing them compares months
+        expired = [r for r in rows if r["relname"] < cutoff_name]
+
+        for r in expired:
+            name = r["relname"]
+            ident = sql.Identifier(name)
+            if r["attached"]:
+                db.execute(conn, sql.SQL("ALTER TABLE audit_logs DETACH PARTITION {}").format(ident))
+            path = _archive_partition(conn, name)
+            db.execute(conn, sql.SQL("DROP TABLE {}").format(ident))
+            logger.info("Archived audit log partition %s to %s", name, path)
+            archived.append(name)
+
+    return {"archived": archived, "cutoff": cutoff.isoformat()}
+
+
+def maintain_partitions() -> dict:
+    """Periodic job: create upcoming partitions, then apply retention."""
+    with db.connect() as conn:
+        created = ensure_partitions(conn)
+    return {"created": created, **apply_retention()}
+
+
 class AuditLogCreate(BaseModel):
     actor_user_id: Optional[int] = None
     action: str
@@ -40,11 +271,6 @@ class AuditLogCreate(BaseModel):
     metadata: Optional[dict[str, Any]] = None
 
 
-import json
-from typing import Optional, Any
-
-# ... imports, router, DDL, etc. ...
-
 
 def add_audit_log(
     *,
@@ -53,56 +279,102 @@ def add_audit_log(
     entity_table: Optional[str] = None,
     entity_id: Optional[int] = None,
     metadata: Optional[dict[str, Any]] = None,
+    conn=None,
+    sync: bool = False,
 ) -> None:
     """
     Internal helper to append an audit log entry.
 
     Used by other routers (auth, users, contests, etc.).
     Does NOT depend on get_current_user, so it's safe to import from auth.py.
+
+    Pass the request connection (db.get_conn) as `conn` to write the row inside the
+    caller's transaction: it is NOT committed here, so it lands atomically with the
+    change it describes when the route commits. Without `conn` the row is written
+    and committed without blocking the request: it is queued for the background
+    audit writer, which flushes in batches. Use `sync=True` for security-critical
+    actions that must be on disk before the response is sent.
     """
     json_metadata = json.dumps(metadata, default=str) if metadata is not None else None
+    entry = audit_writer.make_entry(actor_user_id, action, entity_table, entity_id, json_metadata)
 
-    with db.connect() as conn:
-        db.execute(
-            conn,
-            """
-            INSERT INTO audit_logs(actor_user_id, action, entity_table, entity_id, metadata)
-            VALUES (%s,%s,%s,%s,%s::jsonb)
-            """,
-            [actor_user_id, action, entity_table, entity_id, json_metadata],
-        )
+    if conn is not None:
+        audit_writer.insert_entry(conn, entry)
+        return
+
+    if not sync and audit_writer.writer.submit(entry):
+        return
+
+    with db.connect() as own_conn:
+        audit_writer.insert_entry(own_conn, entry)
+        own_conn.commit()
 
 # ---------- Admin-only dependency without top-level import of auth ----------
 
-def _require_admin(request: Request):
-    """
-    Lazy-imports get_current_user to avoid circular imports.
+def _check_admin(auth_ctx: dict) -> dict:
+    if auth_ctx["user"].get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Solo administradores pueden ver los logs.")
+    return auth_ctx
 
-    auth.py can safely do:
-        from .audit_logs import add_audit_log
 
-    and we only import auth.get_current_user here when a request actually hits
-    an /audit-logs endpoint.
+def _require_admin(request: Request, conn = Depends(db.get_conn)):
     """
-    from .auth import get_current_user  # local import breaks the circular dependency
+    Admin guard for sync routes, on the route's own request connection.
 
-    auth_ctx = get_current_user(request)
-    user = auth_ctx["user"]
-    if user.get("role") != "admin":
-        raise HTTPException(status_code=403, detail="Solo administradores pueden ver los logs.")
-    return auth_ctx
+    Lazy-imports the auth dependencies to avoid circular imports: auth.py can
+    safely do `from .audit_logs import add_audit_log`, and we only import auth
+    here when a request actually hits an /audit-logs endpoint.
+    """
+    from .auth import get_current_user_sync  # local import breaks the circular dependency
+
+    return _check_admin(get_current_user_sync(request, conn))
+
+
+async def _require_admin_async(request: Request, conn = Depends(db_async.get_conn)):
+    """_require_admin for async routes on db_async.get_conn."""
+    from .auth import get_current_user_async
+
+    return _check_admin(await get_current_user_async(request, conn))
+
+
+async def _require_admin_no_conn(request: Request):
+    """For routes without a request connection (export streams on its own)."""
+    from .auth import get_current_user
+
+    return _check_admin(await get_current_user(request))
 
 
 # ---------- Endpoints (admin-only) ----------
 
-@router.get("")
-def list_audit_logs(
-    actor_user_id: Optional[int] = None,
-    entity_table: Optional[str] = None,
-    entity_id: Optional[int] = None,
-    auth_ctx = Depends(_require_admin),
-):
-    base = "SELECT * FROM audit_logs"
+def _encode_cursor(row: dict) -> str:
+    raw = json.dumps([row["created_at"].isoformat(), row["id"]])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=422, detail="Cursor inválido.")
+
+
+def _like_prefix(prefix: str) -> str:
+    return prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+def _build_filters(
+    *,
+    actor_user_id: Optional[int],
+    entity_table: Optional[str],
+    entity_id: Optional[int],
+    action: Optional[str],
+    since: Optional[datetime],
+    until: Optional[datetime],
+    metadata: Optional[str],
+) -> tuple[list[str], list]:
+    """WHERE clauses + params shared by the list and export endpoints."""
     clauses = []
     params: list = []
 
@@ -115,16 +387,249 @@ def list_audit_logs(
     if entity_id is not None:
         clauses.append("entity_id=%s")
         params.append(entity_id)
+    if action:
+        clauses.append("action LIKE %s")
+        params.append(_like_prefix(action))
+    if since is not None:
+        clauses.append("created_at >= %s")
+        params.append(since)
+    if until is not None:
+        clauses.append("created_at < %s")
+        params.append(until)
+    if metadata:
+        try:
+            contained = json.loads(metadata)
+        except ValueError:
+            contained = None
+        if not isinstance(contained, dict):
+            raise HTTPException(status_code=422, detail="metadata debe ser un objeto JSON.")
+        clauses.append("metadata @> %s::jsonb")
+        params.append(json.dumps(contained))
+
+    return clauses, params
+
+
+@router.get("")
+def list_audit_logs(
+    actor_user_id: Optional[int] = None,
+    entity_table: Optional[str] = None,
+    entity_id: Optional[int] = None,
+    action: Optional[str] = Query(None, description="Action prefix, e.g. 'auth.' or 'user.avatar'"),
+    since: Optional[datetime] = Query(None, description="created_at >= since"),
+    until: Optional[datetime] = Query(None, description="created_at < until"),
+    metadata: Optional[str] = Query(None, description='JSON object the metadata must contain, e.g. {"provider":"local"}'),
+    limit: int = Query(100, ge=1, le=500),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    auth_ctx = Depends(_require_admin),
+    conn = Depends(db.get_conn),
+):
+    """
+    Newest first, keyset-paginated on (created_at, id): pass the returned
+    `next_cursor` to get the next page. Time bounds also prune whole partitions.
+    """
+    clauses, params = _build_filters(
+        actor_user_id=actor_user_id,
+        entity_table=entity_table,
+        entity_id=entity_id,
+        action=action,
+        since=since,
+        until=until,
+        metadata=metadata,
+    )
+    if cursor:
+        clauses.append("(created_at, id) < (%s, %s)")
+        params.extend(_decode_cursor(cursor))
 
+    base = "SELECT * FROM audit_logs"
     if clauses:
         base += " WHERE " + " AND ".join(clauses)
 
-    base += " ORDER BY created_at DESC LIMIT 300"
+    # one extra row tells us whether there is a next page
+    base += " ORDER BY created_at DESC, id DESC LIMIT %s"
+    params.append(limit + 1)
 
-    with db.connect() as conn:
-        rows = db.fetchall(conn, base, params)
+    rows = db.fetchall(conn, base, params)
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = _encode_cursor(rows[-1])
 
-    return {"items": rows}
+    return {"items": rows, "next_cursor": next_cursor}
+
+
+@router.get("/stats")
+async def audit_log_stats(
+    since: Optional[date] = Query(None, description="First day (UTC), default 30 days ago"),
+    until: Optional[date] = Query(None, description="Last day (UTC, inclusive), default today"),
+    action: Optional[str] = Query(None, description="Action prefix, e.g. 'auth.login' or 'contest.'"),
+    actor_user_id: Optional[int] = None,
+    bucket: Literal["day", "week", "month"] = "day",
+    group_by: Literal["action", "actor", "action_actor", "none"] = "action",
+    auth_ctx = Depends(_require_admin_async),
+    conn = Depends(db_async.get_conn),
+):
+    """
+    Activity counts from the audit_log_daily_stats rollup (never scans audit_logs;
+    entries written inside route transactions show up within AUDIT_STATS_FOLD_INTERVAL),
+    e.g. logins per day: ?action=auth.login&group_by=none,
+    contest edits per coach this season: ?action=contest.&bucket=month&group_by=actor.
+    """
+    until = until or datetime.now(timezone.utc).date()
+    since = since or until - timedelta(days=30)
+    if since > until:
+        raise HTTPException(status_code=422, detail="since debe ser anterior o igual a until.")
+
+    clauses = ["day >= %s", "day <= %s"]
+    params: list = [since, until]
+    if action:
+        clauses.append("action LIKE %s")
+        params.append(_like_prefix(action))
+    if actor_user_id is not None:
+        clauses.append("actor_user_id = %s")
+        params.append(actor_user_id)
+
+    keys = ["bucket"]
+    if group_by in ("action", "action_actor"):
+        keys.append("action")
+    if group_by in ("actor", "action_actor"):
+        keys.append("actor_user_id")
+    select = ", ".join(
+        k if k != "actor_user_id" else "NULLIF(actor_user_id, 0) AS actor_user_id" for k in keys
+    )
+
+    rows = await db_async.fetchall(
+        conn,
+        f"""
+        SELECT {select}, SUM(count)::bigint AS count
+        FROM (
+            SELECT date_trunc(%s, day)::date AS bucket, action, actor_user_id, count
+            FROM audit_log_daily_stats
+            WHERE {" AND ".join(clauses)}
+        ) s
+        GROUP BY {", ".join(keys)}
+        ORDER BY bucket, count DESC
+        """,
+        [bucket] + params,
+    )
+
+    return {
+        "since": since,
+        "until": until,
+        "bucket": bucket,
+        "group_by": group_by,
+        "items": rows,
+    }
+
+
+EXPORT_COLUMNS = ("id", "created_at", "actor_user_id", "action", "entity_table", "entity_id", "metadata")
+
+
+def _export_rows(where: str, params: list) -> Iterator[list[dict]]:
+    """
+    Yield batches of rows through a server-side cursor, oldest first.
+
+    Uses its own connection: the request's connection (db.get_conn) is released
+    before the response body is streamed.
+    """
+    query = f"SELECT {', '.join(EXPORT_COLUMNS)} FROM audit_logs{where} ORDER BY created_at, id"
+    with db.connect() as conn:
+        with conn.cursor(name="audit_logs_export") as cur:
+            cur.itersize = AUDIT_EXPORT_BATCH
+            cur.execute(query, params)
+            while True:
+                batch = cur.fetchmany(AUDIT_EXPORT_BATCH)
+                if not batch:
+                    break
+                yield batch
+        conn.rollback()
+
+
+def _ndjson_stream(batches: Iterator[list[dict]]) -> Iterator[bytes]:
+    for batch in batches:
+        yield "".join(json.dumps(row, default=str) + "\n" for row in batch).encode("utf-8")
+
+
+def _csv_gzip_stream(batches: Iterator[list[dict]]) -> Iterator[bytes]:
+    gz = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 -> gzip container
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+
+    writer.writerow(EXPORT_COLUMNS)
+    for batch in batches:
+        for row in batch:
+            writer.writerow(
+                json.dumps(row[c]) if c == "metadata" and row[c] is not None else row[c]
+                for c in EXPORT_COLUMNS
+            )
+        chunk = gz.compress(buf.getvalue().encode("utf-8"))
+        buf.seek(0)
+        buf.truncate()
+        if chunk:
+            yield chunk
+    yield gz.compress(buf.getvalue().encode("utf-8")) + gz.flush()
+
+
+@router.get("/export")
+def export_audit_logs(
+    format: Literal["ndjson", "csv"] = Query("ndjson", description="ndjson, or gzip-compressed csv"),
+    actor_user_id: Optional[int] = None,
+    entity_table: Optional[str] = None,
+    entity_id: Optional[int] = None,
+    action: Optional[str] = Query(None, description="Action prefix"),
+    since: Optional[datetime] = Query(None),
+    until: Optional[datetime] = Query(None),
+    metadata: Optional[str] = Query(None, description="JSON object the metadata must contain"),
+    auth_ctx = Depends(_require_admin_no_conn),
+):
+    """
+    Full dump for compliance reviews, oldest first. Streams batches of
+    AUDIT_EXPORT_BATCH rows from a named cursor, so memory stays flat no matter
+    how many rows match and the download starts right away.
+    """
+    clauses, params = _build_filters(
+        actor_user_id=actor_user_id,
+        entity_table=entity_table,
+        entity_id=entity_id,
+        action=action,
+        since=since,
+        until=until,
+        metadata=metadata,
+    )
+    where = " WHERE " + " AND ".join(clauses) if clauses else ""
+
+    add_audit_log(
+        actor_user_id=auth_ctx["user"]["id"],
+        action="audit_log.export",
+        entity_table="audit_logs",
+        entity_id=None,
+        metadata={
+            "format": format,
+            "filters": {
+                "actor_user_id": actor_user_id,
+                "entity_table": entity_table,
+                "entity_id": entity_id,
+                "action": action,
+                "since": since,
+                "until": until,
+                "metadata": metadata,
+            },
+        },
+    )
+
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    batches = _export_rows(where, params)
+    if format == "csv":
+        return StreamingResponse(
+            _csv_gzip_stream(batches),
+            media_type="application/gzip",
+            headers={"Content-Disposition": f'attachment; filename="audit_logs_{stamp}.csv.gz"'},
+        )
+    return StreamingResponse(
+        _ndjson_stream(batches),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="audit_logs_{stamp}.ndjson"'},
+    )
 
 
 # Optional: keep a POST endpoint for manual/admin insertion.
@@ -134,20 +639,25 @@ def list_audit_logs(
 def create_audit_log_endpoint(
     payload: AuditLogCreate,
     auth_ctx = Depends(_require_admin),
+    conn = Depends(db.get_conn),
 ):
-    with db.connect() as conn:
-        row = db.fetchone(
-            conn,
-            """
-            INSERT INTO audit_logs(actor_user_id, action, entity_table, entity_id, metadata)
-            VALUES (%s,%s,%s,%s,%s) RETURNING *
-            """,
-            [
-                payload.actor_user_id,
-                payload.action,
-                payload.entity_table,
-                payload.entity_id,
-                payload.metadata,
-            ],
-        )
+    row = db.fetchone(
+        conn,
+        """
+        INSERT INTO audit_logs(actor_user_id, action, entity_table, entity_id, metadata)
+        VALUES (%s,%s,%s,%s,%s::jsonb) RETURNING *
+        """,
+        [
+            payload.actor_user_id,
+            payload.action,
+            payload.entity_table,
+            payload.entity_id,
+            json.dumps(payload.metadata, default=str) if payload.metadata is not None else None,
+        ],
+    )
+    audit_writer.count_later(
+        conn,
+        [(row["actor_user_id"], row["action"], row["entity_table"], row["entity_id"], None, row["created_at"])],
+    )
+    conn.commit()
     return row
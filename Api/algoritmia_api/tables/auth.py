@@ -1,22 +1,23 @@
 import secrets, hashlib, string
+import copy
 
-from datetime import date, datetime, timedelta
+from datetime import date, datetime, timedelta, timezone
 from typing import Optional
 
 from fastapi import Response, Request, Depends, Cookie
 
-from fastapi import APIRouter, HTTPException, BackgroundTasks
+from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel, EmailStr, Field
-from passlib.hash import argon2
 import secrets, hashlib, string, re
-import json
-import urllib.request
-import urllib.error
 import os
 import logging
 
-from .. import db
-from ..email_utils import send_email 
+from .. import db, db_async
+from ..cache import TTLCache
+from ..codeforces import validate_codeforces_handle_exists
+from ..passwords import hash_password, verify_and_update
+from ..email_sender import sender as email_sender
+from . import email_outbox
 from .audit_logs import add_audit_log
 
 FRONTEND_BASE_URL = os.getenv(
@@ -30,7 +31,14 @@ router = APIRouter(prefix="/auth", tags=["Auth"])
 SESSION_COOKIE_NAME = "sid"
 SESSION_COOKIE_AGE = 60 * 60 * 24  # one day in seconds
 
-CF_HANDLE_RE = re.compile(r"^[A-Za-z0-9_\-]{1,24}$")
+# Per-process cache of resolved sessions, keyed by token_sha256.
+# Entries are dropped explicitly on logout / password reset / profile changes in this
+# process; other workers may serve a stale entry for at most SESSION_CACHE_TTL seconds.
+SESSION_CACHE_TTL = float(os.getenv("SESSION_CACHE_TTL", "30"))  # 0 disables
+SESSION_CACHE_MAXSIZE = int(os.getenv("SESSION_CACHE_MAXSIZE", "10000"))
+_session_cache = TTLCache(maxsize=SESSION_CACHE_MAXSIZE, ttl=SESSION_CACHE_TTL)
+
+SESSION_COLUMNS = ("id", "user_id", "token_sha256", "expires_at", "revoked_at", "created_at")
 
 DDL_SESSIONS = """
 CREATE TABLE IF NOT EXISTS sessions (
@@ -134,194 +142,136 @@ def _validate_password_strength(pw: str) -> None:
                 "una mayúscula, un dígito y un símbolo."
             ),
         )
-    
-def _validate_codeforces_handle_exists(handle: str) -> None:
-    # Basic format validation
-    if not CF_HANDLE_RE.fullmatch(handle):
-        raise HTTPException(
-            status_code=422,
-            detail=(
-                "El handle de Codeforces debe tener entre 3 y 24 caracteres "
-                "(letras, dígitos, '_' o '-')."
-            ),
-        )
 
-    url = f"https://codeforces.com/api/user.info?handles={handle}"
 
-    try:
-        # timeout in seconds
-        with urllib.request.urlopen(url, timeout=5) as resp:
-            raw = resp.read().decode("utf-8")
-    except (urllib.error.URLError, urllib.error.HTTPError):
-        # Treat this as an external service issue, not a bad handle syntax
-        raise HTTPException(
-            status_code=503,
-            detail=(
-                "No se pudo contactar a Codeforces para verificar tu handle. "
-                "Intenta de nuevo más tarde."
-            ),
-        )
+_SESSION_LOOKUP_SQL = (
+    "SELECT "
+    + ", ".join(f's.{c} AS "session__{c}"' for c in SESSION_COLUMNS)
+    + """, u.*
+    FROM sessions s
+    JOIN users u ON u.id = s.user_id
+    WHERE s.token_sha256=%s AND s.revoked_at IS NULL AND s.expires_at > NOW()
+    """
+)
 
-    try:
-        data = json.loads(raw)
-    except json.JSONDecodeError:
-        raise HTTPException(
-            status_code=503,
-            detail="Respuesta inválida de Codeforces al verificar tu handle.",
-        )
 
-    # Codeforces semantics:
-    # OK   → handle exists, data["result"] is a list with one user
-    # FAILED → handle does not exist (or other error)
-    if data.get("status") != "OK":
-        raise HTTPException(
-            status_code=422,
-            detail=f"El usuario de Codeforces '{handle}' no existe.",
-        )
-    
-def _send_password_reset_email(to_email: str, reset_url: str) -> None:
-    subject = "Restablecer contraseña - Algoritmia UP"
+def invalidate_session_cache(
+    *,
+    token_sha256: Optional[str] = None,
+    user_id: Optional[int] = None,
+) -> None:
+    """
+    Forget cached sessions: one token, or every session of a user.
+    Call after anything that revokes a session or changes the users row.
 
-    text_body = f"""Hola,
+    Only this worker's cache is cleared. Other workers keep serving their cached
+    copy, so a session revoked by logout / password reset stays usable there for
+    up to SESSION_CACHE_TTL seconds (set it to 0 to rule that out).
+    """
+    if token_sha256 is not None:
+        _session_cache.pop(token_sha256)
+    if user_id is not None:
+        _session_cache.discard_where(lambda _k, v: v["user"]["id"] == user_id)
 
-Recibimos una solicitud para restablecer la contraseña de tu cuenta de Algoritmia UP.
 
-Para continuar, haz clic en el siguiente enlace (o cópialo en tu navegador):
+def _session_token(request: Request) -> str:
+    raw = request.cookies.get(SESSION_COOKIE_NAME)
+    if not raw:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    return _hash_token(raw)
 
-{reset_url}
 
-Si tú no solicitaste este cambio, puedes ignorar este correo.
+def _cached_session(token_sha256: str) -> Optional[dict]:
+    cached = _session_cache.get(token_sha256)
+    # Routes may modify what they get; the cached dicts are shared
+    return copy.deepcopy(cached) if cached is not None else None
 
-Saludos,
-Equipo Algoritmia UP
-"""
 
-    html_body = f"""\
-<html>
-  <body style="font-family: system-ui, -apple-system, BlinkMacSystemFont, 'Segoe UI', sans-serif; background-color:#f5f5f5; padding:24px;">
-    <div style="max-width:480px; margin:0 auto; background:white; padding:24px; border-radius:12px;">
-      <h2 style="margin-top:0; color:#C5133D;">Restablecer tu contraseña</h2>
-      <p>Hola,</p>
-      <p>Recibimos una solicitud para restablecer la contraseña de tu cuenta de <strong>Algoritmia UP</strong>.</p>
-      <p>Haz clic en el siguiente botón para continuar:</p>
-      <p style="text-align:center; margin:24px 0;">
-        <a href="{reset_url}"
-           style="background-color:#C5133D; color:white; padding:12px 24px; border-radius:999px; text-decoration:none; font-weight:600;">
-          Restablecer contraseña
-        </a>
-      </p>
-      <p style="font-size:14px; color:#555;">
-        Si el botón no funciona, copia y pega este enlace en tu navegador:<br/>
-        <a href="{reset_url}" style="color:#C5133D;">{reset_url}</a>
-      </p>
-      <p style="font-size:12px; color:#777; margin-top:24px;">
-        Si tú no solicitaste este cambio, puedes ignorar este correo.
-      </p>
-      <p style="font-size:12px; color:#777;">
-        — Equipo Algoritmia UP
-      </p>
-    </div>
-  </body>
-</html>
-"""
-    send_email(to_email=to_email, subject=subject, text_body=text_body, html_body=html_body)
+def _session_from_row(token_sha256: str, row: Optional[dict]) -> dict:
+    if not row:
+        raise HTTPException(status_code=401, detail="Invalid or expired session")
 
+    sess = {c: row.pop(f"session__{c}") for c in SESSION_COLUMNS}
+    current = {"session": sess, "user": row}
 
-def _send_email_verification(to_email: str, verify_url: str, preferred_name: str) -> None:
-    subject = "Confirma tu correo - Algoritmia UP"
+    # Never cache past the session's own expiry
+    remaining = (sess["expires_at"] - datetime.now(timezone.utc)).total_seconds()
+    _session_cache.set(token_sha256, copy.deepcopy(current), ttl=remaining)
+    return current
 
-    text_body = f"""Hola {preferred_name},
 
-Gracias por registrarte en Algoritmia UP.
+async def get_current_user(request: Request):
+    """
+    Resolve the session cookie to {"session": ..., "user": ...}.
 
-Para completar tu registro y confirmar que este correo te pertenece, haz clic en el siguiente enlace (o cópialo en tu navegador):
+    One joined sessions+users query, fronted by a small LRU/TTL cache keyed by the
+    token hash (every page hits /auth/me). The cache is checked first: a hit
+    touches no connection, a miss borrows one from the async pool just for the
+    lookup.
+    """
+    token_sha256 = _session_token(request)
 
-{verify_url}
+    cached = _cached_session(token_sha256)
+    if cached is not None:
+        return cached
 
-Si tú no iniciaste este registro, puedes ignorar este correo.
+    async with db_async.connect() as conn:
+        row = await db_async.fetchone(conn, _SESSION_LOOKUP_SQL, [token_sha256])
+    return _session_from_row(token_sha256, row)
 
-Saludos,
-Equipo Algoritmia UP
-"""
 
-    html_body = f"""\
-<html>
-  <body style="font-family: system-ui, -apple-system, BlinkMacSystemFont, 'Segoe UI', sans-serif; background-color:#f5f5f5; padding:24px;">
-    <div style="max-width:480px; margin:0 auto; background:white; padding:24px; border-radius:12px;">
-      <h2 style="margin-top:0; color:#C5133D;">Confirma tu correo</h2>
-      <p>Hola {preferred_name},</p>
-      <p>Gracias por registrarte en <strong>Algoritmia UP</strong>.</p>
-      <p>Para completar tu registro, confirma que este correo te pertenece haciendo clic en el siguiente botón:</p>
-      <p style="text-align:center; margin:24px 0;">
-        <a href="{verify_url}"
-           style="background-color:#C5133D; color:white; padding:12px 24px; border-radius:999px; text-decoration:none; font-weight:600;">
-          Confirmar correo
-        </a>
-      </p>
-      <p style="font-size:14px; color:#555;">
-        Si el botón no funciona, copia y pega este enlace en tu navegador:<br/>
-        <a href="{verify_url}" style="color:#C5133D;">{verify_url}</a>
-      </p>
-      <p style="font-size:12px; color:#777; margin-top:24px;">
-        Si tú no iniciaste este registro, puedes ignorar este correo.
-      </p>
-      <p style="font-size:12px; color:#777;">
-        — Equipo Algoritmia UP
-      </p>
-    </div>
-  </body>
-</html>
-"""
-    send_email(to_email=to_email, subject=subject, text_body=text_body, html_body=html_body)
+def get_current_user_sync(request: Request, conn = Depends(db.get_conn)):
+    """
+    get_current_user for routes that use db.get_conn: FastAPI hands this and
+    the route the same request connection, so a cache miss is looked up on it
+    and the request never holds a second pooled connection.
+    """
+    token_sha256 = _session_token(request)
 
+    cached = _cached_session(token_sha256)
+    if cached is not None:
+        return cached
 
-def get_current_user(request: Request):
-    # read cookie
-    raw = request.cookies.get(SESSION_COOKIE_NAME)
-    if not raw:
-        raise HTTPException(status_code=401, detail="Not authenticated")
+    row = db.fetchone(conn, _SESSION_LOOKUP_SQL, [token_sha256])
+    return _session_from_row(token_sha256, row)
 
-    token_sha256 = _hash_token(raw)
 
-    with db.connect() as conn:
-        sess = db.fetchone(
-            conn,
-            """
-            SELECT * FROM sessions
-            WHERE token_sha256=%s AND revoked_at IS NULL AND expires_at > NOW()
-            """,
-            [token_sha256],
-        )
-        if not sess:
-            raise HTTPException(status_code=401, detail="Invalid or expired session")
+async def get_current_user_async(request: Request, conn = Depends(db_async.get_conn)):
+    """The same for async routes on db_async.get_conn: a miss is looked up on the route's connection."""
+    token_sha256 = _session_token(request)
 
-        user = db.fetchone(conn, "SELECT * FROM users WHERE id=%s", [sess["user_id"]])
-    return {"session": sess, "user": user}
+    cached = _cached_session(token_sha256)
+    if cached is not None:
+        return cached
+
+    row = await db_async.fetchone(conn, _SESSION_LOOKUP_SQL, [token_sha256])
+    return _session_from_row(token_sha256, row)
 
 
 @router.get("/me")
-def me(current = Depends(get_current_user)):
+async def me(current = Depends(get_current_user)):
     return current
 
 
 @router.post("/logout")
-def logout(response: Response, current = Depends(get_current_user)):
+def logout(
+    response: Response,
+    current = Depends(get_current_user_sync),
+    conn = Depends(db.get_conn),
+):
     session = current["session"]
     user = current["user"]
 
-    with db.connect() as conn:
-        db.execute(
-            conn,
-            """
-            UPDATE sessions
-            SET revoked_at = NOW()
-            WHERE id = %s AND revoked_at IS NULL
-            """,
-            [session["id"]],
-        )
-        conn.commit()
-
-    response.delete_cookie(SESSION_COOKIE_NAME, path="/")
+    db.execute(
+        conn,
+        """
+        UPDATE sessions
+        SET revoked_at = NOW()
+        WHERE id = %s AND revoked_at IS NULL
+        """,
+        [session["id"]],
+        commit=False,
+    )
 
     add_audit_log(
         actor_user_id=user["id"],
@@ -331,13 +281,18 @@ def logout(response: Response, current = Depends(get_current_user)):
         metadata={
             "reason": "user_initiated",
         },
+        conn=conn,
     )
+    conn.commit()
+    invalidate_session_cache(token_sha256=session["token_sha256"])
+
+    response.delete_cookie(SESSION_COOKIE_NAME, path="/")
 
     return {"ok": True}
 
 
 @router.post("/signup")
-def signup(payload: SignUp, background_tasks: BackgroundTasks):
+def signup(payload: SignUp):
     # --- Server-side validations ---
 
     # 1) email domain
@@ -366,9 +321,9 @@ def signup(payload: SignUp, background_tasks: BackgroundTasks):
         )
 
     _validate_password_strength(payload.password)
-    _validate_codeforces_handle_exists(payload.codeforces_handle)
+    validate_codeforces_handle_exists(payload.codeforces_handle)
 
-    pwd_hash = argon2.hash(payload.password)
+    pwd_hash = hash_password(payload.password)
 
     with db.connect() as conn:
         try:
@@ -498,17 +453,21 @@ def signup(payload: SignUp, background_tasks: BackgroundTasks):
             VALUES (%s, %s, %s)
             """,
             [user_id, token_hash, expires_at],
+            commit=False,
         )
-        conn.commit()
-
-    verify_url = f"{FRONTEND_BASE_URL}/verificar-correo?token={raw_token}"
 
-    background_tasks.add_task(
-        _send_email_verification,
-        str(payload.email),
-        verify_url,
-        payload.preferred_name,
-    )
+        verify_url = f"{FRONTEND_BASE_URL}/verificar-correo?token={raw_token}"
+        # Queued in the token's transaction; email_sender delivers it
+        email_outbox.enqueue_template(
+            conn,
+            "email_verification",
+            to_email=str(payload.email),
+            expires_at=expires_at,
+            verify_url=verify_url,
+            preferred_name=payload.preferred_name,
+        )
+        conn.commit()
+    email_sender.wake()
 
     return {"user": user, "identity": identity, "email_verification_sent": True}
 
@@ -532,9 +491,20 @@ def login(payload: Login, response: Response):
         )
 
     # 2) verify password
-    if not argon2.verify(payload.password, ident["password_hash"]):
+    valid, new_hash = verify_and_update(payload.password, ident["password_hash"])
+    if not valid:
         raise HTTPException(status_code=401, detail="Invalid credentials")
 
+    if new_hash:
+        # Stored hash uses outdated argon2 parameters: swap in the re-tuned one,
+        # unless the password changed meanwhile
+        with db.connect() as conn:
+            db.execute(
+                conn,
+                "UPDATE auth_identities SET password_hash = %s WHERE id = %s AND password_hash = %s",
+                [new_hash, ident["id"], ident["password_hash"]],
+            )
+
     result = {"identity": {k: v for k, v in ident.items() if k != "password_hash"}}
 
     session_row = None
@@ -602,7 +572,7 @@ def login(payload: Login, response: Response):
 
 
 @router.post("/request-password-reset")
-def request_password_reset(payload: RequestPasswordReset, background_tasks: BackgroundTasks):
+def request_password_reset(payload: RequestPasswordReset):
     email_str = str(payload.email).lower()
 
     generic_msg = {
@@ -651,9 +621,20 @@ def request_password_reset(payload: RequestPasswordReset, background_tasks: Back
             VALUES (%s, %s, %s)
             """,
             [user_id, token_hash, expires_at],
+            commit=False,
+        )
+
+        reset_url = f"{FRONTEND_BASE_URL}/reiniciar-contrasena?token={raw_token}"
+        email_outbox.enqueue_template(
+            conn,
+            "password_reset",
+            to_email=email_str,
+            expires_at=expires_at,
+            reset_url=reset_url,
         )
 
         conn.commit()
+    email_sender.wake()
 
     # ✅ Audit log
     add_audit_log(
@@ -669,10 +650,6 @@ def request_password_reset(payload: RequestPasswordReset, background_tasks: Back
         },
     )
 
-    reset_url = f"{FRONTEND_BASE_URL}/reiniciar-contrasena?token={raw_token}"
-
-    background_tasks.add_task(_send_password_reset_email, email_str, reset_url)
-
     return generic_msg
 
 
@@ -719,7 +696,7 @@ def reset_password(payload: ResetPasswordPayload):
                     detail="No existe una cuenta local asociada a este usuario.",
                 )
 
-            new_hash = argon2.hash(payload.new_password)
+            new_hash = hash_password(payload.new_password)
             db.execute(
                 conn,
                 "UPDATE auth_identities SET password_hash = %s WHERE id = %s",
@@ -758,6 +735,9 @@ def reset_password(payload: ResetPasswordPayload):
                 detail="Error interno al restablecer la contraseña.",
             )
 
+    # All of the user's sessions were just revoked
+    invalidate_session_cache(user_id=user_id)
+
     # ✅ Audit log
     add_audit_log(
         actor_user_id=user_id,
@@ -768,6 +748,7 @@ def reset_password(payload: ResetPasswordPayload):
             "reset_token_id": reset_row["id"],
             "sessions_revoked": True,
         },
+        sync=True,
     )
 
     return {"ok": True}
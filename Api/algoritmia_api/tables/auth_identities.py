@@ -4,10 +4,10 @@ from typing import Optional
 
 from fastapi import APIRouter, HTTPException, Depends
 from pydantic import BaseModel, EmailStr
-from passlib.hash import argon2
 
 from .. import db
-from .auth import get_current_user
+from ..passwords import hash_password, verify_password
+from .auth import get_current_user, get_current_user_sync
 from .audit_logs import add_audit_log
 
 router = APIRouter(prefix="/auth-identities", tags=["AuthIdentities"])
@@ -105,7 +105,8 @@ def _validate_password_strength(pw: str) -> None:
 @router.get("/")
 def list_auth_identities(
     user_id: Optional[int] = None,
-    auth_ctx = Depends(get_current_user),
+    auth_ctx = Depends(get_current_user_sync),
+    conn = Depends(db.get_conn),
 ):
     """
     List auth identities.
@@ -130,8 +131,7 @@ def list_auth_identities(
 
     base += " ORDER BY created_at DESC LIMIT 200"
 
-    with db.connect() as conn:
-        rows = db.fetchall(conn, base, params)
+    rows = db.fetchall(conn, base, params)
 
     return {"items": rows}
 
@@ -139,7 +139,8 @@ def list_auth_identities(
 @router.post("/")
 def create_auth_identity(
     payload: IdentityCreate,
-    auth_ctx = Depends(get_current_user),
+    auth_ctx = Depends(get_current_user_sync),
+    conn = Depends(db.get_conn),
 ):
     """
     Create/link an identity.
@@ -166,29 +167,28 @@ def create_auth_identity(
                 status_code=422,
                 detail="Local identity requires email and password",
             )
-        pwd_hash = argon2.hash(payload.password)
+        pwd_hash = hash_password(payload.password)
         provider_uid = None  # enforce NULL for local
     else:
         pwd_hash = None
         provider_uid = payload.provider_uid
 
     try:
-        with db.connect() as conn:
-            row = db.fetchone(
-                conn,
-                """
-                INSERT INTO auth_identities(user_id, provider, provider_uid, email, password_hash)
-                VALUES (%s, %s, %s, %s, %s)
-                RETURNING id, user_id, provider, provider_uid, email, created_at
-                """,
-                [
-                    target_user_id,
-                    payload.provider,
-                    provider_uid,
-                    str(payload.email) if payload.email else None,
-                    pwd_hash,
-                ],
-            )
+        row = db.fetchone(
+            conn,
+            """
+            INSERT INTO auth_identities(user_id, provider, provider_uid, email, password_hash)
+            VALUES (%s, %s, %s, %s, %s)
+            RETURNING id, user_id, provider, provider_uid, email, created_at
+            """,
+            [
+                target_user_id,
+                payload.provider,
+                provider_uid,
+                str(payload.email) if payload.email else None,
+                pwd_hash,
+            ],
+        )
 
         add_audit_log(
             actor_user_id=current_id,
@@ -202,11 +202,14 @@ def create_auth_identity(
                 # To avoid leaking email contents, just log whether it's present.
                 "email_present": bool(row["email"]),
             },
+            conn=conn,
         )
+        conn.commit()
 
         return row
 
     except Exception as e:
+        conn.rollback()
         msg = str(e).lower()
         if "auth_identities_user_provider_uq" in msg:
             raise HTTPException(status_code=409, detail="User already has an identity for this provider")
@@ -222,6 +225,10 @@ def change_my_password(
     payload: PasswordChange,
     auth_ctx = Depends(get_current_user),
 ):
+    """
+    No connection is held while argon2 runs in the password pool: the hash is
+    read on one short-lived connection and the update made on another.
+    """
     user = auth_ctx["user"]
     user_id = user["id"]
 
@@ -244,53 +251,66 @@ def change_my_password(
             [user_id],
         )
 
-        if not identity:
-            raise HTTPException(
-                status_code=400,
-                detail=(
-                    "Tu cuenta no tiene una contraseña local configurada. "
-                    "Inicia sesión con tu proveedor (Google, GitHub, etc.) "
-                    "o configura primero una contraseña local."
-                ),
-            )
+    if not identity:
+        raise HTTPException(
+            status_code=400,
+            detail=(
+                "Tu cuenta no tiene una contraseña local configurada. "
+                "Inicia sesión con tu proveedor (Google, GitHub, etc.) "
+                "o configura primero una contraseña local."
+            ),
+        )
 
-        if not identity["password_hash"]:
-            raise HTTPException(
-                status_code=400,
-                detail="Tu cuenta no usa contraseña local.",
-            )
+    if not identity["password_hash"]:
+        raise HTTPException(
+            status_code=400,
+            detail="Tu cuenta no usa contraseña local.",
+        )
 
-        if not argon2.verify(payload.current_password, identity["password_hash"]):
-            raise HTTPException(
-                status_code=401,
-                detail="La contraseña actual no es correcta.",
-            )
+    if not verify_password(payload.current_password, identity["password_hash"]):
+        raise HTTPException(
+            status_code=401,
+            detail="La contraseña actual no es correcta.",
+        )
 
-        if argon2.verify(payload.new_password, identity["password_hash"]):
-            raise HTTPException(
-                status_code=422,
-                detail="La nueva contraseña no puede ser igual a la actual.",
-            )
+    # current_password just matched the stored hash, so comparing the plain strings
+    # is equivalent to a second (slow) verify against it
+    if payload.new_password == payload.current_password:
+        raise HTTPException(
+            status_code=422,
+            detail="La nueva contraseña no puede ser igual a la actual.",
+        )
 
-        new_hash = argon2.hash(payload.new_password)
+    new_hash = hash_password(payload.new_password)
 
-        db.execute(
+    with db.connect() as conn:
+        # Only if the hash we verified is still the current one (no change in between)
+        count = db.execute(
             conn,
-            "UPDATE auth_identities SET password_hash = %s WHERE id = %s",
-            [new_hash, identity["id"]],
+            "UPDATE auth_identities SET password_hash = %s WHERE id = %s AND password_hash = %s",
+            [new_hash, identity["id"], identity["password_hash"]],
+            commit=False,
         )
+        if not count:
+            conn.rollback()
+            raise HTTPException(
+                status_code=409,
+                detail="Tu contraseña cambió mientras tanto. Intenta de nuevo.",
+            )
 
-    add_audit_log(
-        actor_user_id=user_id,
-        action="auth_password.change",
-        entity_table="auth_identities",
-        entity_id=identity["id"],
-        metadata={
-            "provider": identity["provider"],
-            # You might add a marker if later you allow multiple identities:
-            # "reason": "user_initiated"
-        },
-    )
+        add_audit_log(
+            actor_user_id=user_id,
+            action="auth_password.change",
+            entity_table="auth_identities",
+            entity_id=identity["id"],
+            metadata={
+                "provider": identity["provider"],
+                # You might add a marker if later you allow multiple identities:
+                # "reason": "user_initiated"
+            },
+            conn=conn,
+        )
+        conn.commit()
 
     return {"ok": True}
 
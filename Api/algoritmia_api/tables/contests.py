@@ -4,8 +4,8 @@ from typing import Optional
 from fastapi import APIRouter, HTTPException, Query, Depends
 from pydantic import BaseModel, AnyUrl, Field
 
-from .. import db
-from .auth import get_current_user
+from .. import db, db_async
+from .auth import get_current_user_async, get_current_user_sync
 from .audit_logs import add_audit_log
 
 router = APIRouter(prefix="/contests", tags=["Contests"])
@@ -81,11 +81,12 @@ class ContestUpdate(BaseModel):
 
 
 @router.get("")
-def list_contests(
+async def list_contests(
     platform: Optional[str] = None,
     season: Optional[str] = None,
     upcoming_only: bool = Query(False),
-    auth_ctx = Depends(get_current_user), # ensure only logged-in users, don't remove!
+    auth_ctx = Depends(get_current_user_async), # ensure only logged-in users, don't remove!
+    conn = Depends(db_async.get_conn),
 ):
     base = "SELECT * FROM contests"
     clauses = []
@@ -105,25 +106,28 @@ def list_contests(
 
     base += " ORDER BY start_at DESC LIMIT 200"
 
-    with db.connect() as conn:
-        rows = db.fetchall(conn, base, params)
+    rows = await db_async.fetchall(conn, base, params)
     return {"items": [row_to_contest(r) for r in rows]}
 
 
 @router.get("/{contest_id}")
 def get_contest(
     contest_id: int, 
-    auth_ctx = Depends(get_current_user) # ensure only logged-in users, don't remove!
+    auth_ctx = Depends(get_current_user_sync), # ensure only logged-in users, don't remove!
+    conn = Depends(db.get_conn),
 ):
-    with db.connect() as conn:
-        row = db.fetchone(conn, "SELECT * FROM contests WHERE id=%s", [contest_id])
+    row = db.fetchone(conn, "SELECT * FROM contests WHERE id=%s", [contest_id])
     if not row:
         raise HTTPException(status_code=404, detail="Contest not found")
     return row_to_contest(row)
 
 
 @router.post("")
-def create_contest(payload: ContestCreate, auth=Depends(get_current_user)):
+def create_contest(
+    payload: ContestCreate,
+    auth=Depends(get_current_user_sync),
+    conn=Depends(db.get_conn),
+):
     """
     Only 'coach' or 'admin' can create contests.
     `auth` looks like: {"session": ..., "user": ...}
@@ -138,32 +142,31 @@ def create_contest(payload: ContestCreate, auth=Depends(get_current_user)):
     if payload.start_at >= payload.end_at:
         raise HTTPException(status_code=400, detail="start_at must be before end_at")
 
-    with db.connect() as conn:
-        row = db.fetchone(
-            conn,
-            """
-            INSERT INTO contests(
-                title, platform, url, tags, difficulty,
-                added_by, format, start_at, end_at, location, season, notes
-            )
-            VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
-            RETURNING *
-            """,
-            [
-                payload.title,
-                payload.platform,
-                str(payload.url),
-                payload.tags,
-                payload.difficulty,
-                user_id,
-                payload.format,
-                payload.start_at,
-                payload.end_at,
-                payload.location,
-                payload.season,
-                payload.notes,
-            ],
+    row = db.fetchone(
+        conn,
+        """
+        INSERT INTO contests(
+            title, platform, url, tags, difficulty,
+            added_by, format, start_at, end_at, location, season, notes
         )
+        VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
+        RETURNING *
+        """,
+        [
+            payload.title,
+            payload.platform,
+            str(payload.url),
+            payload.tags,
+            payload.difficulty,
+            user_id,
+            payload.format,
+            payload.start_at,
+            payload.end_at,
+            payload.location,
+            payload.season,
+            payload.notes,
+        ],
+    )
 
     contest = row_to_contest(row)
 
@@ -181,13 +184,20 @@ def create_contest(payload: ContestCreate, auth=Depends(get_current_user)):
             "start_at": row["start_at"].isoformat(),
             "end_at": row["end_at"].isoformat(),
         },
+        conn=conn,
     )
+    conn.commit()
 
     return contest
 
 
 @router.patch("/{contest_id}")
-def update_contest(contest_id: int, payload: ContestUpdate, auth=Depends(get_current_user)):
+def update_contest(
+    contest_id: int,
+    payload: ContestUpdate,
+    auth=Depends(get_current_user_sync),
+    conn=Depends(db.get_conn),
+):
     user = auth["user"]
     role = user.get("role")
     user_id = user["id"]
@@ -211,8 +221,7 @@ def update_contest(contest_id: int, payload: ContestUpdate, auth=Depends(get_cur
     cols = ", ".join(f"{k}=%s" for k in data.keys())
     params = list(data.values()) + [contest_id]
 
-    with db.connect() as conn:
-        row = db.fetchone(conn, f"UPDATE contests SET {cols} WHERE id=%s RETURNING *", params)
+    row = db.fetchone(conn, f"UPDATE contests SET {cols} WHERE id=%s RETURNING *", params)
 
     if not row:
         raise HTTPException(status_code=404, detail="Contest not found")
@@ -230,13 +239,19 @@ def update_contest(contest_id: int, payload: ContestUpdate, auth=Depends(get_cur
             "platform": row["platform"],
             "season": row["season"],
         },
+        conn=conn,
     )
+    conn.commit()
 
     return contest
 
 
 @router.delete("/{contest_id}")
-def delete_contest(contest_id: int, auth=Depends(get_current_user)):
+def delete_contest(
+    contest_id: int,
+    auth=Depends(get_current_user_sync),
+    conn=Depends(db.get_conn),
+):
     user = auth["user"]
     role = user.get("role")
     user_id = user["id"]
@@ -244,13 +259,12 @@ def delete_contest(contest_id: int, auth=Depends(get_current_user)):
     if role not in ("coach", "admin"):
         raise HTTPException(status_code=403, detail="Only coaches/admins can delete contests")
 
-    with db.connect() as conn:
-        # Fetch contest for logging metadata before deleting
-        row = db.fetchone(conn, "SELECT * FROM contests WHERE id=%s", [contest_id])
-        if not row:
-            raise HTTPException(status_code=404, detail="Contest not found")
+    # Fetch contest for logging metadata before deleting
+    row = db.fetchone(conn, "SELECT * FROM contests WHERE id=%s", [contest_id])
+    if not row:
+        raise HTTPException(status_code=404, detail="Contest not found")
 
-        db.execute(conn, "DELETE FROM contests WHERE id=%s", [contest_id])
+    db.execute(conn, "DELETE FROM contests WHERE id=%s", [contest_id], commit=False)
 
     add_audit_log(
         actor_user_id=user_id,
@@ -264,7 +278,9 @@ def delete_contest(contest_id: int, auth=Depends(get_current_user)):
             "start_at": row["start_at"].isoformat(),
             "end_at": row["end_at"].isoformat(),
         },
+        conn=conn,
     )
+    conn.commit()
 
     return {"deleted": True}
 
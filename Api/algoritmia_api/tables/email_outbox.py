@@ -0,0 +1,99 @@
+"""
+Transactional email outbox.
+
+Routes don't talk to SMTP: they INSERT the rendered message here in the same
+transaction as whatever it announces (a verification or reset token), and
+email_sender delivers it. Rows survive restarts, failed sends are retried with
+backoff, and any number of sender processes can drain the table side by side
+(rows are claimed with FOR UPDATE SKIP LOCKED).
+
+status: pending -> sent | failed. While a sender holds a row, next_attempt_at
+is pushed into the future (a lease), so a sender that dies mid-batch only
+delays its rows. Bodies hold raw tokens, so they are cleared once a row is
+done with.
+"""
+
+from datetime import datetime
+from typing import Any, Optional
+
+from .. import db, email_templates
+
+DDL = """
+CREATE TABLE IF NOT EXISTS email_outbox (
+    id BIGSERIAL PRIMARY KEY,
+    kind TEXT NOT NULL,
+    to_email TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    text_body TEXT,
+    html_body TEXT,
+    status TEXT NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'sent', 'failed')),
+    attempts INT NOT NULL DEFAULT 0,
+    last_error TEXT,
+    next_attempt_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    expires_at TIMESTAMPTZ,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    sent_at TIMESTAMPTZ
+);
+"""
+
+# What the senders poll: due pending rows, oldest first
+DDL_IDX_DUE = """
+CREATE INDEX IF NOT EXISTS idx_email_outbox_due
+ON email_outbox (next_attempt_at)
+WHERE status = 'pending';
+"""
+
+
+def ensure_table(conn) -> None:
+    with conn.cursor() as cur:
+        cur.execute(DDL)
+        cur.execute(DDL_IDX_DUE)
+    conn.commit()
+
+
+def enqueue(
+    conn,
+    *,
+    kind: str,
+    to_email: str,
+    subject: str,
+    text_body: str,
+    html_body: Optional[str] = None,
+    expires_at: Optional[datetime] = None,
+) -> int:
+    """
+    Queue one message (not committed: it is sent only if the caller's transaction
+    commits). `expires_at`: don't bother sending after this, e.g. when the link
+    in it has expired. Returns the outbox id.
+    """
+    row = db.fetchone(
+        conn,
+        """
+        INSERT INTO email_outbox (kind, to_email, subject, text_body, html_body, expires_at)
+        VALUES (%s,%s,%s,%s,%s,%s)
+        RETURNING id
+        """,
+        [kind, to_email, subject, text_body, html_body, expires_at],
+    )
+    return row["id"]
+
+
+def enqueue_template(
+    conn,
+    template: str,
+    *,
+    to_email: str,
+    expires_at: Optional[datetime] = None,
+    **context: Any,
+) -> int:
+    """Render email template `template` (see email_templates) with `context` and queue it."""
+    subject, text_body, html_body = email_templates.render(template, **context)
+    return enqueue(
+        conn,
+        kind=template,
+        to_email=to_email,
+        subject=subject,
+        text_body=text_body,
+        html_body=html_body,
+        expires_at=expires_at,
+    )
@@ -5,7 +5,7 @@ from fastapi import APIRouter, HTTPException, Depends
 from pydantic import BaseModel
 
 from .. import db
-from .auth import get_current_user
+from .auth import get_current_user_sync
 from .audit_logs import add_audit_log
 
 router = APIRouter(prefix="/email-verification-tokens", tags=["EmailVerificationTokens"])
@@ -57,7 +57,7 @@ def create_email_verification_token_for_user(
     return row
 
 
-def _require_admin(auth_ctx = Depends(get_current_user)):
+def _require_admin(auth_ctx = Depends(get_current_user_sync)):
     """
     Small helper to enforce that only admins can hit these endpoints.
     'auth_ctx' is whatever get_current_user returns (likely { "user": ... }).
@@ -73,6 +73,7 @@ def _require_admin(auth_ctx = Depends(get_current_user)):
 def list_email_verification_tokens(
     user_id: Optional[int] = None,
     auth_ctx = Depends(_require_admin),
+    conn = Depends(db.get_conn),
 ):
     base = "SELECT * FROM email_verification_tokens"
     params: list = []
@@ -80,8 +81,7 @@ def list_email_verification_tokens(
         base += " WHERE user_id=%s"
         params.append(user_id)
     base += " ORDER BY created_at DESC LIMIT 200"
-    with db.connect() as conn:
-        rows = db.fetchall(conn, base, params)
+    rows = db.fetchall(conn, base, params)
     return {"items": rows}
 
 
@@ -89,20 +89,20 @@ def list_email_verification_tokens(
 def create_email_verification_token(
     payload: EmailTokenCreate,
     auth_ctx = Depends(_require_admin),
+    conn = Depends(db.get_conn),
 ):
     admin = auth_ctx["user"]
     admin_id = admin["id"]
 
     expires_at = datetime.utcnow() + timedelta(minutes=payload.ttl_minutes)
-    with db.connect() as conn:
-        row = db.fetchone(
-            conn,
-            """
-            INSERT INTO email_verification_tokens(user_id, token_hash, expires_at)
-            VALUES (%s,%s,%s) RETURNING *
-            """,
-            [payload.user_id, payload.token_hash, expires_at],
-        )
+    row = db.fetchone(
+        conn,
+        """
+        INSERT INTO email_verification_tokens(user_id, token_hash, expires_at)
+        VALUES (%s,%s,%s) RETURNING *
+        """,
+        [payload.user_id, payload.token_hash, expires_at],
+    )
 
     add_audit_log(
         actor_user_id=admin_id,
@@ -117,7 +117,9 @@ def create_email_verification_token(
             # Never log the raw token; even the hash is usually not needed:
             "token_hash_present": bool(row["token_hash"]),
         },
+        conn=conn,
     )
+    conn.commit()
 
     return row
 
@@ -126,16 +128,16 @@ def create_email_verification_token(
 def mark_email_token_used(
     token_id: str,
     auth_ctx = Depends(_require_admin),
+    conn = Depends(db.get_conn),
 ):
     admin = auth_ctx["user"]
     admin_id = admin["id"]
 
-    with db.connect() as conn:
-        row = db.fetchone(
-            conn,
-            "UPDATE email_verification_tokens SET used_at=NOW() WHERE id=%s RETURNING *",
-            [token_id],
-        )
+    row = db.fetchone(
+        conn,
+        "UPDATE email_verification_tokens SET used_at=NOW() WHERE id=%s RETURNING *",
+        [token_id],
+    )
     if not row:
         raise HTTPException(status_code=404, detail="Token not found")
 
@@ -149,6 +151,8 @@ def mark_email_token_used(
             "user_id": row["user_id"],
             "used_at": row["used_at"].isoformat() if row["used_at"] else None,
         },
+        conn=conn,
     )
+    conn.commit()
 
     return row
@@ -1,6 +1,7 @@
 import uuid
 import shutil
 import os
+import json
 
 from datetime import datetime
 from typing import Optional
@@ -8,10 +9,33 @@ from typing import Optional
 from fastapi import APIRouter, HTTPException, Query, UploadFile, File, Depends
 from pydantic import BaseModel
 
-from .. import db
-from .auth import get_current_user
+from .. import db, db_async
+from .auth import get_current_user, get_current_user_sync
 from .audit_logs import add_audit_log
-from ..r2_client import upload_file_obj
+from ..r2_client import (
+    upload_content_addressed,
+    public_url,
+    download_object,
+    discard_object,
+    release_object,
+    retain_urls,
+    get_key_from_url,
+    StorageBusy,
+    StorageTimeout,
+)
+from ..image_processing import store_variants, image_tempfile, copy_to_tempfile, BANNER_VARIANT_SIZES
+from ..image_uploads import (
+    open_image_upload,
+    too_large_error,
+    presign_image_upload,
+    verify_uploaded_image,
+    PresignRequest,
+    FinalizeUpload,
+    UploadTooLarge,
+    UPLOAD_MAX_BANNER_BYTES,
+    IMAGE_TYPES,
+    EXTENSIONS,
+)
 
 router = APIRouter(prefix="/events", tags=["Events"])
 
@@ -30,10 +54,16 @@ CREATE TABLE IF NOT EXISTS events (
 );
 """
 
+# Resized WebP copies of the banner: {"256": url, "1024": url, ...}
+DDL_IMAGE_VARIANTS = """
+ALTER TABLE events ADD COLUMN IF NOT EXISTS image_variants JSONB;
+"""
+
 
 def ensure_table(conn) -> None:
     with conn.cursor() as cur:
         cur.execute(DDL)
+        cur.execute(DDL_IMAGE_VARIANTS)
     conn.commit()
 
 
@@ -44,9 +74,16 @@ class EventCreate(BaseModel):
     location: Optional[str] = None
     description: Optional[str] = None
     image_url: Optional[str] = None
+    # As returned by /events/upload-banner together with the url
+    image_variants: Optional[dict[str, str]] = None
     video_call_link: Optional[str] = None
 
 
+class BannerFinalize(FinalizeUpload):
+    # Optionally attach the banner to an existing event right away
+    event_id: Optional[int] = None
+
+
 class EventUpdate(BaseModel):
     title: Optional[str] = None
     starts_at: Optional[datetime] = None
@@ -54,18 +91,19 @@ class EventUpdate(BaseModel):
     location: Optional[str] = None
     description: Optional[str] = None
     image_url: Optional[str] = None
+    image_variants: Optional[dict[str, str]] = None
     video_call_link: Optional[str] = None
 
 
 
 @router.get("")
-def list_events(upcoming_only: bool = Query(False)):
+async def list_events(upcoming_only: bool = Query(False)):
     base = "SELECT * FROM events"
     if upcoming_only:
         base += " WHERE ends_at IS NULL OR ends_at >= NOW()"
     base += " ORDER BY COALESCE(starts_at, created_at) DESC LIMIT 200"
-    with db.connect() as conn:
-        rows = db.fetchall(conn, base)
+    async with db_async.connect() as conn:
+        rows = await db_async.fetchall(conn, base)
     return {"items": rows}
 
 
@@ -81,7 +119,8 @@ def get_event(event_id: int):
 @router.post("")
 def create_event(
     payload: EventCreate,
-    current = Depends(get_current_user),
+    current = Depends(get_current_user_sync),
+    conn = Depends(db.get_conn),
 ):
     user = current["user"]
     role = user.get("role")
@@ -93,31 +132,32 @@ def create_event(
     if payload.starts_at and payload.ends_at and payload.starts_at >= payload.ends_at:
         raise HTTPException(status_code=400, detail="starts_at must be before ends_at")
 
-    with db.connect() as conn:
-        row = db.fetchone(
-            conn,
-            """
-            INSERT INTO events(
-                title,
-                starts_at,
-                ends_at,
-                location,
-                description,
-                image_url,
-                video_call_link
-            )
-            VALUES (%s,%s,%s,%s,%s,%s,%s) RETURNING *
-            """,
-            [
-                payload.title,
-                payload.starts_at,
-                payload.ends_at,
-                payload.location,
-                payload.description,
-                payload.image_url,
-                payload.video_call_link,
-            ],
+    row = db.fetchone(
+        conn,
+        """
+        INSERT INTO events(
+            title,
+            starts_at,
+            ends_at,
+            location,
+            description,
+            image_url,
+            image_variants,
+            video_call_link
         )
+        VALUES (%s,%s,%s,%s,%s,%s,%s::jsonb,%s) RETURNING *
+        """,
+        [
+            payload.title,
+            payload.starts_at,
+            payload.ends_at,
+            payload.location,
+            payload.description,
+            payload.image_url,
+            json.dumps(payload.image_variants) if payload.image_variants is not None else None,
+            payload.video_call_link,
+        ],
+    )
 
     add_audit_log(
         actor_user_id=user_id,
@@ -132,16 +172,44 @@ def create_event(
             "has_image": bool(row["image_url"]),
             "has_video_call_link": bool(row["video_call_link"]),
         },
+        conn=conn,
     )
+    retain_urls(conn, _image_urls(row))
+    conn.commit()
 
     return row
 
 
+def _image_urls(row: dict) -> list[str]:
+    return [row["image_url"], *(row["image_variants"] or {}).values()]
+
+
+def _release_image(row: dict) -> None:
+    """Drop the event's reference to its banner objects (after commit). Untracked URLs are left alone."""
+    for url in _image_urls(row):
+        key = get_key_from_url(url) if url else None
+        if key:
+            release_object(key)
+
+
+def _banner_variants(key: str, path: str) -> dict[str, str]:
+    """Resized WebP copies of a stored banner (local copy at `path`); the original is removed if that fails."""
+    try:
+        return store_variants(key, path, sizes=BANNER_VARIANT_SIZES, square=False)
+    except HTTPException:
+        discard_object(key)
+        raise
+
+
 @router.post("/upload-banner")
 def upload_banner(
     file: UploadFile = File(...),
     current = Depends(get_current_user),
 ):
+    """
+    Upload an event banner (plus WebP variants) to R2. Holds no DB connection
+    while the file is uploaded and rendered; the audit row goes to the writer.
+    """
     user = current["user"]
     role = user.get("role")
     user_id = user["id"]
@@ -149,22 +217,29 @@ def upload_banner(
     if role not in ("coach", "admin"):
         raise HTTPException(status_code=403, detail="Solo coaches o admins pueden subir banners.")
 
-    if not file.content_type or not file.content_type.startswith("image/"):
-        raise HTTPException(status_code=400, detail="El archivo debe ser una imagen.")
-
-    # Determine extension
-    ext = "jpg"
-    if "." in file.filename:
-        ext = file.filename.rsplit(".", 1)[-1].lower()
-
-    # Key inside the bucket, e.g.: events/banners/<uuid>.<ext>
-    key = f"events/banners/{uuid.uuid4().hex}.{ext}"
+    reader, content_type = open_image_upload(
+        file, max_bytes=UPLOAD_MAX_BANNER_BYTES, allowed=IMAGE_TYPES
+    )
 
+    # Content-addressed key, e.g.: events/banners/<sha256>.<ext>; re-uploads skip the transfer
     try:
-        url = upload_file_obj(file.file, key=key, content_type=file.content_type)
+        key, url = upload_content_addressed(
+            reader, "events/banners/", EXTENSIONS[content_type], content_type
+        )
+    except UploadTooLarge:
+        raise too_large_error(UPLOAD_MAX_BANNER_BYTES)
+    except StorageBusy:
+        raise HTTPException(status_code=503, detail="Demasiadas subidas en curso. Intenta de nuevo en unos segundos.")
+    except StorageTimeout:
+        raise HTTPException(status_code=504, detail="La subida a R2 tardó demasiado.")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error subiendo banner a R2: {e!r}")
 
+    # Already size-checked by the streaming upload; the pool reads it from a temp file
+    with image_tempfile() as tmp:
+        copy_to_tempfile(file.file, tmp)
+        variants = _banner_variants(key, tmp.name)
+
     add_audit_log(
         actor_user_id=user_id,
         action="event.banner_upload",
@@ -173,21 +248,114 @@ def upload_banner(
         metadata={
             "key": key,
             "filename": file.filename,
-            "content_type": file.content_type,
+            "content_type": content_type,
             "public_url": url,
         },
     )
 
-    # Frontend will use this as events.image_url
-    return {"url": url}
+    # Frontend will use these as events.image_url / events.image_variants
+    return {"url": url, "variants": variants}
+
 
+@router.post("/upload-banner/presign")
+def presign_banner_upload(
+    payload: PresignRequest,
+    current = Depends(get_current_user),
+):
+    """Direct-to-R2 banner upload, step 1: presigned PUT URL for the client."""
+    user = current["user"]
+    if user.get("role") not in ("coach", "admin"):
+        raise HTTPException(status_code=403, detail="Solo coaches o admins pueden subir banners.")
+
+    return presign_image_upload(
+        payload,
+        key_prefix=f"events/banners/{user['id']}_",
+        max_bytes=UPLOAD_MAX_BANNER_BYTES,
+        allowed=IMAGE_TYPES,
+    )
+
+
+@router.post("/upload-banner/finalize")
+def finalize_banner_upload(
+    payload: BannerFinalize,
+    current = Depends(get_current_user),
+):
+    """
+    Direct-to-R2 banner upload, step 2: checks the uploaded object and, if
+    event_id is given, sets it as that event's image_url. A connection is only
+    taken for that update: rendering the variants records them in
+    storage_objects on connections of its own.
+    """
+    user = current["user"]
+    role = user.get("role")
+    user_id = user["id"]
+
+    if role not in ("coach", "admin"):
+        raise HTTPException(status_code=403, detail="Solo coaches o admins pueden subir banners.")
+
+    content_type = verify_uploaded_image(
+        payload.key,
+        key_prefix=f"events/banners/{user_id}_",
+        max_bytes=UPLOAD_MAX_BANNER_BYTES,
+        allowed=IMAGE_TYPES,
+    )
+    url = public_url(payload.key)
+
+    # Streamed to a temp file for the pool, never read into memory
+    with image_tempfile() as tmp:
+        try:
+            download_object(payload.key, tmp)
+        except StorageBusy:
+            raise HTTPException(status_code=503, detail="Demasiadas subidas en curso. Intenta de nuevo en unos segundos.")
+        except StorageTimeout:
+            raise HTTPException(status_code=504, detail="R2 tardó demasiado en responder.")
+        variants = _banner_variants(payload.key, tmp.name)
+
+    old = None
+    with db.connect() as conn:
+        if payload.event_id is not None:
+            old = db.fetchone(
+                conn,
+                "SELECT image_url, image_variants FROM events WHERE id=%s FOR UPDATE",
+                [payload.event_id],
+            )
+            if not old:
+                raise HTTPException(status_code=404, detail="Event not found")
+            db.execute(
+                conn,
+                "UPDATE events SET image_url=%s, image_variants=%s::jsonb WHERE id=%s",
+                [url, json.dumps(variants), payload.event_id],
+                commit=False,
+            )
+            retain_urls(conn, [url, *variants.values()])
+
+        add_audit_log(
+            actor_user_id=user_id,
+            action="event.banner_upload",
+            entity_table="events" if payload.event_id is not None else "event_banners",
+            entity_id=payload.event_id,
+            metadata={
+                "key": payload.key,
+                "content_type": content_type,
+                "public_url": url,
+                "direct": True,
+            },
+            conn=conn,
+        )
+        conn.commit()
+
+    if old:
+        _release_image(old)
+
+    return {"url": url, "variants": variants, "event_id": payload.event_id}
 
 
 @router.patch("/{event_id}")
 def update_event(
     event_id: int,
     payload: EventUpdate,
-    current = Depends(get_current_user),
+    current = Depends(get_current_user_sync),
+    conn = Depends(db.get_conn),
 ):
     user = current["user"]
     role = user.get("role")
@@ -204,12 +372,27 @@ def update_event(
         if data["starts_at"] >= data["ends_at"]:
             raise HTTPException(status_code=400, detail="starts_at must be before ends_at")
 
-    cols = ", ".join(f"{k}=%s" for k in data.keys())
+    # A new image_url without its variants must not keep serving the old ones
+    if "image_url" in data and "image_variants" not in data:
+        data["image_variants"] = None
+    if data.get("image_variants") is not None:
+        data["image_variants"] = json.dumps(data["image_variants"])
+
+    old = None
+    if "image_variants" in data:
+        old = db.fetchone(
+            conn,
+            "SELECT image_url, image_variants FROM events WHERE id=%s FOR UPDATE",
+            [event_id],
+        )
+
+    cols = ", ".join(f"{k}=%s::jsonb" if k == "image_variants" else f"{k}=%s" for k in data.keys())
     params = list(data.values()) + [event_id]
-    with db.connect() as conn:
-        row = db.fetchone(conn, f"UPDATE events SET {cols} WHERE id=%s RETURNING *", params)
+    row = db.fetchone(conn, f"UPDATE events SET {cols} WHERE id=%s RETURNING *", params)
     if not row:
         raise HTTPException(status_code=404, detail="Event not found")
+    if old:
+        retain_urls(conn, _image_urls(row))
 
     add_audit_log(
         actor_user_id=user_id,
@@ -222,7 +405,12 @@ def update_event(
             "starts_at": row["starts_at"].isoformat() if row["starts_at"] else None,
             "ends_at": row["ends_at"].isoformat() if row["ends_at"] else None,
         },
+        conn=conn,
     )
+    conn.commit()
+
+    if old:
+        _release_image(old)
 
     return row
 
@@ -230,7 +418,8 @@ def update_event(
 @router.delete("/{event_id}")
 def delete_event(
     event_id: int,
-    current = Depends(get_current_user),
+    current = Depends(get_current_user_sync),
+    conn = Depends(db.get_conn),
 ):
     user = current["user"]
     role = user.get("role")
@@ -239,13 +428,12 @@ def delete_event(
     if role not in ("coach", "admin"):
         raise HTTPException(status_code=403, detail="Solo coaches o admins pueden borrar eventos.")
 
-    with db.connect() as conn:
-        # Fetch event for logging before deletion
-        row = db.fetchone(conn, "SELECT * FROM events WHERE id=%s", [event_id])
-        if not row:
-            raise HTTPException(status_code=404, detail="Event not found")
+    # Fetch event for logging before deletion
+    row = db.fetchone(conn, "SELECT * FROM events WHERE id=%s", [event_id])
+    if not row:
+        raise HTTPException(status_code=404, detail="Event not found")
 
-        db.execute(conn, "DELETE FROM events WHERE id=%s", [event_id])
+    db.execute(conn, "DELETE FROM events WHERE id=%s", [event_id], commit=False)
 
     add_audit_log(
         actor_user_id=user_id,
@@ -260,7 +448,11 @@ def delete_event(
             "had_image": bool(row["image_url"]),
             "had_video_call_link": bool(row["video_call_link"]),
         },
+        conn=conn,
     )
+    conn.commit()
+
+    _release_image(row)
 
     return {"deleted": True}
 
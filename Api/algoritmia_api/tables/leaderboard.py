@@ -0,0 +1,206 @@
+import os
+import logging
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Query, Depends
+
+from .. import db, db_async
+from ..codeforces import fetch_user_info, remember_existing, CodeforcesError
+from .auth import get_current_user
+from .audit_logs import add_audit_log
+
+logger = logging.getLogger("leaderboard")
+
+router = APIRouter(prefix="/leaderboard", tags=["Leaderboard"])
+
+# How often the background job refreshes Codeforces ratings (seconds, 0 = never)
+CF_RATINGS_SYNC_INTERVAL = int(os.getenv("CF_RATINGS_SYNC_INTERVAL", "1800"))
+
+DDL = """
+CREATE TABLE IF NOT EXISTS cf_ratings (
+    handle_lc    TEXT PRIMARY KEY,          -- lower(users.codeforces_handle)
+    handle       TEXT NOT NULL,             -- casing as returned by Codeforces
+    rating       INT NOT NULL DEFAULT 0,
+    max_rating   INT,
+    cf_rank      TEXT,
+    cf_max_rank  TEXT,
+    synced_at    TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_cf_ratings_rating ON cf_ratings(rating DESC);
+
+-- the leaderboard joins users to cf_ratings on the lower-cased handle
+CREATE INDEX IF NOT EXISTS idx_users_cf_handle_lc ON users(lower(codeforces_handle));
+"""
+
+
+def ensure_table(conn) -> None:
+    with conn.cursor() as cur:
+        cur.execute(DDL)
+    conn.commit()
+
+
+UPSERT_RATING = """
+INSERT INTO cf_ratings (handle_lc, handle, rating, max_rating, cf_rank, cf_max_rank, synced_at)
+VALUES (%s, %s, %s, %s, %s, %s, NOW())
+ON CONFLICT (handle_lc) DO UPDATE SET
+    handle = EXCLUDED.handle,
+    rating = EXCLUDED.rating,
+    max_rating = EXCLUDED.max_rating,
+    cf_rank = EXCLUDED.cf_rank,
+    cf_max_rank = EXCLUDED.cf_max_rank,
+    synced_at = EXCLUDED.synced_at
+"""
+
+
+def sync_ratings(force: bool = False) -> dict:
+    """
+    Refresh cf_ratings for every users.codeforces_handle with batched user.info calls.
+
+    Safe to call from several worker processes: a transaction-scoped advisory lock
+    lets only one of them run, and unless `force` is set a sync is skipped when the
+    table was refreshed less than half an interval ago.
+    """
+    with db.connect() as conn:
+        if not db.try_advisory_xact_lock(conn, "cf_ratings_sync"):
+            return {"skipped": "another sync is running"}
+
+        if not force and CF_RATINGS_SYNC_INTERVAL > 0:
+            fresh = db.fetchone(
+                conn,
+                "SELECT MAX(synced_at) > NOW() - make_interval(secs => %s) AS fresh FROM cf_ratings",
+                [CF_RATINGS_SYNC_INTERVAL / 2],
+            )
+            if fresh and fresh["fresh"]:
+                return {"skipped": "ratings are fresh"}
+
+        handles = [
+            r["codeforces_handle"]
+            for r in db.fetchall(
+                conn,
+                """
+                SELECT DISTINCT codeforces_handle
+                FROM users
+                WHERE codeforces_handle IS NOT NULL AND codeforces_handle <> ''
+                """,
+            )
+        ]
+
+        infos = fetch_user_info(handles)
+        # Signup / profile edits re-validating these handles can skip the CF call
+        remember_existing(u["handle"] for u in infos)
+
+        rows = [
+            (
+                u["handle"].lower(),
+                u["handle"],
+                u.get("rating") or 0,
+                u.get("maxRating"),
+                u.get("rank"),
+                u.get("maxRank"),
+            )
+            for u in infos
+        ]
+        found = {r[0] for r in rows}
+        missing = [h.lower() for h in handles if h.lower() not in found]
+
+        with conn.cursor() as cur:
+            if rows:
+                cur.executemany(UPSERT_RATING, rows)
+            # Forget handles Codeforces no longer knows, and handles no member uses anymore
+            cur.execute(
+                """
+                DELETE FROM cf_ratings
+                WHERE handle_lc = ANY(%s)
+                   OR handle_lc NOT IN (
+                        SELECT lower(codeforces_handle) FROM users
+                        WHERE codeforces_handle IS NOT NULL
+                   )
+                """,
+                [missing],
+            )
+            pruned = cur.rowcount
+        conn.commit()
+
+    logger.info("CF ratings synced: %s handles, %s found, %s pruned", len(handles), len(rows), pruned)
+    return {"handles": len(handles), "synced": len(rows), "missing": len(missing), "pruned": pruned}
+
+
+@router.get("")
+async def get_leaderboard(
+    page: int = Query(1, ge=1),
+    page_size: int = Query(50, ge=1, le=200),
+    q: Optional[str] = Query(None, description="Filter by handle or name"),
+):
+    """
+    Public, pre-ranked Codeforces leaderboard served from cf_ratings.
+    Ranks are computed over all members (ties share a rank: 1, 2, 2, 4) before
+    the optional search filter and pagination are applied.
+    """
+    base = """
+        WITH ranked AS (
+            SELECT
+                u.id,
+                u.preferred_name,
+                u.country,
+                u.profile_image_url,
+                u.profile_image_variants,
+                r.handle,
+                r.rating,
+                r.max_rating,
+                r.cf_rank,
+                RANK() OVER (ORDER BY r.rating DESC) AS rank
+            FROM users u
+            JOIN cf_ratings r ON r.handle_lc = lower(u.codeforces_handle)
+        )
+    """
+    where = ""
+    params: list = []
+    if q and q.strip():
+        where = " WHERE handle ILIKE %s OR preferred_name ILIKE %s"
+        like = f"%{q.strip()}%"
+        params.extend([like, like])
+
+    async with db_async.connect() as conn:
+        rows = await db_async.fetchall(
+            conn,
+            base + "SELECT * FROM ranked" + where + " ORDER BY rank, handle LIMIT %s OFFSET %s",
+            params + [page_size, (page - 1) * page_size],
+        )
+        meta = await db_async.fetchone(
+            conn,
+            base + "SELECT COUNT(*) AS total FROM ranked" + where,
+            params,
+        )
+        synced = await db_async.fetchone(conn, "SELECT MAX(synced_at) AS last_synced_at FROM cf_ratings")
+
+    return {
+        "items": rows,
+        "total": meta["total"],
+        "page": page,
+        "page_size": page_size,
+        "last_synced_at": synced["last_synced_at"],
+    }
+
+
+@router.post("/sync")
+def trigger_sync(auth_ctx = Depends(get_current_user)):
+    """Admin-only: refresh ratings now instead of waiting for the next scheduled run."""
+    user = auth_ctx["user"]
+    if user.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Solo administradores pueden sincronizar el leaderboard.")
+
+    try:
+        result = sync_ratings(force=True)
+    except CodeforcesError as e:
+        raise HTTPException(status_code=503, detail=f"No se pudo sincronizar con Codeforces: {e}")
+
+    add_audit_log(
+        actor_user_id=user["id"],
+        action="leaderboard.sync",
+        entity_table="cf_ratings",
+        entity_id=None,
+        metadata=result,
+    )
+
+    return result
@@ -5,7 +5,7 @@ from fastapi import APIRouter, HTTPException, Depends
 from pydantic import BaseModel
 
 from .. import db
-from .auth import get_current_user
+from .auth import get_current_user_sync
 from .audit_logs import add_audit_log
 
 router = APIRouter(prefix="/password-reset-tokens", tags=["PasswordResetTokens"])
@@ -38,7 +38,7 @@ class PasswordResetTokenCreate(BaseModel):
     token_hash: str
 
 
-def _require_admin(auth_ctx = Depends(get_current_user)):
+def _require_admin(auth_ctx = Depends(get_current_user_sync)):
     """
     Ensure the caller is an authenticated admin.
 
@@ -57,6 +57,7 @@ def _require_admin(auth_ctx = Depends(get_current_user)):
 def list_password_reset_tokens(
     user_id: Optional[int] = None,
     auth_ctx = Depends(_require_admin),  # ⬅ admin-only
+    conn = Depends(db.get_conn),
 ):
     base = "SELECT * FROM password_reset_tokens"
     params: list = []
@@ -64,8 +65,7 @@ def list_password_reset_tokens(
         base += " WHERE user_id=%s"
         params.append(user_id)
     base += " ORDER BY created_at DESC LIMIT 200"
-    with db.connect() as conn:
-        rows = db.fetchall(conn, base, params)
+    rows = db.fetchall(conn, base, params)
     return {"items": rows}
 
 
@@ -73,20 +73,20 @@ def list_password_reset_tokens(
 def create_password_reset_token(
     payload: PasswordResetTokenCreate,
     auth_ctx = Depends(_require_admin),  # ⬅ admin-only
+    conn = Depends(db.get_conn),
 ):
     admin = auth_ctx["user"]
     admin_id = admin["id"]
 
     expires_at = datetime.utcnow() + timedelta(minutes=payload.ttl_minutes)
-    with db.connect() as conn:
-        row = db.fetchone(
-            conn,
-            """
-            INSERT INTO password_reset_tokens(user_id, token_hash, expires_at)
-            VALUES (%s,%s,%s) RETURNING *
-            """,
-            [payload.user_id, payload.token_hash, expires_at],
-        )
+    row = db.fetchone(
+        conn,
+        """
+        INSERT INTO password_reset_tokens(user_id, token_hash, expires_at)
+        VALUES (%s,%s,%s) RETURNING *
+        """,
+        [payload.user_id, payload.token_hash, expires_at],
+    )
 
     add_audit_log(
         actor_user_id=admin_id,
@@ -100,7 +100,9 @@ def create_password_reset_token(
             "expires_at": row["expires_at"].isoformat(),
             "token_hash_present": bool(row["token_hash"]),
         },
+        conn=conn,
     )
+    conn.commit()
 
     return row
 
@@ -109,16 +111,16 @@ def create_password_reset_token(
 def mark_password_reset_token_used(
     token_id: str,
     auth_ctx = Depends(_require_admin),  # ⬅ admin-only
+    conn = Depends(db.get_conn),
 ):
     admin = auth_ctx["user"]
     admin_id = admin["id"]
 
-    with db.connect() as conn:
-        row = db.fetchone(
-            conn,
-            "UPDATE password_reset_tokens SET used_at=NOW() WHERE id=%s RETURNING *",
-            [token_id],
-        )
+    row = db.fetchone(
+        conn,
+        "UPDATE password_reset_tokens SET used_at=NOW() WHERE id=%s RETURNING *",
+        [token_id],
+    )
     if not row:
         raise HTTPException(status_code=404, detail="Token not found")
 
@@ -133,7 +135,9 @@ def mark_password_reset_token_used(
             "user_id": row["user_id"],
             "used_at": row["used_at"].isoformat() if row["used_at"] else None,
         },
+        conn=conn,
     )
+    conn.commit()
 
     return row
 
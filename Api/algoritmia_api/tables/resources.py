@@ -3,8 +3,8 @@ from typing import Optional
 from fastapi import APIRouter, HTTPException, Depends
 from pydantic import BaseModel, AnyUrl, Field
 
-from .. import db
-from .auth import get_current_user
+from .. import db, db_async
+from .auth import get_current_user_async, get_current_user_sync
 from .audit_logs import add_audit_log
 
 router = APIRouter(prefix="/resources", tags=["Resources"])
@@ -61,10 +61,11 @@ class ResourceUpdate(BaseModel):
     notes: Optional[str] = None
 
 @router.get("")
-def list_resources(
+async def list_resources(
     type: Optional[str] = None,
     difficulty: Optional[str] = None,
-    auth = Depends(get_current_user),  # ensure only logged-in users, don't remove!
+    auth = Depends(get_current_user_async),  # ensure only logged-in users, don't remove!
+    conn = Depends(db_async.get_conn),
 ):
     base = """
         SELECT
@@ -88,15 +89,18 @@ def list_resources(
 
     base += " ORDER BY r.created_at DESC LIMIT 200"
 
-    with db.connect() as conn:
-        rows = db.fetchall(conn, base, params)
+    rows = await db_async.fetchall(conn, base, params)
 
     items = [row_to_resource(row) for row in rows]
     return {"items": items}
 
 
 @router.post("")
-def create_resource(payload: ResourceCreate, auth=Depends(get_current_user)):
+def create_resource(
+    payload: ResourceCreate,
+    auth=Depends(get_current_user_sync),
+    conn=Depends(db.get_conn),
+):
     """
     Only 'coach' or 'admin' can create resources.
     `auth` looks like: {"session": ..., "user": ...}
@@ -108,42 +112,41 @@ def create_resource(payload: ResourceCreate, auth=Depends(get_current_user)):
     if role not in ("coach", "admin"):
         raise HTTPException(status_code=403, detail="Only coaches/admins can create resources")
 
-    with db.connect() as conn:
-        # first insert
-        inserted = db.fetchone(
-            conn,
-            """
-            INSERT INTO resources(
-                title, type, url, tags, difficulty,
-                added_by, notes
-            )
-            VALUES (%s,%s,%s,%s,%s,%s,%s)
-            RETURNING id
-            """,
-            [
-                payload.title,
-                payload.type,
-                str(payload.url),
-                payload.tags,
-                payload.difficulty,
-                user_id,
-                payload.notes,
-            ],
+    # first insert
+    inserted = db.fetchone(
+        conn,
+        """
+        INSERT INTO resources(
+            title, type, url, tags, difficulty,
+            added_by, notes
         )
+        VALUES (%s,%s,%s,%s,%s,%s,%s)
+        RETURNING id
+        """,
+        [
+            payload.title,
+            payload.type,
+            str(payload.url),
+            payload.tags,
+            payload.difficulty,
+            user_id,
+            payload.notes,
+        ],
+    )
 
-        # then re-fetch with JOIN to get added_by_name
-        row = db.fetchone(
-            conn,
-            """
-            SELECT
-                r.*,
-                u.full_name AS added_by_name
-            FROM resources r
-            LEFT JOIN users u ON r.added_by = u.id
-            WHERE r.id = %s
-            """,
-            [inserted["id"]],
-        )
+    # then re-fetch with JOIN to get added_by_name
+    row = db.fetchone(
+        conn,
+        """
+        SELECT
+            r.*,
+            u.full_name AS added_by_name
+        FROM resources r
+        LEFT JOIN users u ON r.added_by = u.id
+        WHERE r.id = %s
+        """,
+        [inserted["id"]],
+    )
 
     resource = row_to_resource(row)
 
@@ -159,7 +162,9 @@ def create_resource(payload: ResourceCreate, auth=Depends(get_current_user)):
             "tags": row["tags"] or [],
             "added_by": row["added_by"],
         },
+        conn=conn,
     )
+    conn.commit()
 
     return resource
 
@@ -167,28 +172,33 @@ def create_resource(payload: ResourceCreate, auth=Depends(get_current_user)):
 @router.get("/{resource_id}")
 def get_resource(
     resource_id: int, 
-    auth = Depends(get_current_user) # ensure only logged-in users, don't remove!
+    auth = Depends(get_current_user_sync), # ensure only logged-in users, don't remove!
+    conn = Depends(db.get_conn),
 ):
-    with db.connect() as conn:
-        row = db.fetchone(
-            conn,
-            """
-            SELECT
-                r.*,
-                u.full_name AS added_by_name
-            FROM resources r
-            LEFT JOIN users u ON r.added_by = u.id
-            WHERE r.id = %s
-            """,
-            [resource_id],
-        )
+    row = db.fetchone(
+        conn,
+        """
+        SELECT
+            r.*,
+            u.full_name AS added_by_name
+        FROM resources r
+        LEFT JOIN users u ON r.added_by = u.id
+        WHERE r.id = %s
+        """,
+        [resource_id],
+    )
     if not row:
         raise HTTPException(status_code=404, detail="Resource not found")
     return row_to_resource(row)
 
 
 @router.patch("/{resource_id}")
-def update_resource(resource_id: int, payload: ResourceUpdate, auth=Depends(get_current_user)):
+def update_resource(
+    resource_id: int,
+    payload: ResourceUpdate,
+    auth=Depends(get_current_user_sync),
+    conn=Depends(db.get_conn),
+):
     user = auth["user"]
     role = user.get("role")
     user_id = user["id"]
@@ -206,28 +216,27 @@ def update_resource(resource_id: int, payload: ResourceUpdate, auth=Depends(get_
     cols = ", ".join(f"{k}=%s" for k in data.keys())
     params = list(data.values()) + [resource_id]
 
-    with db.connect() as conn:
-        updated = db.fetchone(
-            conn,
-            f"UPDATE resources SET {cols} WHERE id=%s RETURNING id",
-            params,
-        )
+    updated = db.fetchone(
+        conn,
+        f"UPDATE resources SET {cols} WHERE id=%s RETURNING id",
+        params,
+    )
 
-        if not updated:
-            raise HTTPException(status_code=404, detail="Resource not found")
-
-        row = db.fetchone(
-            conn,
-            """
-            SELECT
-                r.*,
-                u.full_name AS added_by_name
-            FROM resources r
-            LEFT JOIN users u ON r.added_by = u.id
-            WHERE r.id = %s
-            """,
-            [updated["id"]],
-        )
+    if not updated:
+        raise HTTPException(status_code=404, detail="Resource not found")
+
+    row = db.fetchone(
+        conn,
+        """
+        SELECT
+            r.*,
+            u.full_name AS added_by_name
+        FROM resources r
+        LEFT JOIN users u ON r.added_by = u.id
+        WHERE r.id = %s
+        """,
+        [updated["id"]],
+    )
 
     resource = row_to_resource(row)
 
@@ -242,13 +251,19 @@ def update_resource(resource_id: int, payload: ResourceUpdate, auth=Depends(get_
             "type": row["type"],
             "difficulty": row["difficulty"],
         },
+        conn=conn,
     )
+    conn.commit()
 
     return resource
 
 
 @router.delete("/{resource_id}")
-def delete_resource(resource_id: int, auth=Depends(get_current_user)):
+def delete_resource(
+    resource_id: int,
+    auth=Depends(get_current_user_sync),
+    conn=Depends(db.get_conn),
+):
     user = auth["user"]
     role = user.get("role")
     user_id = user["id"]
@@ -256,18 +271,17 @@ def delete_resource(resource_id: int, auth=Depends(get_current_user)):
     if role not in ("coach", "admin"):
         raise HTTPException(status_code=403, detail="Only coaches/admins can delete resources")
 
-    with db.connect() as conn:
-        # Fetch before deleting for logging purposes
-        row = db.fetchone(
-            conn,
-            "SELECT * FROM resources WHERE id=%s",
-            [resource_id],
-        )
+    # Fetch before deleting for logging purposes
+    row = db.fetchone(
+        conn,
+        "SELECT * FROM resources WHERE id=%s",
+        [resource_id],
+    )
 
-        if not row:
-            raise HTTPException(status_code=404, detail="Resource not found")
+    if not row:
+        raise HTTPException(status_code=404, detail="Resource not found")
 
-        count = db.execute(conn, "DELETE FROM resources WHERE id=%s", [resource_id])
+    count = db.execute(conn, "DELETE FROM resources WHERE id=%s", [resource_id], commit=False)
 
     add_audit_log(
         actor_user_id=user_id,
@@ -281,6 +295,8 @@ def delete_resource(resource_id: int, auth=Depends(get_current_user)):
             "tags": row["tags"] or [],
             "added_by": row["added_by"],
         },
+        conn=conn,
     )
+    conn.commit()
 
     return {"deleted": True}
\ No newline at end of file
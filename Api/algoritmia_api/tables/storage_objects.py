@@ -0,0 +1,104 @@
+"""
+Reference counts for content-addressed R2 objects.
+
+An object is keyed by its SHA-256, so the same bytes uploaded twice share one
+object and one row here. `refcount` is the number of DB rows pointing at it
+(users.profile_image_url / events.image_url and their variants): it is bumped
+in the same transaction that stores the URL and decremented once the URL has
+been replaced or removed. `touched_at` is refreshed on every upload / retain so
+an object that was just (re)uploaded is never deleted under a request that is
+about to reference it.
+"""
+
+from typing import Iterable, Optional
+
+from .. import db
+
+DDL = """
+CREATE TABLE IF NOT EXISTS storage_objects (
+    key TEXT PRIMARY KEY,
+    sha256 TEXT NOT NULL,
+    size BIGINT,
+    content_type TEXT,
+    refcount INT NOT NULL DEFAULT 0 CHECK (refcount >= 0),
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    touched_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+"""
+
+# Unreferenced objects, oldest first (release / garbage collection)
+DDL_IDX_UNREFERENCED = """
+CREATE INDEX IF NOT EXISTS idx_storage_objects_unreferenced
+ON storage_objects (touched_at)
+WHERE refcount = 0;
+"""
+
+
+def ensure_table(conn) -> None:
+    with conn.cursor() as cur:
+        cur.execute(DDL)
+        cur.execute(DDL_IDX_UNREFERENCED)
+    conn.commit()
+
+
+def touch(conn, key: str, sha256: str, size: Optional[int], content_type: Optional[str]) -> None:
+    """
+    Record an upload of `key` (not committed). Blocks while a release of the same
+    key holds its row lock, so afterwards the object is either kept or already gone.
+    """
+    db.execute(
+        conn,
+        """
+        INSERT INTO storage_objects(key, sha256, size, content_type)
+        VALUES (%s,%s,%s,%s)
+        ON CONFLICT (key) DO UPDATE SET touched_at = NOW()
+        """,
+        [key, sha256, size, content_type],
+        commit=False,
+    )
+
+
+def retain(conn, keys: Iterable[str]) -> None:
+    """One more DB reference to each tracked key (not committed). Untracked keys are ignored."""
+    keys = sorted({k for k in keys if k})
+    if keys:
+        db.execute(
+            conn,
+            "UPDATE storage_objects SET refcount = refcount + 1, touched_at = NOW() WHERE key = ANY(%s)",
+            [keys],
+            commit=False,
+        )
+
+
+def lock_for_release(conn, key: str) -> Optional[dict]:
+    """Row of `key`, locked until the caller's transaction ends; None if untracked."""
+    return db.fetchone(
+        conn,
+        "SELECT key, refcount, touched_at FROM storage_objects WHERE key=%s FOR UPDATE",
+        [key],
+    )
+
+
+def lock_if_unreferenced(conn, key: str, grace: int) -> bool:
+    """
+    Lock `key` for deletion if it is still unreferenced and untouched for `grace`
+    seconds. Doesn't wait: False if another transaction holds the row.
+    """
+    row = db.fetchone(
+        conn,
+        """
+        SELECT 1 FROM storage_objects
+        WHERE key=%s AND refcount = 0 AND touched_at <= NOW() - make_interval(secs => %s)
+        FOR UPDATE SKIP LOCKED
+        """,
+        [key, grace],
+    )
+    return row is not None
+
+
+def set_refcount(conn, key: str, refcount: int) -> None:
+    db.execute(conn, "UPDATE storage_objects SET refcount=%s WHERE key=%s", [refcount, key], commit=False)
+
+
+def forget(conn, key: str) -> None:
+    db.execute(conn, "DELETE FROM storage_objects WHERE key=%s", [key], commit=False)
@@ -2,22 +2,49 @@ from datetime import date
 from typing import Optional, Literal
 
 from fastapi import APIRouter, HTTPException, Query, UploadFile, File, Depends
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel, EmailStr, Field
-from passlib.hash import argon2
 
 from pathlib import Path
 import secrets, hashlib, string, re
-import os
 import json
-import urllib.request
-import urllib.error
+import os
 
-from .. import db
-from .auth import get_current_user
+from .. import db, db_async
+from ..codeforces import validate_codeforces_handle_exists
+from ..passwords import verify_password
+from .auth import get_current_user, get_current_user_sync, invalidate_session_cache
 from .audit_logs import add_audit_log
-from ..r2_client import upload_file_obj, delete_object, get_key_from_url
-
-CF_HANDLE_RE = re.compile(r"^[A-Za-z0-9_\-]{1,24}$")
+from ..r2_client import (
+    upload_content_addressed_async,
+    delete_object,
+    discard_object,
+    retain_urls,
+    get_key_from_url,
+    public_url,
+    download_object,
+    StorageBusy,
+    StorageTimeout,
+)
+from ..image_processing import (
+    store_variants,
+    delete_variants,
+    image_tempfile,
+    copy_to_tempfile,
+    AVATAR_VARIANT_SIZES,
+)
+from ..image_uploads import (
+    open_image_upload,
+    too_large_error,
+    presign_image_upload,
+    verify_uploaded_image,
+    PresignRequest,
+    FinalizeUpload,
+    UploadTooLarge,
+    UPLOAD_MAX_AVATAR_BYTES,
+    AVATAR_TYPES,
+    EXTENSIONS,
+)
 
 router = APIRouter(prefix="/users", tags=["Users"])
 
@@ -44,9 +71,15 @@ CREATE TABLE IF NOT EXISTS users (
 );
 """
 
+# Resized WebP copies of the avatar: {"64": url, "256": url, ...}
+DDL_PROFILE_IMAGE_VARIANTS = """
+ALTER TABLE users ADD COLUMN IF NOT EXISTS profile_image_variants JSONB;
+"""
+
 def ensure_table(conn) -> None:
     with conn.cursor() as cur:
         cur.execute(DDL)
+        cur.execute(DDL_PROFILE_IMAGE_VARIANTS)
     conn.commit()
 
 
@@ -118,54 +151,11 @@ def _validate_birthdate_before_today(birthdate: date) -> None:
             detail="La fecha de nacimiento debe ser anterior a hoy.",
         )
 
-def _validate_codeforces_handle_exists(handle: str) -> None:
-    # Basic format validation
-    if not CF_HANDLE_RE.fullmatch(handle):
-        raise HTTPException(
-            status_code=422,
-            detail=(
-                "El handle de Codeforces debe tener entre 3 y 24 caracteres "
-                "(letras, dígitos, '_' o '-')."
-            ),
-        )
-
-    url = f"https://codeforces.com/api/user.info?handles={handle}"
-
-    try:
-        # timeout in seconds
-        with urllib.request.urlopen(url, timeout=5) as resp:
-            raw = resp.read().decode("utf-8")
-    except (urllib.error.URLError, urllib.error.HTTPError):
-        # Treat this as an external service issue, not a bad handle syntax
-        raise HTTPException(
-            status_code=503,
-            detail=(
-                "No se pudo contactar a Codeforces para verificar tu handle. "
-                "Intenta de nuevo más tarde."
-            ),
-        )
-
-    try:
-        data = json.loads(raw)
-    except json.JSONDecodeError:
-        raise HTTPException(
-            status_code=503,
-            detail="Respuesta inválida de Codeforces al verificar tu handle.",
-        )
-
-    # Codeforces semantics:
-    # OK   → handle exists, data["result"] is a list with one user
-    # FAILED → handle does not exist (or other error)
-    if data.get("status") != "OK":
-        raise HTTPException(
-            status_code=422,
-            detail=f"El usuario de Codeforces '{handle}' no existe.",
-        )
-
 @router.get("")
 def list_users(
     q: Optional[str] = Query(None, description="Search by name or email"),
-    auth_ctx = Depends(get_current_user),
+    auth_ctx = Depends(get_current_user_sync),
+    conn = Depends(db.get_conn),
 ):
     # Only coaches/admins can list the whole user base
     _ensure_role(auth_ctx, {"admin"})
@@ -177,19 +167,18 @@ def list_users(
         like = f"%{q}%"
         params.extend([like, like])
     sql += " ORDER BY created_at DESC LIMIT 200"
-    with db.connect() as conn:
-        rows = db.fetchall(conn, sql, params)
+    rows = db.fetchall(conn, sql, params)
     return {"items": rows}
 
 
 @router.get("/public-leaderboard")
-def get_public_leaderboard_users():
+async def get_public_leaderboard_users():
     """
     Public endpoint used by the Codeforces leaderboard.
     Returns only the minimal fields needed, WITHOUT email or role.
     """
-    with db.connect() as conn:
-        rows = db.fetchall(
+    async with db_async.connect() as conn:
+        rows = await db_async.fetchall(
             conn,
             """
             SELECT
@@ -197,7 +186,8 @@ def get_public_leaderboard_users():
                 preferred_name,
                 codeforces_handle,
                 country,
-                profile_image_url
+                profile_image_url,
+                profile_image_variants
             FROM users
             WHERE codeforces_handle IS NOT NULL
             ORDER BY created_at DESC
@@ -209,13 +199,13 @@ def get_public_leaderboard_users():
 @router.get("/by-email")
 def get_user_by_email(
     email: EmailStr,
-    auth_ctx = Depends(get_current_user),
+    auth_ctx = Depends(get_current_user_sync),
+    conn = Depends(db.get_conn),
 ):
     # Only admins can look up arbitrary users by email
     _ensure_role(auth_ctx, {"admin"})
 
-    with db.connect() as conn:
-        row = db.fetchone(conn, "SELECT * FROM users WHERE email=%s", [str(email)])
+    row = db.fetchone(conn, "SELECT * FROM users WHERE email=%s", [str(email)])
     if not row:
         raise HTTPException(status_code=404, detail="User not found")
     return row
@@ -224,7 +214,8 @@ def get_user_by_email(
 @router.post("")
 def create_user(
     payload: UserCreate,
-    auth_ctx = Depends(get_current_user),
+    auth_ctx = Depends(get_current_user_sync),
+    conn = Depends(db.get_conn),
 ):
     # Only admins can create arbitrary users
     _ensure_role(auth_ctx, {"admin"})
@@ -243,31 +234,30 @@ def create_user(
         payload.grad_month,
     )
 
-    with db.connect() as conn:
-        sql = (
-            "INSERT INTO users (full_name, preferred_name, email, codeforces_handle, birthdate, degree_program, "
-            "entry_year, entry_month, grad_year, grad_month, country, profile_image_url, role) "
-            "VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s) RETURNING *"
-        )
-        row = db.fetchone(
-            conn,
-            sql,
-            [
-                payload.full_name,
-                payload.preferred_name,
-                str(payload.email),
-                payload.codeforces_handle,
-                payload.birthdate,
-                payload.degree_program,
-                payload.entry_year,
-                payload.entry_month,
-                payload.grad_year,
-                payload.grad_month,
-                payload.country,
-                payload.profile_image_url,
-                payload.role,  # safe because only admins reach here
-            ],
-        )
+    sql = (
+        "INSERT INTO users (full_name, preferred_name, email, codeforces_handle, birthdate, degree_program, "
+        "entry_year, entry_month, grad_year, grad_month, country, profile_image_url, role) "
+        "VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s) RETURNING *"
+    )
+    row = db.fetchone(
+        conn,
+        sql,
+        [
+            payload.full_name,
+            payload.preferred_name,
+            str(payload.email),
+            payload.codeforces_handle,
+            payload.birthdate,
+            payload.degree_program,
+            payload.entry_year,
+            payload.entry_month,
+            payload.grad_year,
+            payload.grad_month,
+            payload.country,
+            payload.profile_image_url,
+            payload.role,  # safe because only admins reach here
+        ],
+    )
 
     add_audit_log(
         actor_user_id=admin_id,
@@ -281,7 +271,9 @@ def create_user(
             "degree_program": row["degree_program"],
             "country": row["country"],
         },
+        conn=conn,
     )
+    conn.commit()
 
     return row
 
@@ -289,7 +281,8 @@ def create_user(
 @router.patch("/me")
 def update_me(
     payload: UserUpdate,
-    auth_ctx = Depends(get_current_user),
+    auth_ctx = Depends(get_current_user_sync),
+    conn = Depends(db.get_conn),
 ):
     """
     Update the currently authenticated user's profile fields.
@@ -312,14 +305,13 @@ def update_me(
         old_cf = (user.get("codeforces_handle") or "").strip()
 
         if new_cf and new_cf != old_cf:
-            _validate_codeforces_handle_exists(new_cf)
+            validate_codeforces_handle_exists(new_cf)
 
-            with db.connect() as conn:
-                existing = db.fetchone(
-                    conn,
-                    "SELECT id FROM users WHERE codeforces_handle=%s AND id<>%s",
-                    [new_cf, user_id],
-                )
+            existing = db.fetchone(
+                conn,
+                "SELECT id FROM users WHERE codeforces_handle=%s AND id<>%s",
+                [new_cf, user_id],
+            )
             if existing:
                 raise HTTPException(
                     status_code=409,
@@ -359,12 +351,11 @@ def update_me(
     cols = ", ".join(f"{k}=%s" for k in fields.keys())
     params = list(fields.values()) + [user_id]
 
-    with db.connect() as conn:
-        row = db.fetchone(
-            conn,
-            f"UPDATE users SET {cols} WHERE id=%s RETURNING *",
-            params,
-        )
+    row = db.fetchone(
+        conn,
+        f"UPDATE users SET {cols} WHERE id=%s RETURNING *",
+        params,
+    )
 
     if not row:
         raise HTTPException(status_code=404, detail="User not found")
@@ -380,11 +371,74 @@ def update_me(
             "degree_program": row["degree_program"],
             "country": row["country"],
         },
+        conn=conn,
     )
+    conn.commit()
+    invalidate_session_cache(user_id=user_id)
 
     return row
 
 
+def _save_avatar_url(
+    conn, user_id: int, url: str, key: str, content_type: str, variants: dict[str, str]
+) -> tuple[dict, dict]:
+    """
+    Point users.profile_image_url / profile_image_variants at the new upload;
+    returns (updated row, previous row) so the caller can delete the old objects.
+    """
+    old = db.fetchone(
+        conn,
+        "SELECT profile_image_url, profile_image_variants FROM users WHERE id=%s",
+        [user_id],
+    )
+    if not old:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    old_url = old["profile_image_url"]
+
+    updated = db.fetchone(
+        conn,
+        """
+        UPDATE users SET profile_image_url = %s, profile_image_variants = %s::jsonb
+        WHERE id=%s RETURNING profile_image_url, profile_image_variants
+        """,
+        [url, json.dumps(variants), user_id],
+    )
+
+    add_audit_log(
+        actor_user_id=user_id,
+        action="user.avatar.upload",
+        entity_table="users",
+        entity_id=user_id,
+        metadata={
+            "new_profile_image_url": updated["profile_image_url"],
+            "old_profile_image_url": old_url,
+            "content_type": content_type,
+            "key": key,
+            "variants": sorted(variants, key=int),
+        },
+        conn=conn,
+    )
+    retain_urls(conn, [url, *variants.values()])
+    conn.commit()
+    return updated, old
+
+
+def _save_avatar_url_own_conn(*args) -> tuple[dict, dict]:
+    """_save_avatar_url on a short-lived connection, for routes that hold none during the upload."""
+    with db.connect() as conn:
+        return _save_avatar_url(conn, *args)
+
+
+def _delete_old_avatar(old: dict, keep_key: Optional[str] = None) -> None:
+    """Best-effort removal of a replaced / deleted avatar and its variants from R2."""
+    delete_variants(old["profile_image_variants"])
+    if old["profile_image_url"]:
+        old_key = get_key_from_url(old["profile_image_url"])
+        if old_key and old_key != keep_key:
+            delete_object(old_key)
+
+
 @router.post("/me/avatar")
 async def upload_avatar(
     file: UploadFile = File(...),
@@ -392,104 +446,148 @@ async def upload_avatar(
 ):
     """
     Upload a profile picture for the current user to R2.
-    - Uploads to R2
-    - Updates profile_image_url in DB
-    - Deletes the previous R2 object (if any)
+    - Uploads to R2, plus resized WebP variants
+    - Updates profile_image_url / profile_image_variants in DB
+    - Deletes the previous R2 objects (if any)
     """
     user = auth_ctx["user"]
     user_id = user["id"]
 
-    if file.content_type not in {"image/jpeg", "image/png", "image/webp"}:
-        raise HTTPException(status_code=400, detail="Formato de imagen no soportado.")
-
-    ext_map = {
-        "image/jpeg": ".jpg",
-        "image/png": ".png",
-        "image/webp": ".webp",
-    }
-    ext = ext_map.get(file.content_type, ".jpg")
-
-    random_part = secrets.token_hex(8)
-    key = f"avatars/user_{user_id}_{random_part}{ext}"
-
-    # We need the raw file-like object for upload_file_obj
-    contents = await file.read()
+    reader, content_type = open_image_upload(
+        file, max_bytes=UPLOAD_MAX_AVATAR_BYTES, allowed=AVATAR_TYPES
+    )
 
+    # Content-addressed: avatars/<sha256>.<ext>, skipped if those bytes are already stored
     try:
-        from io import BytesIO
-        url = upload_file_obj(BytesIO(contents), key=key, content_type=file.content_type)
+        key, url = await upload_content_addressed_async(
+            reader, "avatars/", EXTENSIONS[content_type], content_type
+        )
+    except UploadTooLarge:
+        raise too_large_error(UPLOAD_MAX_AVATAR_BYTES)
+    except StorageBusy:
+        raise HTTPException(status_code=503, detail="Demasiadas subidas en curso. Intenta de nuevo en unos segundos.")
+    except StorageTimeout:
+        raise HTTPException(status_code=504, detail="La subida a R2 tardó demasiado.")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error subiendo avatar a R2: {e!r}")
 
-    with db.connect() as conn:
-        row = db.fetchone(
-            conn,
-            "SELECT profile_image_url FROM users WHERE id=%s",
-            [user_id],
-        )
-        if not row:
-            raise HTTPException(status_code=404, detail="User not found")
+    # Already size-checked by the streaming upload; the pool reads it from a temp file
+    with image_tempfile() as tmp:
+        await run_in_threadpool(copy_to_tempfile, file.file, tmp)
+        try:
+            variants = await run_in_threadpool(
+                store_variants, key, tmp.name, sizes=AVATAR_VARIANT_SIZES, square=True
+            )
+        except HTTPException:
+            await run_in_threadpool(discard_object, key)
+            raise
+
+    # No connection is held during the upload and rendering; one is taken only to
+    # save the result. The DB helpers are sync: keep them off the event loop too
+    updated, old = await run_in_threadpool(
+        _save_avatar_url_own_conn, user_id, url, key, content_type, variants
+    )
+    invalidate_session_cache(user_id=user_id)
 
-        old_url = row["profile_image_url"]
+    # Delete old avatar from R2 only once the new URL is committed
+    await run_in_threadpool(_delete_old_avatar, old)
 
-        updated = db.fetchone(
-            conn,
-            "UPDATE users SET profile_image_url = %s WHERE id=%s RETURNING profile_image_url",
-            [url, user_id],
-        )
+    return {
+        "profile_image_url": updated["profile_image_url"],
+        "profile_image_variants": updated["profile_image_variants"],
+    }
 
-    # Delete old avatar from R2 if possible
-    if old_url:
-        old_key = get_key_from_url(old_url)
-        if old_key:
-            delete_object(old_key)
 
-    add_audit_log(
-        actor_user_id=user_id,
-        action="user.avatar.upload",
-        entity_table="users",
-        entity_id=user_id,
-        metadata={
-            "new_profile_image_url": updated["profile_image_url"],
-            "old_profile_image_url": old_url,
-            "content_type": file.content_type,
-            "key": key,
-        },
+@router.post("/me/avatar/presign")
+def presign_avatar_upload(
+    payload: PresignRequest,
+    auth_ctx = Depends(get_current_user),
+):
+    """
+    Direct-to-R2 avatar upload, step 1: returns a presigned PUT URL. The client
+    uploads the file there, then calls /users/me/avatar/finalize with the key.
+    """
+    user_id = auth_ctx["user"]["id"]
+    return presign_image_upload(
+        payload,
+        key_prefix=f"avatars/user_{user_id}_",
+        max_bytes=UPLOAD_MAX_AVATAR_BYTES,
+        allowed=AVATAR_TYPES,
+    )
+
+
+@router.post("/me/avatar/finalize")
+def finalize_avatar_upload(
+    payload: FinalizeUpload,
+    auth_ctx = Depends(get_current_user),
+):
+    """
+    Direct-to-R2 avatar upload, step 2: checks the uploaded object and makes it
+    the user's profile picture (same bookkeeping as POST /users/me/avatar).
+    Like that route, it holds no connection while the variants are rendered.
+    """
+    user_id = auth_ctx["user"]["id"]
+
+    content_type = verify_uploaded_image(
+        payload.key,
+        key_prefix=f"avatars/user_{user_id}_",
+        max_bytes=UPLOAD_MAX_AVATAR_BYTES,
+        allowed=AVATAR_TYPES,
     )
 
-    return {"profile_image_url": updated["profile_image_url"]}
+    # Streamed to a temp file for the pool, never read into memory
+    with image_tempfile() as tmp:
+        try:
+            download_object(payload.key, tmp)
+        except StorageBusy:
+            raise HTTPException(status_code=503, detail="Demasiadas subidas en curso. Intenta de nuevo en unos segundos.")
+        except StorageTimeout:
+            raise HTTPException(status_code=504, detail="R2 tardó demasiado en responder.")
+        try:
+            variants = store_variants(payload.key, tmp.name, sizes=AVATAR_VARIANT_SIZES, square=True)
+        except HTTPException:
+            discard_object(payload.key)
+            raise
+
+    updated, old = _save_avatar_url_own_conn(
+        user_id, public_url(payload.key), payload.key, content_type, variants
+    )
+    invalidate_session_cache(user_id=user_id)
+
+    _delete_old_avatar(old, keep_key=payload.key)
+
+    return {
+        "profile_image_url": updated["profile_image_url"],
+        "profile_image_variants": updated["profile_image_variants"],
+    }
 
 
 @router.delete("/me/avatar")
-def delete_avatar(auth_ctx = Depends(get_current_user)):
+def delete_avatar(
+    auth_ctx = Depends(get_current_user_sync),
+    conn = Depends(db.get_conn),
+):
     """
     Remove the current user's profile picture (DB and R2 object).
     """
     user = auth_ctx["user"]
     user_id = user["id"]
 
-    with db.connect() as conn:
-        row = db.fetchone(
-            conn,
-            "SELECT profile_image_url FROM users WHERE id=%s",
-            [user_id],
-        )
-        if not row:
-            raise HTTPException(status_code=404, detail="User not found")
-
-        old_url = row["profile_image_url"]
+    old = db.fetchone(
+        conn,
+        "SELECT profile_image_url, profile_image_variants FROM users WHERE id=%s",
+        [user_id],
+    )
+    if not old:
+        raise HTTPException(status_code=404, detail="User not found")
 
-        db.fetchone(
-            conn,
-            "UPDATE users SET profile_image_url = NULL WHERE id=%s RETURNING id",
-            [user_id],
-        )
+    old_url = old["profile_image_url"]
 
-    # Delete from R2 if we can extract the key
-    if old_url:
-        old_key = get_key_from_url(old_url)
-        if old_key:
-            delete_object(old_key)
+    db.fetchone(
+        conn,
+        "UPDATE users SET profile_image_url = NULL, profile_image_variants = NULL WHERE id=%s RETURNING id",
+        [user_id],
+    )
 
     add_audit_log(
         actor_user_id=user_id,
@@ -499,9 +597,15 @@ def delete_avatar(auth_ctx = Depends(get_current_user)):
         metadata={
             "old_profile_image_url": old_url,
         },
+        conn=conn,
     )
+    conn.commit()
+    invalidate_session_cache(user_id=user_id)
+
+    # Delete from R2 if we can extract the keys
+    _delete_old_avatar(old)
 
-    return {"profile_image_url": None}
+    return {"profile_image_url": None, "profile_image_variants": None}
 
 
 @router.delete("/me")
@@ -509,10 +613,14 @@ def delete_me(
     payload: DeleteMePayload,
     auth_ctx = Depends(get_current_user),
 ):
+    """
+    Delete the current account after checking its password. No connection is
+    held while the password is verified in the password pool.
+    """
     user = auth_ctx["user"]
     user_id = user["id"]
 
-    # 1) Verify password and read metadata we want to log
+    # 1) Read the password hash and the metadata we want to log
     with db.connect() as conn:
         row = db.fetchone(
             conn,
@@ -527,41 +635,45 @@ def delete_me(
             [user_id],
         )
 
-        if not row or not row["password_hash"]:
-            raise HTTPException(
-                status_code=400,
-                detail="No se pudo validar la contraseña para esta cuenta.",
-            )
+    if not row or not row["password_hash"]:
+        raise HTTPException(
+            status_code=400,
+            detail="No se pudo validar la contraseña para esta cuenta.",
+        )
 
-        if not argon2.verify(payload.password, row["password_hash"]):
-            raise HTTPException(status_code=403, detail="Contraseña incorrecta.")
+    if not verify_password(payload.password, row["password_hash"]):
+        raise HTTPException(status_code=403, detail="Contraseña incorrecta.")
 
-        # Save metadata before leaving the connection
-        email = row["email"]
-        role = row["role"]
-        codeforces_handle = row["codeforces_handle"]
-        degree_program = row["degree_program"]
-        country = row["country"]
+    with db.connect() as conn:
+        # 2) Write audit log WHILE the user still exists
+        # (so the FK on actor_user_id passes; later the FK's ON DELETE rule can set it to NULL)
+        add_audit_log(
+            actor_user_id=user_id,
+            action="user.self_delete",
+            entity_table="users",
+            entity_id=user_id,
+            metadata={
+                "email": row["email"],
+                "role": row["role"],
+                "codeforces_handle": row["codeforces_handle"],
+                "degree_program": row["degree_program"],
+                "country": row["country"],
+            },
+            conn=conn,
+        )
 
-    # 2) Write audit log WHILE the user still exists
-    # (so the FK on actor_user_id passes; later the FK's ON DELETE rule can set it to NULL)
-    add_audit_log(
-        actor_user_id=user_id,
-        action="user.self_delete",
-        entity_table="users",
-        entity_id=user_id,
-        metadata={
-            "email": email,
-            "role": role,
-            "codeforces_handle": codeforces_handle,
-            "degree_program": degree_program,
-            "country": country,
-        },
-    )
+        # 3) Now delete the user, in the same transaction as its audit row
+        old = db.fetchone(
+            conn,
+            "DELETE FROM users WHERE id=%s RETURNING profile_image_url, profile_image_variants",
+            [user_id],
+        )
+        conn.commit()
+    invalidate_session_cache(user_id=user_id)
 
-    # 3) Now delete the user
-    with db.connect() as conn:
-        db.execute(conn, "DELETE FROM users WHERE id=%s", [user_id])
+    # 4) Release the avatar's storage references only once the delete is committed
+    if old:
+        _delete_old_avatar(old)
 
     return {"deleted": True}
 
@@ -569,7 +681,8 @@ def delete_me(
 @router.get("/{user_id}")
 def get_user(
     user_id: int,
-    auth_ctx = Depends(get_current_user),
+    auth_ctx = Depends(get_current_user_sync),
+    conn = Depends(db.get_conn),
 ):
     current = auth_ctx["user"]
 
@@ -580,8 +693,7 @@ def get_user(
             detail="No tienes permiso para ver este usuario.",
         )
 
-    with db.connect() as conn:
-        row = db.fetchone(conn, "SELECT * FROM users WHERE id=%s", [user_id])
+    row = db.fetchone(conn, "SELECT * FROM users WHERE id=%s", [user_id])
     if not row:
         raise HTTPException(status_code=404, detail="User not found")
     return row
@@ -590,20 +702,20 @@ def get_user(
 @router.delete("/{user_id}")
 def delete_user(
     user_id: int,
-    auth_ctx = Depends(get_current_user),
+    auth_ctx = Depends(get_current_user_sync),
+    conn = Depends(db.get_conn),
 ):
     # Only admins can delete arbitrary users
     _ensure_role(auth_ctx, {"admin"})
     admin = auth_ctx["user"]
     admin_id = admin["id"]
 
-    with db.connect() as conn:
-        # Fetch user first for logging purposes
-        row = db.fetchone(conn, "SELECT * FROM users WHERE id=%s", [user_id])
-        if not row:
-            raise HTTPException(status_code=404, detail="User not found")
+    # Fetch user first for logging purposes (and its avatar, released below)
+    row = db.fetchone(conn, "SELECT * FROM users WHERE id=%s", [user_id])
+    if not row:
+        raise HTTPException(status_code=404, detail="User not found")
 
-        count = db.execute(conn, "DELETE FROM users WHERE id=%s", [user_id])
+    count = db.execute(conn, "DELETE FROM users WHERE id=%s", [user_id], commit=False)
 
     add_audit_log(
         actor_user_id=admin_id,
@@ -617,7 +729,14 @@ def delete_user(
             "degree_program": row["degree_program"],
             "country": row["country"],
         },
+        conn=conn,
     )
+    conn.commit()
+    invalidate_session_cache(user_id=user_id)
+
+    # Release the avatar's storage references only once the delete is committed
+    if count:
+        _delete_old_avatar(row)
 
     return {"deleted": True}
 
@@ -0,0 +1,23 @@
+"""
+Tests that need PostgreSQL run against TEST_DATABASE_URL (a throwaway database:
+tables are created and truncated) and are skipped when it isn't set.
+
+  cd Api
+  TEST_DATABASE_URL=postgresql://localhost/algoritmia_test python -m pytest tests
+"""
+
+import os
+import sys
+
+import pytest
+
+# Make algoritmia_api importable the same way `cd Api && python -m ...` does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def database_url() -> str:
+    url = os.getenv("TEST_DATABASE_URL")
+    if not url:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    return url
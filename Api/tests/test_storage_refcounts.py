@@ -0,0 +1,199 @@
+"""
+storage_objects refcounts (r2_client upload / retain / release) and the orphan
+GC that relies on them, against the in-memory storage backend.
+"""
+
+import io
+import hashlib
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from algoritmia_api import db, r2_client, storage_gc
+from algoritmia_api.storage_backends import MemoryBackend
+from algoritmia_api.tables import users, events, resources, contests, storage_objects, audit_logs
+
+
+@pytest.fixture
+def backend(monkeypatch, database_url):
+    monkeypatch.setenv("DATABASE_URL", database_url)
+    with db.connect() as conn:
+        db.ensure_extensions(conn)
+        for mod in (users, events, resources, contests, storage_objects, audit_logs):
+            mod.ensure_table(conn)
+        db.execute(conn, "TRUNCATE storage_objects, resources, users CASCADE")
+
+    memory = MemoryBackend()
+    r2_client.set_backend(memory)
+    monkeypatch.setattr(r2_client, "R2_DEDUP", True)
+    monkeypatch.setattr(r2_client, "R2_DEDUP_GRACE", 0)
+    yield memory
+    r2_client.set_backend(None)
+
+
+def _refcount(key: str):
+    """refcount of `key`, or None once its row is gone."""
+    with db.connect() as conn:
+        row = db.fetchone(conn, "SELECT refcount FROM storage_objects WHERE key=%s", [key])
+    return row["refcount"] if row else None
+
+
+def _upload(data: bytes) -> tuple[str, str]:
+    """Upload content-addressed and store one reference, as the avatar / banner routes do."""
+    key, url = r2_client.upload_content_addressed(io.BytesIO(data), "avatars/", "png", "image/png")
+    with db.connect() as conn:
+        r2_client.retain_urls(conn, [url])
+        conn.commit()
+    return key, url
+
+
+def _add_user(email: str, role: str = "user") -> int:
+    with db.connect() as conn:
+        row = db.fetchone(
+            conn,
+            """
+            INSERT INTO users(full_name, preferred_name, email, codeforces_handle, birthdate,
+                              degree_program, entry_year, entry_month, grad_year, grad_month,
+                              country, role)
+            VALUES (%s,%s,%s,%s,'2000-01-01','ISC',2020,8,2024,6,'mx',%s)
+            RETURNING id
+            """,
+            [email, email, email, email, role],
+        )
+    return row["id"]
+
+
+def _age(memory: MemoryBackend, key: str, days: int = 2) -> None:
+    data, content_type, _ = memory._objects[key]
+    memory._objects[key] = (data, content_type, datetime.now(timezone.utc) - timedelta(days=days))
+
+
+def test_same_bytes_share_one_object(backend):
+    key, _ = _upload(b"same bytes")
+    again, _ = _upload(b"same bytes")
+
+    assert again == key == f"avatars/{hashlib.sha256(b'same bytes').hexdigest()}.png"
+    assert list(backend._objects) == [key]
+    assert _refcount(key) == 2
+
+    r2_client.delete_object(key)
+    assert _refcount(key) == 1
+    assert backend.head(key) is not None
+
+
+def test_upload_replace_delete_leaves_nothing(backend):
+    old_key, _ = _upload(b"first avatar")
+
+    # Replace: reference the new upload, then drop the old one
+    new_key, _ = _upload(b"second avatar")
+    r2_client.delete_object(old_key)
+    assert _refcount(old_key) is None
+    assert backend.head(old_key) is None
+    assert _refcount(new_key) == 1
+
+    # Delete
+    r2_client.delete_object(new_key)
+    assert _refcount(new_key) is None
+    assert backend._objects == {}
+
+
+def test_deleting_a_user_releases_its_avatar(backend):
+    admin_id = _add_user("admin@up.edu.mx", role="admin")
+    user_id = _add_user("ana@up.edu.mx")
+
+    key, url = _upload(b"avatar")
+    variant_key = key.replace(".png", "_64.webp")
+    variant_url = r2_client.upload_file_obj(io.BytesIO(b"webp"), key=variant_key, track=True)
+    with db.connect() as conn:
+        r2_client.retain_urls(conn, [variant_url])
+        db.execute(
+            conn,
+            "UPDATE users SET profile_image_url=%s, profile_image_variants=%s::jsonb WHERE id=%s",
+            [url, f'{{"64": "{variant_url}"}}', user_id],
+        )
+
+    with db.connect() as conn:
+        users.delete_user(user_id, auth_ctx={"user": {"id": admin_id, "role": "admin"}}, conn=conn)
+
+    assert _refcount(key) is None and _refcount(variant_key) is None
+    assert backend._objects == {}
+
+
+def test_release_within_grace_keeps_object(backend, monkeypatch):
+    monkeypatch.setattr(r2_client, "R2_DEDUP_GRACE", 3600)
+    key, _ = _upload(b"just uploaded")
+
+    r2_client.delete_object(key)
+
+    # Unreferenced, but left for the GC until the grace period is over
+    assert _refcount(key) == 0
+    assert backend.head(key) is not None
+
+
+def test_failed_delete_keeps_the_decrement(backend, monkeypatch):
+    key, _ = _upload(b"r2 is down")
+
+    def fail(_key):
+        raise RuntimeError("R2 down")
+
+    monkeypatch.setattr(backend, "delete", fail)
+    r2_client.delete_object(key)
+
+    assert _refcount(key) == 0
+    assert backend.head(key) is not None
+
+
+def test_row_locked_elsewhere_is_not_claimed(backend):
+    key, _ = _upload(b"busy")
+    with db.connect() as conn:
+        db.execute(
+            conn,
+            "UPDATE storage_objects SET refcount=0, touched_at=NOW() - interval '1 hour' WHERE key=%s",
+            [key],
+        )
+
+    # A concurrent release (or touch) holds the row: the delete claim skips it
+    with db.connect() as holder, db.connect() as other:
+        storage_objects.lock_for_release(holder, key)
+        assert not storage_objects.lock_if_unreferenced(other, key, 0)
+        holder.rollback()
+        assert storage_objects.lock_if_unreferenced(other, key, 0)
+
+
+def test_gc_keeps_referenced_and_recent_keys(backend):
+    # Referenced by a DB row (a resource URL)
+    linked = "avatars/linked.png"
+    backend.put(io.BytesIO(b"linked"), linked, "image/png")
+    with db.connect() as conn:
+        db.execute(
+            conn,
+            "INSERT INTO resources(title, type, url) VALUES (%s, %s, %s)",
+            ["Guía", "pdf", r2_client.public_url(linked)],
+        )
+
+    # Refcounted and in use
+    counted, _ = _upload(b"counted")
+
+    # Unreferenced, but touched within the grace period
+    touched = "avatars/touched.png"
+    backend.put(io.BytesIO(b"touched"), touched, "image/png")
+    with db.connect() as conn:
+        storage_objects.touch(conn, touched, "0" * 64, 7, "image/png")
+        conn.commit()
+
+    # Nothing points at it
+    orphan = "avatars/orphan.png"
+    backend.put(io.BytesIO(b"orphan"), orphan, "image/png")
+
+    for key in (linked, counted, touched, orphan):
+        _age(backend, key)
+
+    dry = storage_gc.collect_garbage(dry_run=True, grace=3600, prefixes=("avatars/",))
+    assert dry["orphans"] == 1 and dry["sample"] == [orphan]
+    assert backend.head(orphan) is not None
+
+    report = storage_gc.collect_garbage(dry_run=False, grace=3600, prefixes=("avatars/",))
+    assert report["deleted"] == 1 and report["failed"] == 0
+    assert sorted(backend._objects) == sorted([linked, counted, touched])
+    assert _refcount(counted) == 1
+    assert _refcount(touched) == 0
@@ -1,16 +1,28 @@
 "use client";
 
-import { useEffect, useMemo, useState } from "react";
+import { useEffect, useState } from "react";
 import Image from "next/image";
 import Link from "next/link";
 import { API_BASE } from "@/lib/api";
 
-type AlgoritmiaUser = {
+// Row returned by GET /leaderboard (already ranked server-side)
+type LeaderboardRow = {
   id: number;
   preferred_name: string;
-  codeforces_handle?: string | null;
   country: string;
   profile_image_url?: string | null;
+  handle: string;
+  rating: number;
+  max_rating?: number | null;
+  rank: number;
+};
+
+type LeaderboardResponse = {
+  items: LeaderboardRow[];
+  total: number;
+  page: number;
+  page_size: number;
+  last_synced_at: string | null;
 };
 
 export type Member = {
@@ -21,25 +33,32 @@ export type Member = {
   rating: number;
   maxRating?: number;
   avatarUrl?: string | null;
+  rank: number;
 };
 
-type UsersResponse = {
-  items: AlgoritmiaUser[];
-};
-
-// Shape of Codeforces response
-type CodeforcesUser = {
-  handle: string;
-  rating?: number;
-  maxRating?: number;
-  country?: string;
-};
-
-type CodeforcesResponse = {
-  status: "OK" | "FAILED";
-  comment?: string;
-  result?: CodeforcesUser[];
-};
+const PAGE_SIZE = 50;
+
+function toMember(row: LeaderboardRow): Member {
+  const avatarUrl = row.profile_image_url
+    ? row.profile_image_url.startsWith("http")
+      ? row.profile_image_url
+      : `${API_BASE}${row.profile_image_url}`
+    : null;
+
+  const countryCode =
+    row.country && row.country.length === 2 ? row.country.toUpperCase() : "XX";
+
+  return {
+    id: String(row.id),
+    handle: row.handle,
+    name: row.preferred_name,
+    countryCode,
+    rating: row.rating,
+    maxRating: row.max_rating ?? undefined,
+    avatarUrl,
+    rank: row.rank,
+  };
+}
 
 function ratingColor(r: number): string {
   if (r >= 4000) return "text-black"; // black (tourist black)
@@ -78,27 +97,14 @@ function formatDateTime(dt: Date): string {
   });
 }
 
-// Calculate ranks with ties (1,2,2,4 ...)
-function rankMembers(members: Member[]): Array<Member & { rank: number }> {
-  const sorted = [...members].sort((a, b) => b.rating - a.rating);
-  let rank = 0;
-  let lastRating = Infinity;
-  let count = 0;
-  return sorted.map((m) => {
-    count += 1;
-    if (m.rating !== lastRating) {
-      rank = count;
-      lastRating = m.rating;
-    }
-    return { ...m, rank };
-  });
-}
-
 // --- Component
 export default function Leaderboard() {
   const [currentUserId, setCurrentUserId] = useState<string | null>(null);
   const [query, setQuery] = useState("");
   const [members, setMembers] = useState<Member[]>([]);
+  const [total, setTotal] = useState(0);
+  const [page, setPage] = useState(1);
+  const [search, setSearch] = useState("");
   const [lastSynced, setLastSynced] = useState<Date | null>(null);
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState<string | null>(null);
@@ -114,8 +120,16 @@ export default function Leaderboard() {
       .catch(() => {});
   }, []);
 
-
-  // Fetch Algoritmia users + Codeforces info
+  // Debounce the search box before asking the server
+  useEffect(() => {
+    const t = setTimeout(() => {
+      setSearch(query.trim());
+      setPage(1);
+    }, 300);
+    return () => clearTimeout(t);
+  }, [query]);
+
+  // Ratings are synced from Codeforces by the backend; we only read the ranked table
   useEffect(() => {
     let cancelled = false;
 
@@ -124,96 +138,31 @@ export default function Leaderboard() {
       setError(null);
 
       try {
-        // 1) Get all Algoritmia UP users
-        const res = await fetch(`${API_BASE}/users/public-leaderboard`, {
+        const params = new URLSearchParams({
+          page: String(page),
+          page_size: String(PAGE_SIZE),
+        });
+        if (search) params.set("q", search);
+
+        const res = await fetch(`${API_BASE}/leaderboard?${params}`, {
           credentials: "include",
         });
         if (!res.ok) {
-          throw new Error(`Error al obtener usuarios (${res.status})`);
-        }
-        const data: UsersResponse = await res.json();
-        const users = data.items || [];
-
-        // 2) Extract CF handles
-        const handles = users
-          .map((u) => u.codeforces_handle?.trim())
-          .filter((h): h is string => !!h && h.length > 0);
-
-        if (handles.length === 0) {
-          if (!cancelled) {
-            setMembers([]);
-            setLastSynced(new Date());
-          }
-          return;
-        }
-
-        const joinedHandles = handles.join(";");
-        const cfUrl = `https://codeforces.com/api/user.info?handles=${encodeURIComponent(
-          joinedHandles
-        )}&checkHistoricHandles=false`;
-
-        const cfRes = await fetch(cfUrl);
-        if (!cfRes.ok) {
-          throw new Error(`Error al consultar Codeforces (${cfRes.status})`);
-        }
-        const cfData: CodeforcesResponse = await cfRes.json();
-
-        if (cfData.status !== "OK" || !cfData.result) {
-          throw new Error(
-            cfData.comment || "Codeforces devolvió un estado de error"
-          );
+          throw new Error(`Error al obtener el leaderboard (${res.status})`);
         }
-
-        // 4) Map handle -> Codeforces user
-        const cfByHandle = new Map<string, CodeforcesUser>();
-        for (const u of cfData.result) {
-          cfByHandle.set(u.handle.toLowerCase(), u);
-        }
-
-        // 5) Build Member[] from join (Algoritmia users + CF data)
-        const builtMembers: Member[] = users.flatMap((u) => {
-          const handle = u.codeforces_handle?.trim();
-          if (!handle) return [];
-
-          const cf = cfByHandle.get(handle.toLowerCase());
-          if (!cf) return [];
-
-          const rating = cf.rating ?? 0;
-          const maxRating = cf.maxRating ?? undefined;
-
-          const avatarUrl = u.profile_image_url
-            ? u.profile_image_url.startsWith("http")
-              ? u.profile_image_url
-              : `${API_BASE}${u.profile_image_url}`
-            : null;
-
-          const countryCode =
-            u.country && u.country.length === 2
-              ? u.country.toUpperCase()
-              : "XX";
-
-          return [
-            {
-              id: String(u.id),
-              handle,
-              name: u.preferred_name,
-              countryCode,
-              rating,
-              maxRating,
-              avatarUrl,
-            },
-          ];
-        });
+        const data: LeaderboardResponse = await res.json();
+        const pageMembers = (data.items || []).map(toMember);
 
         if (!cancelled) {
-          setMembers(builtMembers);
-          setLastSynced(new Date());
+          setMembers((prev) => (page === 1 ? pageMembers : [...prev, ...pageMembers]));
+          setTotal(data.total);
+          setLastSynced(data.last_synced_at ? new Date(data.last_synced_at) : null);
         }
       } catch (err) {
         console.error(err);
         if (!cancelled) {
-          setError("No se pudo sincronizar con Codeforces.");
-          setMembers([]);
+          setError("No se pudo cargar el leaderboard.");
+          if (page === 1) setMembers([]);
         }
       } finally {
         if (!cancelled) {
@@ -227,17 +176,7 @@ export default function Leaderboard() {
     return () => {
       cancelled = true;
     };
-  }, []);
-
-  const filtered = useMemo(() => {
-    const q = query.trim().toLowerCase();
-    const base = rankMembers(members);
-    if (!q) return base;
-    return base.filter(
-      (m) =>
-        m.handle.toLowerCase().includes(q) || m.name.toLowerCase().includes(q)
-    );
-  }, [members, query]);
+  }, [page, search]);
 
   return (
     <section
@@ -267,7 +206,7 @@ export default function Leaderboard() {
             </p>
             {loading && (
               <p className="mt-1 text-xs text-white/50">
-                Sincronizando con Codeforces…
+                Cargando leaderboard…
               </p>
             )}
             {error && (
@@ -326,7 +265,7 @@ export default function Leaderboard() {
                 </tr>
               )}
 
-              {!loading && filtered.length === 0 && (
+              {!loading && members.length === 0 && (
                 <tr>
                   <td
                     colSpan={7}
@@ -339,7 +278,7 @@ export default function Leaderboard() {
                 </tr>
               )}
 
-              {filtered.map((m) => (
+              {members.map((m) => (
                 <tr
                   key={m.id}
                   className={`hover:bg-white/5 transition-colors ${
@@ -416,6 +355,19 @@ export default function Leaderboard() {
           </table>
         </div>
 
+        {members.length < total && (
+          <div className="mt-4 flex justify-center">
+            <button
+              type="button"
+              onClick={() => setPage((p) => p + 1)}
+              disabled={loading}
+              className="rounded-xl border border-white/10 bg-white/10 px-4 py-2 text-sm text-white hover:bg-white/20 disabled:opacity-50"
+            >
+              {loading ? "Cargando…" : "Ver más"}
+            </button>
+          </div>
+        )}
+
         <footer className="mt-4 flex flex-col items-start justify-between gap-2 text-sm text-white/70 sm:flex-row sm:items-center">
           <div className="flex items-center gap-2">
             <span className="inline-block h-2 w-2 rounded-full bg-emerald-400" />